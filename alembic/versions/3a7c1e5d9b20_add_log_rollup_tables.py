@@ -0,0 +1,55 @@
+"""add log rollup tables
+
+Revision ID: 3a7c1e5d9b20
+Revises: f541dd128ff8
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3a7c1e5d9b20'
+down_revision: Union[str, Sequence[str], None] = 'f541dd128ff8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+ROLLUP_TABLES = [
+    ('log_daily_rollups', 'day'),
+    ('log_weekly_rollups', 'week_start'),
+    ('log_monthly_rollups', 'month_start'),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for table_name, bucket_column in ROLLUP_TABLES:
+        op.create_table(table_name,
+            sa.Column('user_id', sa.Integer(), nullable=False),
+            sa.Column(bucket_column, sa.Date(), nullable=False),
+            sa.Column('total_minutes', sa.Integer(), nullable=False),
+            sa.Column('log_count', sa.Integer(), nullable=False),
+            sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('user_id', bucket_column)
+        )
+
+    # 既存ログから初期値を作成（日別はSQLで集計、週別・月別は日別から計算）
+    import sys
+    from pathlib import Path
+    sys.path.append(str(Path(__file__).resolve().parents[2]))
+    from sqlalchemy.orm import Session as OrmSession
+    import rollups
+
+    session = OrmSession(bind=op.get_bind())
+    rollups.rebuild_rollups(session)
+    session.flush()
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table_name, _ in reversed(ROLLUP_TABLES):
+        op.drop_table(table_name)
@@ -0,0 +1,61 @@
+"""add normalized tag tables
+
+Revision ID: 7d2f4b8c1a36
+Revises: 3a7c1e5d9b20
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7d2f4b8c1a36'
+down_revision: Union[str, Sequence[str], None] = '3a7c1e5d9b20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('tags',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=100), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'name', name='uq_tags_user_id_name')
+    )
+    op.create_table('log_tags',
+        sa.Column('log_id', sa.Integer(), nullable=False),
+        sa.Column('tag_id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['log_id'], ['logs.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['tag_id'], ['tags.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('log_id', 'tag_id')
+    )
+    op.create_index('ix_log_tags_user_id_tag_id', 'log_tags', ['user_id', 'tag_id'], unique=False)
+    op.create_index('ix_log_tags_tag_id', 'log_tags', ['tag_id'], unique=False)
+
+    # 既存の Log.tags 文字列から関連付けを作成
+    import sys
+    from pathlib import Path
+    sys.path.append(str(Path(__file__).resolve().parents[2]))
+    from sqlalchemy.orm import Session as OrmSession
+    import tagging
+
+    session = OrmSession(bind=op.get_bind())
+    processed = tagging.rebuild_log_tags(session)
+    session.flush()
+    print(f"✅ タグを移行しました（ログ {processed} 件）")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_log_tags_tag_id', table_name='log_tags')
+    op.drop_index('ix_log_tags_user_id_tag_id', table_name='log_tags')
+    op.drop_table('log_tags')
+    op.drop_table('tags')
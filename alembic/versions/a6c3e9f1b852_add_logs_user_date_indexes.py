@@ -0,0 +1,37 @@
+"""add logs user/date indexes
+
+Revision ID: a6c3e9f1b852
+Revises: 9f3a5c7e1d24
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a6c3e9f1b852'
+down_revision: Union[str, Sequence[str], None] = '9f3a5c7e1d24'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(
+        'ix_logs_user_id_date_start_time', 'logs',
+        ['user_id', sa.text('date DESC'), sa.text('start_time DESC'), sa.text('id DESC')]
+    )
+    # PostgreSQL では duration を INCLUDE してカバリングインデックスにする
+    op.create_index(
+        'ix_logs_user_id_date', 'logs', ['user_id', 'date'],
+        postgresql_include=['duration']
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_logs_user_id_date', table_name='logs')
+    op.drop_index('ix_logs_user_id_date_start_time', table_name='logs')
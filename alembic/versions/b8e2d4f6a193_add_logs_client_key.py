@@ -0,0 +1,30 @@
+"""add logs client_key
+
+Revision ID: b8e2d4f6a193
+Revises: a6c3e9f1b852
+Create Date: 2026-10-18 17:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b8e2d4f6a193'
+down_revision: Union[str, Sequence[str], None] = 'a6c3e9f1b852'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('logs', sa.Column('client_key', sa.String(length=64), nullable=True))
+    op.create_index('ux_logs_user_id_client_key', 'logs', ['user_id', 'client_key'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ux_logs_user_id_client_key', table_name='logs')
+    op.drop_column('logs', 'client_key')
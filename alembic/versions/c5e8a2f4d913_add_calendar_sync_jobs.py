@@ -0,0 +1,53 @@
+"""add calendar sync jobs
+
+Revision ID: c5e8a2f4d913
+Revises: 7d2f4b8c1a36
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5e8a2f4d913'
+down_revision: Union[str, Sequence[str], None] = '7d2f4b8c1a36'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # ログごとのカレンダー同期状態
+    op.add_column('logs', sa.Column('calendar_status', sa.String(length=20), nullable=True))
+    op.add_column('logs', sa.Column('calendar_event_link', sa.String(length=500), nullable=True))
+
+    op.create_table('calendar_sync_jobs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('log_id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('calendar_id', sa.String(length=255), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('next_run_at', sa.DateTime(), nullable=False),
+        sa.Column('locked_until', sa.DateTime(), nullable=True),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['log_id'], ['logs.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_calendar_sync_jobs_status_next_run_at', 'calendar_sync_jobs', ['status', 'next_run_at'], unique=False)
+    op.create_index(op.f('ix_calendar_sync_jobs_log_id'), 'calendar_sync_jobs', ['log_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_calendar_sync_jobs_log_id'), table_name='calendar_sync_jobs')
+    op.drop_index('ix_calendar_sync_jobs_status_next_run_at', table_name='calendar_sync_jobs')
+    op.drop_table('calendar_sync_jobs')
+    op.drop_column('logs', 'calendar_event_link')
+    op.drop_column('logs', 'calendar_status')
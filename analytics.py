@@ -0,0 +1,65 @@
+# analytics.py - 作業ログの集計（日別・週別・月別）
+"""
+DB・リクエストに依存しない集計処理。入力はログの (日付, 分) などの iterable、出力は dict。
+rollups.py（ロールアップの一括加算・再集計）から使い、bench/aggregation.py で速度を計測する。
+タグ別の集計は tags / log_tags テーブルに対する SQL で行う（tagging.tag_minutes など）。
+
+日付は date.toordinal() の整数（0001-01-01 が 1 で月曜日）で扱う。
+1行ごとの処理は「日の序数をキーに加算する」だけにし、週・月への振り分けや
+date への変換は日の種類数（数年分でも数千）に対してだけ行う。
+"""
+
+from datetime import date
+
+
+def week_start_ordinal(ordinal):
+    """その日が属する週（月曜始まり）の月曜日の序数"""
+    return ordinal - (ordinal - 1) % 7
+
+
+def day_totals(entries):
+    """
+    [(日付, 分), ...] を日ごとに合算して {日の序数: [分, 件数]} を返す
+    日付は date または序数（int）
+    """
+    totals = {}
+    for day, minutes in entries:
+        ordinal = day if day.__class__ is int else day.toordinal()
+        total = totals.get(ordinal)
+        if total is None:
+            totals[ordinal] = [minutes, 1]
+        else:
+            total[0] += minutes
+            total[1] += 1
+    return totals
+
+
+def bucket_totals(daily):
+    """
+    day_totals() の結果を日別・週別・月別にまとめる
+    戻り値: {'daily': {日付: (分, 件数)}, 'weekly': {週の月曜日: ...}, 'monthly': {月の1日: ...}}
+    """
+    weekly = {}
+    monthly = {}
+    days = {}
+    for ordinal, (minutes, count) in daily.items():
+        day = date.fromordinal(ordinal)
+        days[day] = (minutes, count)
+        for buckets, key in ((weekly, week_start_ordinal(ordinal)), (monthly, (day.year, day.month))):
+            total = buckets.get(key)
+            if total is None:
+                buckets[key] = [minutes, count]
+            else:
+                total[0] += minutes
+                total[1] += count
+
+    return {
+        'daily': days,
+        'weekly': {date.fromordinal(ordinal): tuple(total) for ordinal, total in weekly.items()},
+        'monthly': {date(year, month, 1): tuple(total) for (year, month), total in monthly.items()},
+    }
+
+
+def summarize(entries):
+    """[(日付, 分), ...] を日別・週別・月別に集計する（bucket_totals(day_totals(entries))）"""
+    return bucket_totals(day_totals(entries))
@@ -1,13 +1,11 @@
 # app.py
 import os
 from datetime import datetime, timedelta, date, timezone
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, Response, stream_with_context, abort
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
-from collections import defaultdict
 import json
-import redis
-from email_utils import send_password_reset_email
+import click
 from db import PasswordHistory, PasswordResetToken
 import pytz
 
@@ -16,8 +14,24 @@ from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 
 # db.py からインポート
-from db import Session, Log, User, Base, engine
-from google_calendar import add_event
+from db import Session, Log, User, Base, engine, CalendarSyncJob, CalendarBackfill
+from db import get_request_session, close_request_session
+import calendar_queue
+import calendar_backfill
+import rollups
+import tagging
+import pagination
+import cache
+import user_cache
+import log_import
+import log_export
+import log_sync
+import log_batch
+import dashboard_api
+import db_pool
+import request_metrics
+import prometheus_metrics
+import passwords
 
 # forms.py が存在する場合はインポート（後で作成予定）
 from forms import RegistrationForm, LoginForm
@@ -67,6 +81,9 @@ if not REDIS_URL:
     print("警告: Redis URLが設定されていません。メモリストレージを使用します。")
     REDIS_URL = "memory://"
 
+# 集計APIのレスポンスキャッシュも同じRedisを使う
+cache.init_cache(REDIS_URL)
+
 def get_user_id():
     """ユーザーIDベースのキー関数"""
     if current_user.is_authenticated:
@@ -108,12 +125,19 @@ if os.getenv('RENDER'):
 
 @login_manager.user_loader
 def load_user(user_id):
-    with Session() as session:
-        return session.query(User).get(int(user_id))
+    # 毎リクエストで DB を読まないようにキャッシュ済みのスナップショットを使う
+    return user_cache.load_user_snapshot(int(user_id))
+
+# リクエスト内で共有した DB セッションを返却（接続をプールに戻す）
+app.teardown_appcontext(close_request_session)
+
+# SQL の回数・時間などを Server-Timing ヘッダーで返し、遅いリクエストをログに出す
+request_metrics.init_app(app)
 
 # エラーハンドラー（レート制限エラー用）
 @app.errorhandler(429)
 def ratelimit_handler(e):
+    prometheus_metrics.RATE_LIMITED.labels(request.endpoint or 'none').inc()
     flash('リクエストが多すぎます。しばらく待ってから再度お試しください。', 'warning')
     return render_template('error.html', 
                          error_code=429, 
@@ -129,12 +153,19 @@ def not_found_error(error):
 # 500エラーハンドラー
 @app.errorhandler(500)
 def internal_error(error):
-    with Session() as session:
-        session.rollback()
+    get_request_session().rollback()
     return render_template('error.html', 
                          error_code=500, 
                          error_message="サーバーエラーが発生しました"), 500
 
+# パスワードのハッシュ計算が混雑して時間内に終わらなかった（ログイン・登録・パスワード変更など）
+@app.errorhandler(passwords.PasswordServiceBusy)
+def password_service_busy(error):
+    get_request_session().rollback()
+    return render_template('error.html',
+                         error_code=503,
+                         error_message="ただいま混雑しています"), 503, {'Retry-After': '5'}
+
 # --- ルート: ユーザー登録 ---
 @app.route("/register", methods=["GET", "POST"])
 @limiter.limit("5 per hour")  # 1時間に5回まで
@@ -193,6 +224,12 @@ def login():
                     if hasattr(user, 'reset_failed_attempts'):
                         user.reset_failed_attempts()
                     
+                    # ハッシュの設定（アルゴリズム・コスト）が変わっていれば再ハッシュ
+                    if user.password_needs_rehash():
+                        user.set_password(form.password.data)
+                        print(f"パスワードを再ハッシュしました: {user.email}")
+                    
+                    user_cache.invalidate_user_after_commit(session, user.id)
                     session.commit()
                 except Exception as e:
                     print(f"ログイン情報更新エラー: {e}")
@@ -208,6 +245,7 @@ def login():
                 if user and hasattr(user, 'increment_failed_attempts'):
                     try:
                         user.increment_failed_attempts()
+                        user_cache.invalidate_user_after_commit(session, user.id)
                         session.commit()
                     except:
                         session.rollback()
@@ -235,85 +273,29 @@ def index():
 @limiter.limit("30 per hour")  # 1時間に30回まで
 def log():
     try:
-        # フォームからデータ取得
-        date_str = request.form.get('date')
-        start_time_str = request.form.get('start_time')
-        duration = int(request.form.get('duration', 0))
-        content = request.form.get('content', '')
-        impression = request.form.get('impression', '')
-        tags = request.form.get('tags', '')
-        
-        # 日付と時刻の変換
-        date_obj = datetime.strptime(date_str, '%Y-%m-%d').date()
-        time_obj = datetime.strptime(start_time_str, '%H:%M').time()
+        # フォームからデータ取得・検証（一括インポートと共通）
+        values = log_import.validate_log_row(request.form)
         
         # セッションを使用してログを保存
-        session = Session()
+        session = get_request_session()
         try:
-            new_log = Log(
-                date=date_obj,
-                start_time=time_obj,
-                duration=duration,
-                content=content,
-                impression=impression,
-                tags=tags,
-                user_id=current_user.id
-            )
+            new_log = Log(user_id=current_user.id, **values)
             session.add(new_log)
-            session.commit()
+            # タグ・集計テーブルも同じトランザクションで更新
+            tagging.set_log_tags(session, new_log, values['tags'])
+            rollups.apply_log(session, current_user.id, values['date'], values['duration'])
+            cache.bump_data_version(session, current_user.id)
             
-            # Google Calendar に追加（ユーザーが設定している場合のみ）
-            calendar_success = False
-            calendar_error = None
+            # Google Calendar への登録はワーカーに任せる（ユーザーが設定している場合のみ）
+            calendar_id = (current_user.calendar_id or '').strip()
+            if calendar_id:
+                calendar_queue.enqueue_log_sync(session, new_log, calendar_id)
             
-            try:
-                # 現在のユーザーのカレンダーIDを取得
-                user = session.query(User).get(current_user.id)
-                
-                # ユーザーが個別にカレンダーIDを設定している場合のみ処理
-                if user.calendar_id and user.calendar_id.strip():
-                    calendar_id = user.calendar_id.strip()
-                    print(f"ユーザー専用カレンダーID使用: {calendar_id}")
-                    
-                    # add_event 関数を呼び出し
-                    result = add_event(
-                        calendar_id, 
-                        date_obj, 
-                        time_obj, 
-                        duration, 
-                        content,
-                        impression,
-                        tags
-                    )
-                    
-                    if result:
-                        calendar_success = True
-                        print("Google Calendar への追加成功")
-                    else:
-                        print("Google Calendar への追加に失敗")
-                else:
-                    # カレンダーIDが設定されていない場合
-                    print("カレンダーIDが未設定のため、カレンダーには追加しません")
-                    
-            except ImportError as e:
-                calendar_error = f"Google Calendar モジュールのインポートエラー: {e}"
-                print(calendar_error)
-            except FileNotFoundError as e:
-                calendar_error = f"認証ファイルが見つかりません: {e}"
-                print(calendar_error)
-            except Exception as e:
-                calendar_error = f"Google Calendar エラー: {type(e).__name__}: {e}"
-                print(calendar_error)
+            session.commit()
             
             # メッセージ表示
-            if calendar_success:
-                flash('ログを記録し、カレンダーに追加しました', 'success')
-            elif user.calendar_id and user.calendar_id.strip():
-                # カレンダーIDは設定されているが、追加に失敗した場合
-                if calendar_error:
-                    flash(f'ログは記録されました（カレンダー追加失敗: {calendar_error}）', 'warning')
-                else:
-                    flash('ログは記録されました（カレンダーには追加されませんでした）', 'warning')
+            if calendar_id:
+                flash('ログを記録しました（カレンダーへの追加はバックグラウンドで行われます）', 'success')
             else:
                 # カレンダーIDが未設定の場合
                 flash('ログを記録しました（カレンダー連携を利用するには設定画面でカレンダーIDを設定してください）', 'info')
@@ -328,15 +310,171 @@ def log():
         flash(f'ログの登録に失敗しました: {str(e)}', 'danger')
         return redirect(url_for('index'))
     
-# ログ一覧表示
+# ログの一括作成 API（スクリプト・タイマーなどのプログラム用）
+@app.route('/api/logs:batch', methods=['POST'])
+@login_required
+@limiter.limit("60 per hour")
+def api_logs_batch():
+    payload = request.get_json(silent=True)
+    entries = payload.get('logs') if isinstance(payload, dict) else payload
+    if not isinstance(entries, list) or not entries:
+        return jsonify({'error': 'logs must be a non-empty list'}), 400
+    if len(entries) > log_batch.MAX_BATCH_SIZE:
+        return jsonify({'error': f'too many logs (max {log_batch.MAX_BATCH_SIZE})'}), 413
+
+    values_list, errors = log_batch.validate_entries(entries)
+    if errors:
+        return jsonify({'error': 'validation failed', 'details': errors}), 422
+
+    calendar_id = (current_user.calendar_id or '').strip() or None
+    try:
+        log_ids = log_batch.create_batch(current_user.id, values_list, calendar_id)
+    except Exception as e:
+        print(f"ログ一括作成エラー (user={current_user.id}): {type(e).__name__}: {e}")
+        return jsonify({'error': 'failed to create logs'}), 500
+
+    return jsonify({'ids': log_ids, 'count': len(log_ids)}), 201
+
+# オフライン中に記録したログの同期（PWA の Service Worker から呼ばれる）
+@app.route('/api/logs/sync', methods=['POST'])
+@login_required
+@limiter.limit("120 per hour")
+def api_logs_sync():
+    payload = request.get_json(silent=True) or {}
+    entries = payload.get('logs')
+    if not isinstance(entries, list):
+        return jsonify({'error': 'logs must be a list'}), 400
+    if len(entries) > log_sync.MAX_SYNC_ENTRIES:
+        return jsonify({'error': f'too many logs (max {log_sync.MAX_SYNC_ENTRIES})'}), 413
+    # 別のユーザーがオフライン中に記録したログ（同じブラウザ）は登録しない
+    owner = payload.get('user_id')
+    if owner is not None and str(owner) != str(current_user.id):
+        return jsonify({'error': 'logs belong to another user'}), 409
+
+    calendar_id = (current_user.calendar_id or '').strip() or None
+    try:
+        results = log_sync.sync_logs(current_user.id, entries, calendar_id)
+    except Exception as e:
+        print(f"ログ同期エラー (user={current_user.id}): {type(e).__name__}: {e}")
+        return jsonify({'error': 'sync failed'}), 500
+
+    return jsonify({'results': results})
+
+# ログの一括インポート（CSV / JSONL）
+@app.route('/import', methods=['GET', 'POST'])
+@login_required
+@limiter.limit("10 per hour", methods=['POST'])
+def import_logs():
+    if request.method == 'GET':
+        return render_template('import.html', report=None)
+
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        flash('ファイルを選択してください', 'warning')
+        return redirect(url_for('import_logs'))
+
+    file_format = request.form.get('format') or log_import.detect_format(upload.filename)
+    if file_format not in log_import.FORMATS:
+        flash('ファイル形式は CSV または JSONL を指定してください', 'danger')
+        return redirect(url_for('import_logs'))
+
+    calendar_id = (current_user.calendar_id or '').strip() or None
+    report = log_import.import_logs(current_user.id, upload.stream, file_format, calendar_id)
+    print(f"インポート完了 (user={current_user.id}): {report.imported} 件登録, {report.failed} 件エラー")
+
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify(report.to_dict())
+    return render_template('import.html', report=report.to_dict())
+
+# Service Worker（サイト全体をスコープにするためルートから配信）
+@app.route('/service-worker.js')
+def service_worker():
+    response = app.send_static_file('service-worker.js')
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+# ログのエクスポート（ストリーミング。?gzip=1 で gzip 圧縮）
+@app.route('/export.<file_format>')
+@login_required
+@limiter.limit("10 per hour")
+def export_logs(file_format):
+    if file_format not in log_export.FORMATS:
+        return jsonify({'error': 'not found'}), 404
+
+    use_gzip = request.args.get('gzip') == '1'
+    filename = f"learning-logs-{date.today().isoformat()}.{file_format}"
+    if use_gzip:
+        filename += '.gz'
+        mimetype = 'application/gzip'
+    else:
+        mimetype = log_export.FORMATS[file_format]
+
+    body = log_export.export_logs(current_user.id, file_format, gzip=use_gzip)
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+# ログ一覧表示（キーセットページング）
 @app.route('/logs')
 @login_required
 def logs():
-    session = Session()
+    session = get_request_session()
     try:
-        # 現在のユーザーのログのみ取得（新しい順）
-        user_logs = session.query(Log).filter_by(user_id=current_user.id).order_by(Log.date.desc(), Log.start_time.desc()).all()
-        return render_template('logs.html', logs=user_logs)
+        cursor = request.args.get('cursor')
+        try:
+            rows, next_cursor = pagination.fetch_log_page(
+                session, current_user.id, cursor, pagination.DEFAULT_PAGE_SIZE
+            )
+        except ValueError:
+            flash('ページの指定が正しくありません', 'warning')
+            return redirect(url_for('logs'))
+        
+        # 概要はロールアップから取得
+        total_time, total_logs = rollups.fetch_totals(session, current_user.id)
+        
+        return render_template('logs.html',
+                             logs=[pagination.log_row_to_dict(row) for row in rows],
+                             next_cursor=next_cursor,
+                             is_first_page=not cursor,
+                             total_logs=total_logs,
+                             total_time=total_time)
+    finally:
+        session.close()
+
+# ログ一覧API（/logs と同じカーソルを使用）
+@app.route('/api/logs')
+@login_required
+@limiter.limit("300 per hour")
+def api_logs():
+    session = get_request_session()
+    try:
+        limit = pagination.parse_page_size(request.args.get('limit'))
+        try:
+            rows, next_cursor = pagination.fetch_log_page(
+                session, current_user.id, request.args.get('cursor'), limit
+            )
+        except ValueError:
+            return jsonify({'error': 'invalid cursor'}), 400
+        
+        return jsonify({
+            'logs': [pagination.log_row_to_dict(row) for row in rows],
+            'next_cursor': next_cursor
+        })
+    finally:
+        session.close()
+
+# ログ詳細API（ログ一覧のモーダルから呼ばれる）
+@app.route('/api/logs/<int:log_id>')
+@login_required
+@limiter.limit("300 per hour")
+def api_log_detail(log_id):
+    session = get_request_session()
+    try:
+        log = pagination.fetch_log_detail(session, current_user.id, log_id)
+        if not log:
+            return jsonify({'error': 'not found'}), 404
+        return jsonify(pagination.log_detail_to_dict(log))
     finally:
         session.close()
 
@@ -344,54 +482,22 @@ def logs():
 @app.route('/stats')
 @login_required
 def stats():
-    session = Session()
+    session = get_request_session()
     try:
-        # 現在のユーザーのログのみで統計を計算
-        user_logs = session.query(Log).filter_by(user_id=current_user.id).order_by(Log.date.desc()).all()
-        
-        if not user_logs:
-            return render_template('stats.html', 
-                                 days=0,
-                                 streak=0,
-                                 total_time=0,
-                                 logs=[])
-        
-        # 統計計算
-        total_time = sum(log.duration for log in user_logs)  # total_time に変更
-        days = len(set(log.date for log in user_logs))  # days に変更
-        
-        # 連続日数の計算
-        dates = sorted(set(log.date for log in user_logs))
-        streak = 1
-        current_streak = 1
-        
-        # 今日から逆算して連続日数を計算
-        today = date.today()
-        if dates and dates[-1] == today:
-            # 今日の記録がある場合
-            for i in range(len(dates) - 1, 0, -1):
-                if (dates[i] - dates[i-1]).days == 1:
-                    current_streak += 1
-                else:
-                    break
-            streak = current_streak
-        elif dates and (today - dates[-1]).days == 1:
-            # 昨日の記録がある場合
-            for i in range(len(dates) - 1, 0, -1):
-                if (dates[i] - dates[i-1]).days == 1:
-                    current_streak += 1
-                else:
-                    break
-            streak = current_streak
-        else:
-            # 連続が途切れている
-            streak = 0
-        
-        return render_template('stats.html', 
+        # 集計はすべて DB 側で行い、スカラー値だけを受け取る（履歴の長さに依存しない）
+        total_time, log_count = rollups.fetch_totals(session, current_user.id)
+        days, first_date, last_date = rollups.fetch_day_summary(session, current_user.id)
+        # 連続記録日数（今日または昨日まで続いているもの）と最長記録
+        streak, longest_streak = rollups.fetch_streaks(session, current_user.id)
+
+        return render_template('stats.html',
                              days=days,  # 継続日数
                              streak=streak,  # 連続記録日数
+                             longest_streak=longest_streak,  # 最長連続記録日数
                              total_time=total_time,  # 累計作業時間
-                             logs=user_logs)  # ログリスト（追加情報用）
+                             log_count=log_count,
+                             first_date=first_date,
+                             last_date=last_date)
     finally:
         session.close()
 
@@ -407,22 +513,10 @@ def dashboard():
 @app.route('/tags/top')  # 既存のリンクに対応
 @login_required
 def tags_top():
-    session = Session()
+    session = get_request_session()
     try:
-        # 現在のユーザーのログを取得
-        user_logs = session.query(Log).filter_by(user_id=current_user.id).all()
-        
-        # タグをカウント
-        tag_count = defaultdict(int)
-        for log in user_logs:
-            if log.tags:
-                # カンマで分割してタグを抽出
-                tags = [tag.strip() for tag in log.tags.split(',') if tag.strip()]
-                for tag in tags:
-                    tag_count[tag] += 1
-        
-        # 上位5件を取得
-        rows = sorted(tag_count.items(), key=lambda x: x[1], reverse=True)[:5]
+        # 使用回数の上位5件を集計クエリで取得
+        rows = tagging.tag_counts(session, current_user.id, limit=5)
         
         return render_template('tags_top.html', rows=rows)
     finally:
@@ -432,113 +526,11 @@ def tags_top():
 @app.route('/api/dashboard')
 @login_required
 @limiter.limit("60 per hour")  # APIは少し多めに設定
+@cache.versioned_json('dashboard', per_day=True)
 def api_dashboard():
-    session = Session()
+    session = get_request_session()
     try:
-        # キャッシュ用の基本データ構造
-        result_data = {
-            'daily': {'labels': [], 'data': []},
-            'tags': {'labels': [], 'data': []},
-            'weekly': {'labels': [], 'data': []},
-            'monthly': {'labels': [], 'data': []},
-            'stats': {
-                'total_hours': 0,
-                'total_logs': 0,
-                'avg_duration': 0,
-                'total_tags': 0
-            }
-        }
-        
-        # 現在のユーザーのログを取得（必要なフィールドのみ）
-        user_logs = session.query(
-            Log.date, 
-            Log.duration, 
-            Log.tags
-        ).filter_by(
-            user_id=current_user.id
-        ).order_by(Log.date).all()
-        
-        if not user_logs:
-            return jsonify(result_data)
-        
-        # 高速化のため、一度のループで全データを集計
-        daily_data = defaultdict(int)
-        tag_data = defaultdict(int)
-        weekly_data = defaultdict(int)
-        monthly_data = defaultdict(int)
-        total_duration = 0
-        
-        for log in user_logs:
-            total_duration += log.duration
-            
-            # 日別集計
-            date_str = log.date.strftime('%Y-%m-%d')
-            daily_data[date_str] += log.duration
-            
-            # 週別集計
-            week_start = log.date - timedelta(days=log.date.weekday())
-            week_str = week_start.strftime('%Y-%m-%d')
-            weekly_data[week_str] += log.duration
-            
-            # 月別集計
-            month_str = log.date.strftime('%Y-%m')
-            monthly_data[month_str] += log.duration
-            
-            # タグ集計（タグがある場合のみ）
-            if log.tags:
-                for tag in log.tags.split(','):
-                    tag = tag.strip()
-                    if tag:
-                        tag_data[tag] += log.duration
-        
-        # 統計情報
-        total_logs = len(user_logs)
-        avg_duration = total_duration / total_logs if total_logs > 0 else 0
-        
-        # 日別データ（最近30日分のみ）
-        end_date = date.today()
-        start_date = end_date - timedelta(days=29)
-        
-        for i in range(30):
-            current_date = start_date + timedelta(days=i)
-            date_str = current_date.strftime('%Y-%m-%d')
-            result_data['daily']['labels'].append(current_date.strftime('%m/%d'))
-            result_data['daily']['data'].append(daily_data.get(date_str, 0))
-        
-        # タグデータ（上位5件のみ）
-        if tag_data:
-            sorted_tags = sorted(tag_data.items(), key=lambda x: x[1], reverse=True)[:5]
-            result_data['tags']['labels'] = [tag for tag, _ in sorted_tags]
-            result_data['tags']['data'] = [duration for _, duration in sorted_tags]
-        
-        # 週別データ（最近8週分のみ）
-        if weekly_data:
-            weekly_sorted = sorted(weekly_data.items())[-8:]
-            result_data['weekly']['labels'] = [
-                datetime.strptime(week, '%Y-%m-%d').strftime('%m/%d') 
-                for week, _ in weekly_sorted
-            ]
-            result_data['weekly']['data'] = [duration for _, duration in weekly_sorted]
-        
-        # 月別データ（最近6ヶ月分のみ）
-        if monthly_data:
-            monthly_sorted = sorted(monthly_data.items())[-6:]
-            result_data['monthly']['labels'] = [
-                datetime.strptime(month, '%Y-%m').strftime('%Y/%m') 
-                for month, _ in monthly_sorted
-            ]
-            result_data['monthly']['data'] = [duration for _, duration in monthly_sorted]
-        
-        # 統計情報を更新
-        result_data['stats'] = {
-            'total_hours': round(total_duration / 60, 1),
-            'total_logs': total_logs,
-            'avg_duration': round(avg_duration, 1),
-            'total_tags': len(tag_data)
-        }
-        
-        return jsonify(result_data)
-        
+        return jsonify(dashboard_api.dashboard_data(session, current_user.id, date.today()))
     finally:
         session.close()
 
@@ -549,11 +541,12 @@ def api_dashboard():
 @limiter.limit("20 per hour")
 def settings():
     """ユーザー設定ページ"""
-    session = Session()
+    session = get_request_session()
     try:
-        user = session.query(User).get(current_user.id)
-        
         if request.method == 'POST':
+            user = session.query(User).get(current_user.id)
+            user_cache.invalidate_user_after_commit(session, user.id)
+
             # カレンダー連携解除ボタンが押された場合
             if request.form.get('clear_calendar') == '1':
                 user.calendar_id = None
@@ -580,47 +573,84 @@ def settings():
             
             return redirect(url_for('settings'))
         
-        # 現在の設定を表示
+        # 現在の設定を表示（GET ではキャッシュ済みの current_user を使う）
+        user = current_user
         current_calendar_id = user.calendar_id or ''
+        backfill = calendar_backfill.latest_backfill(session, user.id)
+        unsynced_count = calendar_backfill.count_unsynced_logs(session, user.id) if current_calendar_id else 0
         # ユーザー情報も追加で渡す
         return render_template('settings.html', 
                              current_calendar_id=current_calendar_id,
                              user_email=user.email,
-                             user_username=user.username)
+                             user_username=user.username,
+                             backfill=backfill,
+                             unsynced_count=unsynced_count)
         
     finally:
         session.close()
 
+# 既存ログのカレンダー一括登録（ワーカーがバッチリクエストで処理）
+@app.route('/settings/calendar/backfill', methods=['POST'])
+@login_required
+@limiter.limit("5 per hour")
+def calendar_backfill_start():
+    calendar_id = (current_user.calendar_id or '').strip()
+    if not calendar_id:
+        flash('先にカレンダーIDを設定してください', 'warning')
+        return redirect(url_for('settings'))
+    
+    session = get_request_session()
+    try:
+        calendar_backfill.start_backfill(session, current_user.id, calendar_id)
+        session.commit()
+        flash('過去のログのカレンダー登録を開始しました。完了まで数分かかることがあります。', 'info')
+    finally:
+        session.close()
+    
+    return redirect(url_for('settings'))
+
+@app.route('/api/calendar/backfill')
+@login_required
+@limiter.limit("120 per hour")
+def api_calendar_backfill():
+    """一括登録の進捗を取得するAPI"""
+    session = get_request_session()
+    try:
+        backfill = calendar_backfill.latest_backfill(session, current_user.id)
+        remaining = calendar_backfill.count_unsynced_logs(session, current_user.id)
+        return jsonify(calendar_backfill.backfill_to_dict(backfill, remaining))
+    finally:
+        session.close()
+
 @app.route('/api/popular-tags')
 @login_required
 @limiter.limit("60 per hour")
+@cache.versioned_json('popular-tags')
 def popular_tags():
-    """よく使うタグを取得するAPI"""
-    session = Session()
+    """よく使うタグを取得するAPI（使用回数の多い順に上位10件）"""
+    session = get_request_session()
     try:
-        # 現在のユーザーのログからタグを集計
-        user_logs = session.query(Log).filter_by(user_id=current_user.id).all()
-        
-        # タグの使用回数をカウント
-        tag_count = defaultdict(int)
-        for log in user_logs:
-            if log.tags:
-                # カンマで分割してタグを抽出
-                tags = [tag.strip() for tag in log.tags.split(',') if tag.strip()]
-                for tag in tags:
-                    tag_count[tag] += 1
-        
-        # 使用回数の多い順にソート（上位10件）
-        popular_tags_list = sorted(tag_count.items(), key=lambda x: x[1], reverse=True)[:10]
-        
-        # タグ名のリストとして返す
-        result = [{'tag': tag, 'count': count} for tag, count in popular_tags_list]
-        
-        return jsonify(result)
-        
+        return jsonify(dashboard_api.popular_tags_data(session, current_user.id))
     finally:
         session.close()
 
+@app.route('/api/admin/pool-stats')
+@login_required
+def api_pool_stats():
+    """DB 接続プールの利用状況（管理者のみ。このワーカープロセスの値）"""
+    if not current_user.is_admin:
+        abort(404)
+    return jsonify(db_pool.pool_status(engine))
+
+@app.route('/metrics')
+@limiter.exempt
+def metrics_endpoint():
+    """Prometheus 用のメトリクス（管理者、または Authorization: Bearer <METRICS_TOKEN>）"""
+    if not prometheus_metrics.is_authorized(request.headers.get('Authorization'), current_user):
+        abort(404)
+    body, content_type = prometheus_metrics.latest()
+    return Response(body, content_type=content_type)
+
 # 認証が必要なルートではユーザーIDベースに
 @app.route('/settings/password', methods=['GET', 'POST'])
 @login_required
@@ -631,7 +661,7 @@ def change_password():
     form = ChangePasswordForm()
     
     if form.validate_on_submit():
-        session = Session()
+        session = get_request_session()
         try:
             # 現在のユーザーを取得
             user = session.query(User).get(current_user.id)
@@ -655,6 +685,7 @@ def change_password():
             
             # 新しいパスワードを設定
             user.set_password(form.new_password.data)
+            user_cache.invalidate_user_after_commit(session, user.id)
             session.commit()
             
             # パスワード変更の通知
@@ -689,7 +720,7 @@ def reset_password_request():
             flash('メールアドレスを入力してください', 'danger')
             return redirect(url_for('reset_password_request'))
         
-        session = Session()
+        session = get_request_session()
         try:
             user = session.query(User).filter_by(email=email).first()
             
@@ -698,16 +729,16 @@ def reset_password_request():
                 # トークンを生成
                 token = PasswordResetToken.create_token(user.id)
                 session.add(token)
-                session.commit()
                 
                 # リセットURLを生成
                 reset_url = url_for('reset_password', token=token.token, _external=True)
                 
-                # メールを送信
-                if send_password_reset_email(user.email, reset_url):
-                    print(f"パスワードリセットメール送信成功: {user.email}")
-                else:
-                    print(f"パスワードリセットメール送信失敗: {user.email}")
+                # メールは送信キューに入れてワーカーが送信（SMTPの応答を待たない）
+                # email_utils は SMTP 関連のモジュールを読み込むので、使うときにインポート
+                from email_utils import queue_password_reset_email
+                queue_password_reset_email(session, user.email, reset_url)
+                session.commit()
+                print(f"パスワードリセットメールを送信キューに追加: {user.email}")
             
             flash('入力されたメールアドレスが登録されている場合、パスワードリセットの手順をメールでお送りしました。', 'info')
             return redirect(url_for('login'))
@@ -728,7 +759,7 @@ def reset_password(token):
     if current_user.is_authenticated:
         return redirect(url_for('index'))
     
-    session = Session()
+    session = get_request_session()
     try:
         # トークンを確認
         reset_token = session.query(PasswordResetToken).filter_by(token=token).first()
@@ -763,6 +794,7 @@ def reset_password(token):
                 # トークンを使用済みにする
                 reset_token.used = True
                 
+                user_cache.invalidate_user_after_commit(session, user.id)
                 session.commit()
                 
                 flash('パスワードがリセットされました。新しいパスワードでログインしてください。', 'success')
@@ -785,22 +817,22 @@ def reset_password(token):
 @app.route('/account')
 @login_required
 def account():
-    with Session() as db_session:
-        user = db_session.query(User).get(current_user.id)
-        
-        # user_data辞書を作成（日本時間で表示）
-        user_data = {
-            'id': user.id,
-            'username': user.username,
-            'email': user.email,
-            'created_at': user.created_at,  # そのまま（既に日本時間の可能性）
-            'last_login': user.last_login,  # そのまま（日本時間で保存されている）
-            'calendar_id': getattr(user, 'calendar_id', None)
-        }
-        
-        return render_template('account.html', 
-                             user=user,
-                             user_data=user_data)
+    # 表示のみなので DB は読まずにキャッシュ済みの current_user を使う
+    user = current_user
+
+    # user_data辞書を作成（日本時間で表示）
+    user_data = {
+        'id': user.id,
+        'username': user.username,
+        'email': user.email,
+        'created_at': user.created_at,  # そのまま（既に日本時間の可能性）
+        'last_login': user.last_login,  # そのまま（日本時間で保存されている）
+        'calendar_id': getattr(user, 'calendar_id', None)
+    }
+
+    return render_template('account.html',
+                         user=user,
+                         user_data=user_data)
 
 # アカウント削除（退会）確認ページ（修正版）
 @app.route('/delete_account', methods=['GET', 'POST'])
@@ -835,8 +867,12 @@ def delete_account():
         
         # 関連データを明示的に削除（順序が重要）
         # 1. ログを削除
+        db_session.query(CalendarSyncJob).filter_by(user_id=user_id).delete(synchronize_session=False)
+        db_session.query(CalendarBackfill).filter_by(user_id=user_id).delete(synchronize_session=False)
         deleted_logs = db_session.query(Log).filter_by(user_id=user_id).delete(synchronize_session=False)
         print(f"削除されたログ数: {deleted_logs}")
+        rollups.delete_user_rollups(db_session, user_id)
+        tagging.delete_user_tags(db_session, user_id)
         
         # 2. パスワード履歴を削除
         deleted_history = db_session.query(PasswordHistory).filter_by(user_id=user_id).delete(synchronize_session=False)
@@ -857,6 +893,7 @@ def delete_account():
         user = db_session.query(User).get(user_id)
         if user:
             db_session.delete(user)
+            user_cache.invalidate_user_after_commit(db_session, user_id)
             db_session.commit()
             print(f"ユーザー '{username}' (ID: {user_id}) を削除しました")
         
@@ -888,7 +925,7 @@ def privacy():
 @login_required
 def result():
     # 最新のログを整形して表示
-    session = Session()
+    session = get_request_session()
     try:
         latest_log = session.query(Log).filter_by(user_id=current_user.id).order_by(Log.date.desc(), Log.start_time.desc()).first()
         
@@ -942,25 +979,129 @@ def ensure_columns_exist():
     if 'is_admin' not in columns:
         columns_to_add.append(('is_admin', 'BOOLEAN DEFAULT FALSE'))
     
+    if 'data_version' not in columns:
+        columns_to_add.append(('data_version', 'INTEGER NOT NULL DEFAULT 0'))
+    
+    # logsテーブルのカラム（カレンダー同期状態）
+    log_columns_to_add = []
+    try:
+        log_columns = [col['name'] for col in inspector.get_columns('logs')]
+    except:
+        log_columns = None
+    
+    if log_columns is not None:
+        if 'calendar_status' not in log_columns:
+            log_columns_to_add.append(('calendar_status', 'VARCHAR(20)'))
+        if 'calendar_event_link' not in log_columns:
+            log_columns_to_add.append(('calendar_event_link', 'VARCHAR(500)'))
+        if 'client_key' not in log_columns:
+            log_columns_to_add.append(('client_key', 'VARCHAR(64)'))
+    
     # カラムを追加
-    if columns_to_add:
+    alterations = [('users', name, column_type) for name, column_type in columns_to_add]
+    alterations += [('logs', name, column_type) for name, column_type in log_columns_to_add]
+    if alterations:
         with engine.connect() as conn:
-            for column_name, column_type in columns_to_add:
+            for table_name, column_name, column_type in alterations:
                 try:
-                    query = f"ALTER TABLE users ADD COLUMN {column_name} {column_type}"
+                    query = f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}"
                     conn.execute(text(query))
                     conn.commit()
-                    print(f"✅ カラム '{column_name}' を追加しました")
+                    print(f"✅ カラム '{table_name}.{column_name}' を追加しました")
                 except Exception as e:
                     # 既に存在する場合はスキップ
-                    print(f"ℹ️ カラム '{column_name}' のスキップ: {str(e)[:50]}")
+                    print(f"ℹ️ カラム '{table_name}.{column_name}' のスキップ: {str(e)[:50]}")
 
-# アプリケーション起動時に実行
-with app.app_context():
+    # logsテーブルのインデックス（既存のDBには create_all で追加されないため）
+    if log_columns is not None:
+        for index in Log.__table__.indexes:
+            try:
+                index.create(engine, checkfirst=True)
+            except Exception as e:
+                print(f"ℹ️ インデックス '{index.name}' のスキップ: {str(e)[:50]}")
+
+# 既存ログからロールアップを再集計: flask --app app rebuild-rollups [--user-id N]
+@app.cli.command('rebuild-rollups')
+@click.option('--user-id', type=int, default=None, help='対象ユーザーID（省略時は全ユーザー）')
+def rebuild_rollups_command(user_id):
+    """日別・週別・月別ロールアップテーブルを作り直す"""
+    with Session() as session:
+        buckets = rollups.rebuild_rollups(session, user_id)
+        session.commit()
+    click.echo(f"ロールアップを再集計しました（日別 {buckets} 件）")
+
+# 既存ログの Log.tags 文字列からタグテーブルを再作成: flask --app app rebuild-tags [--user-id N]
+@app.cli.command('rebuild-tags')
+@click.option('--user-id', type=int, default=None, help='対象ユーザーID（省略時は全ユーザー）')
+def rebuild_tags_command(user_id):
+    """tags / log_tags テーブルを作り直す"""
+    with Session() as session:
+        processed = tagging.rebuild_log_tags(session, user_id)
+        session.commit()
+    click.echo(f"タグを再作成しました（ログ {processed} 件）")
+
+# ファイルからログを一括登録: flask --app app import-logs --user-id N logs.csv
+@app.cli.command('import-logs')
+@click.option('--user-id', type=int, required=True, help='登録先のユーザーID')
+@click.option('--format', 'file_format', type=click.Choice(log_import.FORMATS), default=None,
+              help='ファイル形式（省略時は拡張子から判定）')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+def import_logs_command(user_id, file_format, path):
+    """CSV / JSONL ファイルのログを一括登録する"""
+    with Session() as session:
+        user = session.get(User, user_id)
+        if user is None:
+            raise click.ClickException(f"ユーザーが見つかりません: {user_id}")
+        calendar_id = (user.calendar_id or '').strip() or None
+
+    with open(path, 'rb') as stream:
+        report = log_import.import_logs(
+            user_id, stream, file_format or log_import.detect_format(path), calendar_id
+        )
+
+    for error in report.errors:
+        click.echo(f"{error['line']}行目: {error['error']}", err=True)
+    if report.failed > len(report.errors):
+        click.echo(f"（ほか {report.failed - len(report.errors)} 件のエラー）", err=True)
+    click.echo(f"{report.imported} 件登録しました（エラー {report.failed} 件）")
+
+# 既存ログをカレンダーへ一括登録: flask --app app calendar-backfill --user-id N
+@app.cli.command('calendar-backfill')
+@click.option('--user-id', type=int, required=True, help='対象ユーザーID')
+def calendar_backfill_command(user_id):
+    """未登録のログをバッチリクエストでカレンダーへ登録する（中断しても再実行で続きから）"""
+    with Session() as session:
+        user = session.get(User, user_id)
+        if not user or not (user.calendar_id or '').strip():
+            raise click.ClickException('カレンダーIDが設定されたユーザーが見つかりません')
+        backfill = calendar_backfill.start_backfill(session, user.id, user.calendar_id.strip())
+        session.commit()
+        backfill_id = backfill.id
+    
+    batches = calendar_backfill.run_backfill(backfill_id)
+    with Session() as session:
+        result = calendar_backfill.backfill_to_dict(session.get(CalendarBackfill, backfill_id))
+    click.echo(f"{batches} バッチ処理しました: {result}")
+
+def bootstrap_database():
+    """テーブル作成と、既存DBへのカラム・インデックス追加"""
     Base.metadata.create_all(engine)
     ensure_columns_exist()  # カラムの存在確認と追加
 
+# テーブル・カラム・インデックスを作成: flask --app app db-bootstrap
+# デプロイ時（ワーカー起動前）に1回だけ実行する。各ワーカーの起動時には行わない
+@app.cli.command('db-bootstrap')
+def db_bootstrap_command():
+    """テーブルの作成と、不足しているカラム・インデックスの追加"""
+    bootstrap_database()
+    click.echo("データベースの準備が完了しました")
+
+# リリース時にコマンドを実行できない環境向け: DB_BOOTSTRAP_ON_START=1 で従来どおり起動時に実行
+if os.getenv('DB_BOOTSTRAP_ON_START') == '1':
+    with app.app_context():
+        bootstrap_database()
+
 if __name__ == '__main__':
-    # テーブルが存在しない場合は作成
-    Base.metadata.create_all(engine)
+    # ローカル実行時はテーブルが存在しない場合に作成
+    bootstrap_database()
     app.run(debug=False)
\ No newline at end of file
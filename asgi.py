@@ -0,0 +1,11 @@
+# asgi.py - ASGI のエントリーポイント
+"""
+集計 API（/api/dashboard, /api/popular-tags）を asyncio で、それ以外を Flask で処理する。
+
+    gunicorn asgi:application -k uvicorn.workers.UvicornWorker
+"""
+
+from app import app, limiter
+from async_api import AsyncApi
+
+application = AsyncApi(app, limiter)
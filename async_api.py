@@ -0,0 +1,221 @@
+# async_api.py - 集計 API の asyncio 版（ASGI）
+"""
+/api/dashboard と /api/popular-tags を asyncio で処理する ASGI アプリ。
+それ以外のリクエストはすべて従来の Flask アプリ（WSGI）にスレッドで渡す。
+
+    gunicorn asgi:application -k uvicorn.workers.UvicornWorker
+
+同期ワーカーでは遅いクエリを待つ間ワーカーが丸ごと止まるが、こちらは DB・Redis の
+応答待ちの間に他のリクエストを処理できるので、少ないワーカーで多くの同時アクセスをさばける。
+
+・DB: SQLAlchemy の非同期エンジン（PostgreSQL は asyncpg、SQLite は aiosqlite）
+  集計処理は dashboard_api の関数を AsyncSession.run_sync でそのまま使う
+・Redis: redis.asyncio（レスポンスキャッシュ・ユーザーのスナップショットは Flask 版と共通のキー）
+・認証: Flask のセッション Cookie を同じ SECRET_KEY で検証する
+  ログインしていない・ログイン状態の保持（remember me）Cookie だけの場合などは Flask に渡す
+・レート制限: Flask-Limiter と同じストレージ・同じキーで数える（Flask 版と合算される）
+"""
+
+import asyncio
+import os
+from datetime import date
+
+from limits import parse as parse_limit
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from werkzeug.http import parse_cookie, parse_etags
+
+from db import DATABASE_URL
+import cache
+import dashboard_api
+import db_pool
+import prometheus_metrics
+import request_metrics
+import user_cache
+
+# Flask（WSGI）側のリクエストを処理するスレッド数（ワーカープロセスごと）
+WSGI_THREADS = int(os.getenv('ASGI_WSGI_THREADS', '10'))
+
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+# asyncio で処理する API（Flask 側の同名エンドポイントと同じ制限・キャッシュ名を使う）
+ROUTES = {
+    '/api/dashboard': {
+        'endpoint': 'api_dashboard',
+        'limit': parse_limit('60 per hour'),
+        'cache_name': 'dashboard',
+        'per_day': True,
+        'build': lambda session, user_id: dashboard_api.dashboard_data(session, user_id, date.today()),
+    },
+    '/api/popular-tags': {
+        'endpoint': 'popular_tags',
+        'limit': parse_limit('60 per hour'),
+        'cache_name': 'popular-tags',
+        'per_day': False,
+        'build': dashboard_api.popular_tags_data,
+    },
+}
+
+
+def async_database_url(url=DATABASE_URL):
+    """DATABASE_URL のドライバーを asyncio 用に置き換え、(URL, connect_args) を返す"""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"非同期ドライバーに対応していないデータベースです: {backend}")
+
+    connect_args = {}
+    query = dict(url.query)
+    # asyncpg は sslmode を受け付けないので ssl 引数に置き換える
+    sslmode = query.pop('sslmode', None)
+    if sslmode and sslmode != 'disable':
+        connect_args['ssl'] = sslmode
+    if backend == 'postgresql' and db_pool.PGBOUNCER:
+        # PgBouncer（transaction モード）ではプリペアドステートメントをキャッシュしない
+        query['prepared_statement_cache_size'] = '0'
+    return url.set(drivername=ASYNC_DRIVERS[backend], query=query), connect_args
+
+
+def create_engine_for_async():
+    """プールの設定は同期エンジンと同じ DB_POOL_* に従う（db_pool 参照）"""
+    url, connect_args = async_database_url()
+    options = db_pool.engine_options(url, is_async=True)
+    options['connect_args'] = {**options.get('connect_args', {}), **connect_args}
+    engine = create_async_engine(url, future=True, **options)
+    db_pool.instrument_engine(engine.sync_engine, reaper=False)
+    request_metrics.instrument_engine(engine.sync_engine)
+    return engine
+
+
+class AsyncApi:
+    """ROUTES の GET を asyncio で処理し、それ以外を Flask アプリに渡す ASGI アプリ"""
+
+    def __init__(self, flask_app, limiter):
+        from uvicorn.middleware.wsgi import WSGIMiddleware
+
+        self.flask_app = flask_app
+        self.limiter = limiter
+        self.wsgi = WSGIMiddleware(flask_app, workers=WSGI_THREADS)
+        self.engine = create_engine_for_async()
+        self.Session = sessionmaker(self.engine, class_=AsyncSession, expire_on_commit=False)
+        self.serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+
+        route = ROUTES.get(scope['path']) if scope['type'] == 'http' else None
+        if route is not None and scope['method'] in ('GET', 'HEAD'):
+            if await self._handle(route, scope, send):
+                return
+        await self.wsgi(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _session_user_id(self, headers):
+        """Flask のセッション Cookie からログイン中のユーザーIDを取り出す（無効なら None）"""
+        cookie_name = self.flask_app.config['SESSION_COOKIE_NAME']
+        value = parse_cookie(headers.get('cookie', '')).get(cookie_name)
+        if not value or self.serializer is None:
+            return None
+        max_age = int(self.flask_app.permanent_session_lifetime.total_seconds())
+        try:
+            data = self.serializer.loads(value, max_age=max_age)
+            return int(data['_user_id'])
+        except Exception:
+            return None
+
+    def _hit_rate_limit(self, route, user_id):
+        """Flask-Limiter のストレージでカウントし、制限内なら True"""
+        if not self.limiter.enabled:
+            return True
+        try:
+            return self.limiter.limiter.hit(route['limit'], f"user_{user_id}", route['endpoint'])
+        except Exception as e:
+            # Flask 側（swallow_errors=True）と同じく、ストレージのエラーでは制限しない
+            print(f"レート制限の確認エラー: {type(e).__name__}: {e}")
+            return True
+
+    async def _handle(self, route, scope, send):
+        """処理した場合は True。Flask に任せる場合（未ログインなど）は False"""
+        # Flask 版と同じく SQL の回数・時間を計測して Server-Timing で返す
+        token = request_metrics.start()
+        try:
+            return await self._handle_route(route, scope, send)
+        finally:
+            request_metrics.finish(token)
+
+    async def _handle_route(self, route, scope, send):
+        headers = {key.decode('latin-1'): value.decode('latin-1') for key, value in scope['headers']}
+        user_id = self._session_user_id(headers)
+        if user_id is None:
+            return False
+
+        head_only = scope['method'] == 'HEAD'
+        try:
+            async with self.Session() as session:
+                user = await user_cache.load_user_data_async(session, user_id)
+                if user is None:
+                    return False
+
+                # Redis へのアクセスは同期クライアントなのでスレッドで行う
+                if not await asyncio.to_thread(self._hit_rate_limit, route, user_id):
+                    prometheus_metrics.RATE_LIMITED.labels(route['endpoint']).inc()
+                    await self._send_json(scope, send, 429, b'{"error":"too many requests"}\n', head_only=head_only)
+                    return True
+
+                cache_key, etag = cache.versioned_cache_key(
+                    route['cache_name'], user_id, user['data_version'], route['per_day']
+                )
+                cache_headers = [('ETag', f'"{etag}"'), ('Cache-Control', 'private, no-cache')]
+
+                # クライアントが最新版を持っていれば本文なしで返す
+                if parse_etags(headers.get('if-none-match')).contains(etag):
+                    await self._send_json(scope, send, 304, b'', cache_headers, head_only=True)
+                    return True
+
+                body = await cache.async_cache_get(cache_key)
+                if body is None:
+                    payload = await session.run_sync(route['build'], user_id)
+                    body = (self.flask_app.json.dumps(payload, separators=(',', ':')) + '\n').encode('utf-8')
+                    await cache.async_cache_set(cache_key, body)
+        except Exception as e:
+            print(f"非同期APIエラー ({scope['path']}, user={user_id}): {type(e).__name__}: {e}")
+            await self._send_json(scope, send, 500, b'{"error":"internal server error"}\n', head_only=head_only)
+            return True
+
+        await self._send_json(scope, send, 200, body, cache_headers, head_only=head_only)
+        return True
+
+    async def _send_json(self, scope, send, status, body, extra_headers=(), head_only=False):
+        headers = [('Content-Type', 'application/json'), ('Vary', 'Cookie')]
+        if status != 304:
+            headers.append(('Content-Length', str(len(body))))
+        headers += list(extra_headers)
+        metrics = request_metrics.current()
+        if metrics is not None:
+            server_timing = request_metrics.report(
+                metrics, method=scope['method'], path=scope['path'], endpoint=ROUTES[scope['path']]['endpoint'],
+                status=status,
+            )
+            if server_timing:
+                headers.append(('Server-Timing', server_timing))
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+        })
+        await send({'type': 'http.response.body', 'body': b'' if head_only else body})
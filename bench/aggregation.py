@@ -0,0 +1,244 @@
+# bench/aggregation.py - 集計処理（analytics.py）の速度計測
+"""
+ログ件数ごとに、日別・週別・月別の集計とタグ別の集計の時間を計測し、
+行ごとに週・月のキーを作っていた従来の方法・analytics の Python 版・NumPy 版を比べる。
+タグ別の集計と NumPy 版はこのファイルにある比較用の実装
+（アプリのタグ別集計は tagging.py で tags / log_tags テーブルに対する SQL で行い、
+日別・週別・月別は analytics の Python 版を使う。NumPy はアプリの依存関係に含めていない）。
+
+    python bench/aggregation.py
+    python bench/aggregation.py --sizes 1000 100000 1000000 --repeat 5 --json
+
+・従来: 1行ごとに日・週（weekday() から計算）・月のキーを作り、それぞれの dict に加算する
+  タグは1行ごとにカンマで分解する
+・python: 1行ごとには日の序数への加算だけを行い、週・月は日の種類数分だけ計算する（analytics.summarize）
+  タグは同じ文字列の分解結果を使い回す
+・numpy: 行のリストから配列を作って np.bincount で集計する（配列への変換を含む）
+  タグは文字列に番号を振ってから np.bincount で集計する
+・numpy(列): 日の序数・分の配列が既にある場合
+NumPy がインストールされていなければ numpy の列は計測しない（pip install numpy）。
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import analytics
+
+TAG_STRINGS = ['', 'Python', 'Python, Flask', '英語', '英語, TOEIC', '読書', 'SQL, 設計', 'Python, SQL, 設計', '数学']
+
+
+def make_rows(count, days=730, seed=1):
+    """(日付, 分, タグ文字列) を count 件作る（日付は直近 days 日、タグは偏りあり）"""
+    rng = random.Random(seed)
+    today = date.today()
+    weights = [1 / rank for rank in range(1, len(TAG_STRINGS) + 1)]
+    return [
+        (today - timedelta(days=rng.randrange(days)), rng.randint(5, 240), rng.choices(TAG_STRINGS, weights)[0])
+        for _ in range(count)
+    ]
+
+
+def legacy_buckets(entries):
+    """従来の方法（1行ごとに日・週・月のキーを作って加算）"""
+    totals = {'daily': {}, 'weekly': {}, 'monthly': {}}
+    for day, minutes in entries:
+        for name, key in (('daily', day),
+                          ('weekly', day - timedelta(days=day.weekday())),
+                          ('monthly', day.replace(day=1))):
+            total = totals[name].setdefault(key, [0, 0])
+            total[0] += minutes
+            total[1] += 1
+    return totals
+
+
+def _split_tags(tags_str):
+    names = []
+    for tag in tags_str.split(','):
+        tag = tag.strip()
+        if tag and tag not in names:
+            names.append(tag)
+    return names
+
+
+def legacy_tags(entries):
+    """従来の方法（1行ごとにタグ文字列を分解）"""
+    totals = {}
+    for tags_str, minutes in entries:
+        for name in _split_tags(tags_str):
+            total = totals.setdefault(name, [0, 0])
+            total[0] += minutes
+            total[1] += 1
+    return totals
+
+
+def cached_tags(entries):
+    """同じタグ文字列の分解結果を使い回す"""
+    parsed = {}
+    totals = {}
+    for tags_str, minutes in entries:
+        names = parsed.get(tags_str)
+        if names is None:
+            names = parsed[tags_str] = _split_tags(tags_str)
+        for name in names:
+            total = totals.get(name)
+            if total is None:
+                totals[name] = [minutes, 1]
+            else:
+                total[0] += minutes
+                total[1] += 1
+    return totals
+
+
+def _numpy():
+    """NumPy（インストールされていなければ None）"""
+    try:
+        import numpy
+        return numpy
+    except ImportError:
+        return None
+
+
+def numpy_buckets_columns(ordinals, minutes):
+    """
+    日の序数の配列と分の配列から、analytics.summarize() と同じ形の結果を NumPy で求める
+    日ごとの合計を np.bincount で求め、週・月は記録のある日の分だけ bincount でまとめる
+    """
+    np = _numpy()
+    ordinals = np.asarray(ordinals, dtype=np.int32)
+    minutes = np.asarray(minutes, dtype=np.int64)
+    if not len(ordinals):
+        return {'daily': {}, 'weekly': {}, 'monthly': {}}
+
+    first = int(ordinals.min())
+    offsets = ordinals - first
+    day_minutes = np.bincount(offsets, weights=minutes)
+    day_counts = np.bincount(offsets)
+    used = np.flatnonzero(day_counts)
+    days = used + first
+    day_minutes = day_minutes[used]
+    day_counts = day_counts[used]
+
+    # 週: 0001-01-01（月曜日）からの週番号、月: 0001年1月からの月番号
+    weeks = (days - 1) // 7
+    dates = [date.fromordinal(int(ordinal)) for ordinal in days]
+    months = np.array([d.year * 12 + d.month - 1 for d in dates], dtype=np.int64)
+
+    def grouped(keys):
+        base = int(keys.min())
+        sums = np.bincount(keys - base, weights=day_minutes)
+        counts = np.bincount(keys - base, weights=day_counts)
+        present = np.flatnonzero(counts)
+        return [(int(key) + base, int(sums[key]), int(counts[key])) for key in present]
+
+    return {
+        'daily': {d: (int(m), int(c)) for d, m, c in zip(dates, day_minutes, day_counts)},
+        'weekly': {date.fromordinal(week * 7 + 1): (m, c) for week, m, c in grouped(weeks)},
+        'monthly': {date(month // 12, month % 12 + 1, 1): (m, c) for month, m, c in grouped(months)},
+    }
+
+
+def numpy_buckets(entries):
+    """[(日付, 分), ...] を配列にしてから numpy_buckets_columns() で集計する"""
+    return numpy_buckets_columns([day.toordinal() for day, _ in entries], [minutes for _, minutes in entries])
+
+
+def numpy_tags(entries):
+    """タグ文字列に番号を振り（factorize）、番号ごとの合計を np.bincount で求めてからタグに振り分ける"""
+    np = _numpy()
+    string_codes = {}
+    codes = np.fromiter(
+        (string_codes.setdefault(tags_str, len(string_codes)) for tags_str, _ in entries),
+        dtype=np.int32, count=len(entries),
+    )
+    minutes = np.fromiter((m for _, m in entries), dtype=np.int64, count=len(entries))
+    sums = np.bincount(codes, weights=minutes, minlength=len(string_codes))
+    counts = np.bincount(codes, minlength=len(string_codes))
+
+    totals = {}
+    for tags_str, code in string_codes.items():
+        for name in _split_tags(tags_str):
+            total = totals.setdefault(name, [0, 0])
+            total[0] += int(sums[code])
+            total[1] += int(counts[code])
+    return totals
+
+
+def best_of(func, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def measure(size, repeat, use_numpy):
+    rows = make_rows(size)
+    entries = [(day, minutes) for day, minutes, _ in rows]
+    tag_entries = [(tags, minutes) for _, minutes, tags in rows]
+    result = {'rows': size}
+
+    seconds, expected = best_of(lambda: legacy_buckets(entries), repeat)
+    expected = {name: {key: tuple(value) for key, value in buckets.items()} for name, buckets in expected.items()}
+    result['buckets_legacy_ms'] = seconds
+    seconds, buckets = best_of(lambda: analytics.summarize(entries), repeat)
+    assert buckets == expected
+    result['buckets_python_ms'] = seconds
+
+    seconds, expected_tags = best_of(lambda: legacy_tags(tag_entries), repeat)
+    result['tags_legacy_ms'] = seconds
+    seconds, tags = best_of(lambda: cached_tags(tag_entries), repeat)
+    assert tags == expected_tags
+    result['tags_python_ms'] = seconds
+
+    if use_numpy:
+        seconds, buckets = best_of(lambda: numpy_buckets(entries), repeat)
+        assert buckets == expected
+        result['buckets_numpy_ms'] = seconds
+        np = _numpy()
+        ordinals = np.array([day.toordinal() for day, _ in entries], dtype=np.int32)
+        minutes = np.array([m for _, m in entries], dtype=np.int32)
+        seconds, buckets = best_of(lambda: numpy_buckets_columns(ordinals, minutes), repeat)
+        assert buckets == expected
+        result['buckets_numpy_columns_ms'] = seconds
+        seconds, tags = best_of(lambda: numpy_tags(tag_entries), repeat)
+        assert tags == expected_tags
+        result['tags_numpy_ms'] = seconds
+
+    return {key: round(value * 1000, 3) if key.endswith('_ms') else value for key, value in result.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='集計処理の速度計測')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000])
+    parser.add_argument('--repeat', type=int, default=5, help='各計測の繰り返し回数（最速値を使う）')
+    parser.add_argument('--json', action='store_true', help='結果を JSON で出力する')
+    args = parser.parse_args()
+
+    use_numpy = _numpy() is not None
+    results = [measure(size, args.repeat, use_numpy) for size in args.sizes]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    columns = [('buckets_legacy_ms', '日週月 従来'), ('buckets_python_ms', 'python'),
+               ('buckets_numpy_ms', 'numpy'), ('buckets_numpy_columns_ms', 'numpy(列)'),
+               ('tags_legacy_ms', 'タグ 従来'), ('tags_python_ms', 'python'), ('tags_numpy_ms', 'numpy')]
+    columns = [(key, label) for key, label in columns if key in results[0]]
+    print('ミリ秒（最速値）  ' + ('' if use_numpy else 'NumPy がないため numpy は計測していません'))
+    print(f"{'件数':>9} " + ' '.join(f'{label:>12}' for _, label in columns))
+    for r in results:
+        print(f"{r['rows']:>9} " + ' '.join(f'{r[key]:>12.2f}' for key, _ in columns))
+
+
+if __name__ == '__main__':
+    main()
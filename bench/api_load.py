@@ -0,0 +1,170 @@
+# bench/api_load.py - 集計 API の同期版・asyncio 版の負荷比較
+"""
+一時的な SQLite にユーザーとログを用意し、同じワーカー数で
+
+    sync  : gunicorn app:app（同期ワーカー）
+    async : gunicorn asgi:application -k uvicorn.workers.UvicornWorker
+
+を順に起動して、同時接続数 --concurrency で --path を叩き続けたときのスループットとレイテンシを比べる。
+
+    python bench/api_load.py
+    python bench/api_load.py --workers 2 --concurrency 50 --seconds 10 --db-latency-ms 20
+
+--db-latency-ms でクエリごとの待ち時間を入れ、リモート DB との往復を模擬する（bench/bench_app.py 参照）。
+"""
+
+import argparse
+import http.client
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, time as dt_time, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+SECRET_KEY = 'bench-api-load'
+
+SERVERS = {
+    'sync': ['bench_app:app'],
+    'async': ['-k', 'uvicorn.workers.UvicornWorker', 'bench_app:application'],
+}
+
+
+def prepare_database(database_url, log_count):
+    """ユーザー1人とログを登録し、そのユーザーのセッション Cookie を返す"""
+    os.environ['DATABASE_URL'] = database_url
+    os.environ['SECRET_KEY'] = SECRET_KEY
+    os.environ['REDIS_EXTERNAL_URL'] = 'memory://'
+    sys.path.insert(0, ROOT_DIR)
+
+    import app as app_module
+    import log_import
+    from db import Session, User
+
+    app_module.bootstrap_database()
+    with Session() as session:
+        user = User(email='bench@example.com', username='bench', password_hash='-')
+        session.add(user)
+        session.flush()
+        today = date.today()
+        tags = ['Python', '英語', '読書', 'Flask', 'SQL', '数学', '設計']
+        values_list = [{
+            'date': today - timedelta(days=i % 400),
+            'start_time': dt_time(9 + i % 10, 0),
+            'duration': 15 + i % 90,
+            'content': f'ベンチマーク {i}',
+            'impression': '',
+            'tags': ', '.join(tags[j % len(tags)] for j in range(i % 3 + 1)),
+        } for i in range(log_count)]
+        log_import.insert_logs(session, user.id, values_list)
+        session.commit()
+        user_id = user.id
+
+    serializer = app_module.app.session_interface.get_signing_serializer(app_module.app)
+    return serializer.dumps({'_user_id': str(user_id), '_fresh': True})
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"サーバーが起動しませんでした (port {port})")
+
+
+def run_load(port, path, cookie, concurrency, seconds):
+    """concurrency 本のスレッドで seconds 秒間リクエストを送り、(件数, エラー数, レイテンシのリスト) を返す"""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+    headers = {'Cookie': f'session={cookie}', 'Accept': 'application/json'}
+
+    def client():
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        local = []
+        local_errors = 0
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                conn.request('GET', path, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                if response.status != 200:
+                    local_errors += 1
+            except (OSError, http.client.HTTPException):
+                local_errors += 1
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+                continue
+            local.append(time.perf_counter() - started)
+        conn.close()
+        with lock:
+            latencies.extend(local)
+            errors[0] += local_errors
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(latencies), errors[0], sorted(latencies)
+
+
+def percentile(sorted_values, ratio):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * ratio))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='集計 API の同期版と asyncio 版の負荷比較')
+    parser.add_argument('--modes', nargs='+', choices=list(SERVERS), default=list(SERVERS))
+    parser.add_argument('--path', default='/api/dashboard')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn のワーカー数')
+    parser.add_argument('--concurrency', type=int, default=50, help='同時接続数')
+    parser.add_argument('--seconds', type=float, default=10.0, help='1モードあたりの計測時間')
+    parser.add_argument('--db-latency-ms', type=float, default=20.0, help='クエリごとに入れる待ち時間')
+    parser.add_argument('--logs', type=int, default=5000, help='用意するログ件数')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database_url = f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}"
+        cookie = prepare_database(database_url, args.logs)
+
+        env = dict(os.environ, BENCH_DB_LATENCY_MS=str(args.db_latency_ms), PASSWORD_HASH_WORKERS='0')
+        print(f"{args.path}  ワーカー {args.workers}  同時接続 {args.concurrency}  "
+              f"クエリ待ち {args.db_latency_ms:.0f} ms  ログ {args.logs} 件")
+        print(f"{'mode':<6} {'件数':>7} {'req/s':>8} {'p50(ms)':>9} {'p95(ms)':>9} {'p99(ms)':>9} {'エラー':>6}")
+
+        for mode in args.modes:
+            command = [sys.executable, '-m', 'gunicorn', '--chdir', tmp_dir,
+                       '--pythonpath', f'{BENCH_DIR},{ROOT_DIR}',
+                       '-w', str(args.workers), '-b', f'127.0.0.1:{args.port}',
+                       '--timeout', '120', '--log-level', 'warning', *SERVERS[mode]]
+            server = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL)
+            try:
+                wait_for_port(args.port)
+                run_load(args.port, args.path, cookie, min(args.concurrency, 4), 1.0)  # ウォームアップ
+                count, errors, latencies = run_load(
+                    args.port, args.path, cookie, args.concurrency, args.seconds
+                )
+            finally:
+                server.terminate()
+                server.wait(timeout=30)
+
+            print(f"{mode:<6} {count:>7} {count / args.seconds:>8.1f} "
+                  f"{percentile(latencies, 0.50) * 1000:>9.1f} {percentile(latencies, 0.95) * 1000:>9.1f} "
+                  f"{percentile(latencies, 0.99) * 1000:>9.1f} {errors:>6}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+# bench/bench_app.py - 負荷比較用のアプリ（bench/api_load.py が gunicorn で起動する）
+"""
+    app          : 従来の Flask アプリ（同期ワーカー用）
+    application  : asgi.py と同じ ASGI アプリ（uvicorn ワーカー用）
+
+・BENCH_DB_LATENCY_MS: クエリごとに待ち時間を入れ、リモートの DB（Render の PostgreSQL など）との
+  往復を模擬する。同期エンジンでは time.sleep、非同期エンジンでは asyncio.sleep で待つ
+・レート制限とレスポンスキャッシュは無効にし、毎回集計クエリを実行させる
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event
+from sqlalchemy.util import await_only
+
+import app as app_module
+import cache
+from async_api import AsyncApi
+from db import engine
+
+DB_LATENCY_SECONDS = float(os.getenv('BENCH_DB_LATENCY_MS', '0')) / 1000
+
+app_module.limiter.enabled = False
+
+
+async def _cache_miss(key):
+    return None
+
+
+cache.cache_get = lambda key: None
+cache.async_cache_get = _cache_miss
+
+app = app_module.app
+application = AsyncApi(app, app_module.limiter)
+
+
+@event.listens_for(engine, 'before_cursor_execute')
+def _sync_latency(*args):
+    if DB_LATENCY_SECONDS:
+        time.sleep(DB_LATENCY_SECONDS)
+
+
+@event.listens_for(application.engine.sync_engine, 'before_cursor_execute')
+def _async_latency(*args):
+    if DB_LATENCY_SECONDS:
+        # greenlet 経由でイベントループに戻って待つ（他のリクエストは処理され続ける）
+        await_only(asyncio.sleep(DB_LATENCY_SECONDS))
@@ -0,0 +1,276 @@
+# bench/load_test.py - アプリ全体の負荷試験
+"""
+bench/synthetic_data.py で合成データを用意し、本番と同じ構成のサーバーと worker.py を起動して、
+複数のユーザーとして主要な画面・API に同時にアクセスし、エンドポイントごとの
+スループットと p50/p95/p99 レイテンシを JSON で出力する。
+
+    python bench/load_test.py
+    python bench/load_test.py --users 1000 --logs-per-user 2000 --concurrency 50 --seconds 60 --output result.json
+    python bench/load_test.py --database-url postgresql://localhost/bench --users 10000 --logs-per-user 2000
+    python bench/load_test.py --database-url postgresql://localhost/bench --skip-generate   # 生成済みのデータを使う
+
+・同時接続ごとに1人のユーザーとしてログインし、--mix の比率でリクエストを選ぶ
+  （/log の POST はリダイレクト 302 を成功として数える）
+・サーバーは bench/bench_app.py（レート制限・レスポンスキャッシュなし）を gunicorn で起動する
+  --server async: asgi.py と同じ構成（集計 API は asyncio） / sync: 同期ワーカー
+・worker.py も起動し、/log で積まれるカレンダー登録ジョブを処理させる
+  （CALENDAR_BACKEND=fake、メールはローカルの受信専用 SMTP サーバーに送る。外部には接続しない）
+・同じ --seed・同じ規模なら同じデータ・同じリクエスト列になる
+"""
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from urllib.parse import urlencode
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import synthetic_data
+from api_load import SERVERS, percentile, wait_for_port
+
+DEFAULT_MIX = 'log=2,logs=3,stats=2,tags_top=1,dashboard=4,popular_tags=2'
+REQUESTS = {
+    'log': ('POST', '/log'),
+    'logs': ('GET', '/logs'),
+    'stats': ('GET', '/stats'),
+    'tags_top': ('GET', '/tags_top'),
+    'dashboard': ('GET', '/api/dashboard'),
+    'popular_tags': ('GET', '/api/popular-tags'),
+}
+OK_STATUSES = {'log': (302,)}
+
+
+class _SmtpSinkHandler(socketserver.StreamRequestHandler):
+    """受け取ったメールを捨てるだけの SMTP サーバー（EHLO / MAIL / RCPT / DATA / QUIT のみ）"""
+
+    def handle(self):
+        self.wfile.write(b'220 bench smtp sink\r\n')
+        in_data = False
+        for line in self.rfile:
+            if in_data:
+                if line in (b'.\r\n', b'.\n'):
+                    in_data = False
+                    self.wfile.write(b'250 OK\r\n')
+                continue
+            command = line[:4].upper()
+            if command == b'DATA':
+                in_data = True
+                self.wfile.write(b'354 End data with <CR><LF>.<CR><LF>\r\n')
+            elif command == b'QUIT':
+                self.wfile.write(b'221 Bye\r\n')
+                return
+            elif command == b'EHLO':
+                self.wfile.write(b'250 bench\r\n')
+            else:
+                self.wfile.write(b'250 OK\r\n')
+
+
+def start_smtp_sink():
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), _SmtpSinkHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in REQUESTS:
+            raise SystemExit(f"--mix に不明なリクエストがあります: {name}（{', '.join(REQUESTS)}）")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def session_cookies(user_ids):
+    """ユーザーごとのログイン済みセッション Cookie（synthetic_data.generate の後に呼ぶ）"""
+    import app as app_module
+    serializer = app_module.app.session_interface.get_signing_serializer(app_module.app)
+    return [serializer.dumps({'_user_id': str(user_id), '_fresh': True}) for user_id in user_ids]
+
+
+def existing_user_ids(database_url):
+    os.environ['DATABASE_URL'] = database_url
+    os.environ.setdefault('SECRET_KEY', 'bench')
+    sys.path.insert(0, ROOT_DIR)
+    from db import Session, User
+    with Session() as session:
+        return [user_id for (user_id,) in session.query(User.id).filter(
+            User.username.like(f'{synthetic_data.USERNAME_PREFIX}%')
+        ).order_by(User.id)]
+
+
+def log_form(rng):
+    favorites = rng.sample(synthetic_data.TAG_VOCABULARY[:20], 2)
+    return urlencode({
+        'date': (date.today() - timedelta(days=rng.randint(0, 6))).isoformat(),
+        'start_time': f'{rng.randint(6, 23):02d}:{rng.choice([0, 30]):02d}',
+        'duration': str(rng.choice([15, 30, 45, 60, 90])),
+        'content': rng.choice(synthetic_data.CONTENTS),
+        'impression': '',
+        'tags': ', '.join(favorites[:rng.randint(0, 2)]),
+    })
+
+
+def run_load(port, cookies, mix, concurrency, seconds, seed):
+    """concurrency 人が seconds 秒間アクセスし、リクエスト種別ごとの (レイテンシのリスト, エラー数) を返す"""
+    results = {name: ([], [0]) for name in mix}
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+    names = list(mix)
+    weights = [mix[name] for name in names]
+
+    def client(index):
+        rng = random.Random(seed * 100003 + index)
+        headers = {'Cookie': f'session={cookies[index % len(cookies)]}'}
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+        local = {name: ([], 0) for name in names}
+        while time.monotonic() < deadline:
+            name = rng.choices(names, weights)[0]
+            method, path = REQUESTS[name]
+            body = None
+            request_headers = dict(headers)
+            if method == 'POST':
+                body = log_form(rng)
+                request_headers['Content-Type'] = 'application/x-www-form-urlencoded'
+            latencies, errors = local[name]
+            started = time.perf_counter()
+            try:
+                conn.request(method, path, body=body, headers=request_headers)
+                response = conn.getresponse()
+                response.read()
+            except (OSError, http.client.HTTPException):
+                local[name] = (latencies, errors + 1)
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+                continue
+            latencies.append(time.perf_counter() - started)
+            if response.status not in OK_STATUSES.get(name, (200,)):
+                local[name] = (latencies, errors + 1)
+        conn.close()
+        with lock:
+            for name, (latencies, errors) in local.items():
+                results[name][0].extend(latencies)
+                results[name][1][0] += errors
+
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {name: (sorted(latencies), errors[0]) for name, (latencies, errors) in results.items()}
+
+
+def summarize(latencies, errors, seconds):
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / seconds, 2),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'max_ms': round(latencies[-1] * 1000, 2) if latencies else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='アプリ全体の負荷試験（結果は JSON）')
+    parser.add_argument('--database-url', help='省略時は一時ディレクトリの SQLite')
+    parser.add_argument('--skip-generate', action='store_true', help='生成済みのデータを使う')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--logs-per-user', type=int, default=500)
+    parser.add_argument('--calendar-ratio', type=float, default=0.3)
+    parser.add_argument('--server', choices=list(SERVERS), default='async')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn のワーカー数')
+    parser.add_argument('--concurrency', type=int, default=20, help='同時にアクセスするユーザー数')
+    parser.add_argument('--seconds', type=float, default=30.0)
+    parser.add_argument('--warmup-seconds', type=float, default=3.0)
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='リクエストの比率（例: logs=3,dashboard=4）')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--output', help='結果の JSON を書き出すファイル（省略時は標準出力のみ）')
+    args = parser.parse_args()
+    mix = parse_mix(args.mix)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database_url = args.database_url or f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}"
+        generate_seconds = 0.0
+        if args.skip_generate:
+            user_ids = existing_user_ids(database_url)
+            if not user_ids:
+                raise SystemExit('合成データのユーザーがいません（--skip-generate を外して生成してください）')
+        else:
+            started = time.perf_counter()
+            user_ids, _ = synthetic_data.generate(database_url, args.users, args.logs_per_user,
+                                                  seed=args.seed, calendar_ratio=args.calendar_ratio)
+            generate_seconds = time.perf_counter() - started
+        cookies = session_cookies(random.Random(args.seed).sample(user_ids, min(args.concurrency, len(user_ids))))
+
+        smtp_sink = start_smtp_sink()
+        env = dict(
+            os.environ, PASSWORD_HASH_WORKERS='0', CALENDAR_BACKEND='fake', WORKER_POLL_INTERVAL='1',
+            SMTP_SERVER='127.0.0.1', SMTP_PORT=str(smtp_sink.server_address[1]), SMTP_STARTTLS='0', SMTP_AUTH='0',
+            PROMETHEUS_MULTIPROC_DIR=os.path.join(tmp_dir, 'metrics'),
+        )
+        os.makedirs(env['PROMETHEUS_MULTIPROC_DIR'])
+        command = [sys.executable, '-m', 'gunicorn', '--chdir', tmp_dir,
+                   '--pythonpath', f'{BENCH_DIR},{ROOT_DIR}',
+                   '-w', str(args.workers), '-b', f'127.0.0.1:{args.port}',
+                   '--timeout', '120', '--log-level', 'warning', *SERVERS[args.server]]
+        server = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL)
+        worker = subprocess.Popen([sys.executable, os.path.join(ROOT_DIR, 'worker.py')],
+                                  cwd=tmp_dir, env=env, stdout=subprocess.DEVNULL)
+        try:
+            wait_for_port(args.port)
+            run_load(args.port, cookies, mix, min(args.concurrency, 4), args.warmup_seconds, args.seed)
+            results = run_load(args.port, cookies, mix, args.concurrency, args.seconds, args.seed)
+        finally:
+            for process in (server, worker):
+                process.terminate()
+            for process in (server, worker):
+                process.wait(timeout=30)
+            smtp_sink.shutdown()
+
+    all_latencies = sorted(latency for latencies, _ in results.values() for latency in latencies)
+    report = {
+        'config': {
+            'database': database_url.split(':', 1)[0].split('+')[0],
+            'users': len(user_ids),
+            'logs_per_user': None if args.skip_generate else args.logs_per_user,
+            'server': args.server,
+            'workers': args.workers,
+            'concurrency': args.concurrency,
+            'seconds': args.seconds,
+            'mix': mix,
+            'seed': args.seed,
+            'generate_seconds': round(generate_seconds, 1),
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+        },
+        'total': summarize(all_latencies, sum(errors for _, errors in results.values()), args.seconds),
+        'endpoints': {
+            f'{REQUESTS[name][0]} {REQUESTS[name][1]}': summarize(latencies, errors, args.seconds)
+            for name, (latencies, errors) in results.items()
+        },
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
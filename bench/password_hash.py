@@ -0,0 +1,86 @@
+# bench/password_hash.py - パスワードハッシュの速度計測
+"""
+ハッシュ方式ごとに「1コアあたり毎秒何回ハッシュできるか」と、
+passwords のプロセスプール経由での合計スループットを計測する。
+
+    python bench/password_hash.py
+    python bench/password_hash.py --methods scrypt:32768:8:1 pbkdf2:sha256:600000 --seconds 5 --workers 4
+
+結果から、ログイン・登録のピーク時に必要なコア数（= ピーク時の毎秒ハッシュ回数 ÷ 1コアあたりの回数）を見積もれる。
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.security import generate_password_hash
+
+DEFAULT_METHODS = ['scrypt:32768:8:1', 'scrypt:16384:8:1', 'pbkdf2:sha256:600000', 'pbkdf2:sha256:260000']
+
+
+def hash_for(method, seconds):
+    """seconds 秒間ハッシュを繰り返し、回数を返す（1プロセス = 1コア）"""
+    count = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        generate_password_hash('correct horse battery staple', method=method)
+        count += 1
+    return count
+
+
+def bench_single(method, seconds):
+    started = time.perf_counter()
+    count = hash_for(method, seconds)
+    return count / (time.perf_counter() - started)
+
+
+def bench_pool(method, seconds, workers):
+    """workers プロセスで同時にハッシュしたときの合計スループット"""
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        # プロセス起動のコストを除くため先に1回ずつ実行
+        list(executor.map(hash_for, [method] * workers, [0] * workers))
+        started = time.perf_counter()
+        counts = list(executor.map(hash_for, [method] * workers, [seconds] * workers))
+        return sum(counts) / (time.perf_counter() - started)
+
+
+def bench_service(seconds):
+    """passwords.hash_password（現在の環境変数の設定）経由のスループット（呼び出し1スレッド）"""
+    import passwords
+    passwords.hash_password('warm up')
+    count = 0
+    started = time.perf_counter()
+    deadline = started + seconds
+    while time.perf_counter() < deadline:
+        passwords.hash_password('correct horse battery staple')
+        count += 1
+    elapsed = time.perf_counter() - started
+    passwords.shutdown()
+    return passwords.HASH_METHOD, passwords.WORKERS, count / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='パスワードハッシュの速度計測')
+    parser.add_argument('--methods', nargs='+', default=DEFAULT_METHODS)
+    parser.add_argument('--seconds', type=float, default=3.0, help='1項目あたりの計測時間')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='プール計測のプロセス数')
+    args = parser.parse_args()
+
+    print(f"CPU コア数: {os.cpu_count()}  プール計測のプロセス数: {args.workers}")
+    print(f"{'method':<24} {'1コアあたり/秒':>14} {'1回(ms)':>9} {'プール合計/秒':>14}")
+    for method in args.methods:
+        per_core = bench_single(method, args.seconds)
+        pooled = bench_pool(method, args.seconds, args.workers)
+        print(f"{method:<24} {per_core:>14.1f} {1000 / per_core:>9.1f} {pooled:>14.1f}")
+
+    method, workers, rate = bench_service(args.seconds)
+    print(f"\npasswords.hash_password（PASSWORD_HASH_METHOD={method}, PASSWORD_HASH_WORKERS={workers}）: {rate:.1f} 回/秒")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+# bench/synthetic_data.py - 負荷試験用の合成データの生成
+"""
+ユーザーとログを指定した規模で生成して DATABASE_URL（SQLite / PostgreSQL）に登録する。
+同じ --seed なら同じデータになる。
+
+    python bench/synthetic_data.py --database-url sqlite:////tmp/bench.db --users 100 --logs-per-user 500
+    python bench/synthetic_data.py --database-url postgresql://localhost/bench --users 10000 --logs-per-user 2000
+
+・タグは実際の使われ方に近づけるため Zipf 分布（よく使うタグに偏る）で選ぶ。
+  ユーザーごとに「よく使うタグ」を数個〜十数個持ち、1件のログに 0〜3 個付ける
+・作業時間は対数正規分布（30〜60分が多く、まれに数時間）、日付は直近 --days 日に分布
+・--calendar-ratio の割合のユーザーにカレンダーIDを設定する（/log でカレンダー登録ジョブが積まれる）
+・ログは log_import.insert_logs で登録するので、タグ・集計テーブル・データバージョンも更新される
+・パスワードは全員 PASSWORD（ハッシュは1回だけ計算して使い回す）
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+from datetime import date, time as dt_time, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+
+PASSWORD = 'BenchPassw0rd!'
+USERNAME_PREFIX = 'bench_'
+
+TAG_VOCABULARY = [
+    'Python', '英語', '読書', 'Flask', 'SQL', '数学', '設計', 'JavaScript', 'TypeScript', 'React',
+    'レビュー', 'ミーティング', 'ドキュメント作成', 'テスト', 'インフラ', 'AWS', 'Docker', 'Linux', 'Git', 'CSS',
+    'アルゴリズム', '統計', '機械学習', '資格勉強', 'TOEIC', '簿記', '写経', 'リファクタリング', '調査', '障害対応',
+    'PostgreSQL', 'Redis', 'Go', 'Rust', 'Java', 'Kotlin', 'Swift', '設計レビュー', '面談', '1on1',
+    '朝活', 'ランニング', '筋トレ', '日記', '英会話', '中国語', '動画教材', 'オンライン講座', '輪読会', 'もくもく会',
+    'ポートフォリオ', 'ブログ執筆', 'OSS', 'セキュリティ', 'ネットワーク', 'UI', 'UX', 'デザイン', '企画', '振り返り',
+]
+CONTENTS = [
+    'チュートリアルを進めた', '問題集を解いた', '本を1章読んだ', '機能を実装した', 'バグを修正した',
+    '資料をまとめた', '動画講座を視聴した', '過去問を復習した', 'コードレビューをした', '設計を見直した',
+]
+IMPRESSIONS = ['', '', '', '思ったより進んだ', '難しかった', '集中できた', '明日も続ける']
+
+
+def zipf_weights(count, exponent=1.1):
+    return [1 / (rank ** exponent) for rank in range(1, count + 1)]
+
+
+def user_profile(rng):
+    """ユーザーごとのよく使うタグ（Zipf で選んだ重複なしの数個〜十数個）"""
+    weights = zipf_weights(len(TAG_VOCABULARY))
+    favorites = []
+    target = rng.randint(3, 15)
+    while len(favorites) < target:
+        tag = rng.choices(TAG_VOCABULARY, weights)[0]
+        if tag not in favorites:
+            favorites.append(tag)
+    return favorites
+
+
+def generate_log(rng, favorites, today, days):
+    tag_count = rng.choices([0, 1, 2, 3], [10, 50, 30, 10])[0]
+    tags = []
+    weights = zipf_weights(len(favorites), 1.3)
+    for _ in range(tag_count):
+        tag = rng.choices(favorites, weights)[0]
+        if tag not in tags:
+            tags.append(tag)
+    duration = int(min(480, max(5, rng.lognormvariate(math.log(45), 0.6))) // 5 * 5)
+    return {
+        'date': today - timedelta(days=int(rng.triangular(0, days, 0))),
+        'start_time': dt_time(rng.randint(6, 23), rng.choice([0, 15, 30, 45])),
+        'duration': duration,
+        'content': rng.choice(CONTENTS),
+        'impression': rng.choice(IMPRESSIONS),
+        'tags': ', '.join(tags),
+    }
+
+
+def generate(database_url, users, logs_per_user, days=365, seed=1, calendar_ratio=0.0, progress=True):
+    """
+    合成データを登録し、(ユーザーIDのリスト, 登録したログ件数) を返す
+    DATABASE_URL などの環境変数を設定してからアプリのモジュールを読み込むので、
+    呼び出し元ではまだ app / db を import していないこと
+    """
+    os.environ['DATABASE_URL'] = database_url
+    os.environ.setdefault('SECRET_KEY', 'bench')
+    os.environ.setdefault('REDIS_EXTERNAL_URL', 'memory://')
+    os.environ.setdefault('PASSWORD_HASH_WORKERS', '0')
+    sys.path.insert(0, ROOT_DIR)
+
+    from sqlalchemy import insert
+
+    import app as app_module
+    import log_import
+    import passwords
+    from db import Session, User
+
+    app_module.bootstrap_database()
+    rng = random.Random(seed)
+    password_hash = passwords.hash_password(PASSWORD)
+    today = date.today()
+
+    with Session() as session:
+        session.execute(insert(User), [{
+            'email': f'{USERNAME_PREFIX}{n}@example.com',
+            'username': f'{USERNAME_PREFIX}{n}',
+            'password_hash': password_hash,
+            'calendar_id': 'bench@group.calendar.google.com' if rng.random() < calendar_ratio else None,
+        } for n in range(users)])
+        session.commit()
+        user_ids = [user_id for (user_id,) in session.query(User.id).filter(
+            User.username.like(f'{USERNAME_PREFIX}%')
+        ).order_by(User.id)]
+
+    started = time.perf_counter()
+    total = 0
+    for index, user_id in enumerate(user_ids, 1):
+        favorites = user_profile(rng)
+        values_list = [generate_log(rng, favorites, today, days) for _ in range(logs_per_user)]
+        with Session() as session:
+            log_import.insert_logs(session, user_id, values_list)
+            session.commit()
+        total += len(values_list)
+        if progress and (index % 100 == 0 or index == len(user_ids)):
+            elapsed = time.perf_counter() - started
+            print(f"{index}/{len(user_ids)} ユーザー  ログ {total} 件  {total / elapsed:.0f} 件/秒", file=sys.stderr)
+    return user_ids, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description='負荷試験用の合成データを生成する')
+    parser.add_argument('--database-url', required=True)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--logs-per-user', type=int, default=500)
+    parser.add_argument('--days', type=int, default=365, help='ログの日付の範囲（直近の日数）')
+    parser.add_argument('--calendar-ratio', type=float, default=0.3, help='カレンダーIDを設定するユーザーの割合')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    user_ids, total = generate(args.database_url, args.users, args.logs_per_user,
+                               args.days, args.seed, args.calendar_ratio)
+    print(json.dumps({
+        'users': len(user_ids),
+        'logs': total,
+        'seconds': round(time.perf_counter() - started, 1),
+    }))
+
+
+if __name__ == '__main__':
+    main()
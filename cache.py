@@ -0,0 +1,199 @@
+# cache.py - ユーザー単位のデータバージョンとAPIレスポンスのキャッシュ
+"""
+ログが変更されるたびに users.data_version を1つ進め、
+集計APIのレスポンスは (ユーザー, バージョン) をキーに Redis へ保存する。
+
+・If-None-Match が現在の ETag と一致すれば、集計もRedisも使わずに 304 を返す
+・一致しなければ Redis を GET し、無ければ集計して保存する
+・Redis が使えない環境（memory:// や接続失敗）ではプロセス内のキャッシュを使う
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from functools import wraps
+
+from flask import request, current_app, make_response
+from flask_login import current_user
+
+from db import User
+
+CACHE_TTL_SECONDS = 24 * 60 * 60
+LOCAL_CACHE_SIZE = 512
+# Redis でエラーが出たらこの秒数はプロセス内キャッシュだけを使う
+REDIS_RETRY_SECONDS = 30
+
+_redis_client = None
+_async_redis_client = None
+_redis_url = None
+_redis_disabled_until = 0.0
+
+
+def init_cache(redis_url):
+    """Redis の接続先を設定する（接続は最初に使うときに行う）"""
+    global _redis_url, _redis_client, _async_redis_client
+    _redis_url = redis_url
+    _redis_client = None
+    _async_redis_client = None
+
+
+def get_redis():
+    """Redis クライアント（使えない場合は None）"""
+    global _redis_client
+    if time.monotonic() < _redis_disabled_until:
+        return None
+    if _redis_client is None and _redis_url and _redis_url.startswith(('redis://', 'rediss://')):
+        import redis
+        _redis_client = redis.Redis.from_url(
+            _redis_url, socket_timeout=0.5, socket_connect_timeout=0.5
+        )
+    return _redis_client
+
+
+def get_async_redis():
+    """asyncio 用の Redis クライアント（async_api から使う。使えない場合は None）"""
+    global _async_redis_client
+    if time.monotonic() < _redis_disabled_until:
+        return None
+    if _async_redis_client is None and _redis_url and _redis_url.startswith(('redis://', 'rediss://')):
+        import redis.asyncio
+        _async_redis_client = redis.asyncio.Redis.from_url(
+            _redis_url, socket_timeout=0.5, socket_connect_timeout=0.5
+        )
+    return _async_redis_client
+
+
+class _LocalCache:
+    """Redis が使えないとき用の小さな LRU キャッシュ"""
+
+    def __init__(self, size):
+        self._data = OrderedDict()
+        self._size = size
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self._size:
+                self._data.popitem(last=False)
+
+
+_local_cache = _LocalCache(LOCAL_CACHE_SIZE)
+
+
+def disable_redis(error):
+    global _redis_disabled_until
+    _redis_disabled_until = time.monotonic() + REDIS_RETRY_SECONDS
+    print(f"Redis エラー（{REDIS_RETRY_SECONDS}秒間プロセス内キャッシュを使用）: {type(error).__name__}: {error}")
+
+
+def cache_get(key):
+    client = get_redis()
+    if client is not None:
+        try:
+            return client.get(key)
+        except Exception as e:
+            disable_redis(e)
+    return _local_cache.get(key)
+
+
+def cache_set(key, value, ttl=CACHE_TTL_SECONDS):
+    client = get_redis()
+    if client is not None:
+        try:
+            client.set(key, value, ex=ttl)
+            return
+        except Exception as e:
+            disable_redis(e)
+    _local_cache.set(key, value)
+
+
+async def async_cache_get(key):
+    client = get_async_redis()
+    if client is not None:
+        try:
+            return await client.get(key)
+        except Exception as e:
+            disable_redis(e)
+    return _local_cache.get(key)
+
+
+async def async_cache_set(key, value, ttl=CACHE_TTL_SECONDS):
+    client = get_async_redis()
+    if client is not None:
+        try:
+            await client.set(key, value, ex=ttl)
+            return
+        except Exception as e:
+            disable_redis(e)
+    _local_cache.set(key, value)
+
+
+# ── データバージョン ─────────────────────────────
+
+def bump_data_version(session, user_id):
+    """
+    ユーザーのデータバージョンを進める（ログを追加・変更・削除したときに呼ぶ）
+    commit は呼び出し側で行う（ログの変更と同一トランザクションにするため）
+    """
+    session.query(User).filter(User.id == user_id).update(
+        {User.data_version: User.data_version + 1},
+        synchronize_session=False
+    )
+    # current_user のスナップショットにも data_version が入っているので無効化する
+    from user_cache import invalidate_user_after_commit
+    invalidate_user_after_commit(session, user_id)
+
+
+def versioned_cache_key(name, user_id, version, per_day=False):
+    """レスポンスキャッシュのキーと ETag（Flask 版と asyncio 版の API で共通）"""
+    key_parts = [name, str(user_id), str(version or 0)]
+    if per_day:
+        key_parts.append(date.today().isoformat())
+    cache_key = 'v1:' + ':'.join(key_parts)
+    etag = hashlib.sha256(cache_key.encode('utf-8')).hexdigest()[:32]
+    return cache_key, etag
+
+
+def versioned_json(name, per_day=False):
+    """
+    ユーザーのデータバージョンでレスポンスをキャッシュするデコレーター
+
+    per_day=True のときは日付もキーに含める（「直近30日」など日付で内容が変わるAPI用）
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            cache_key, etag = versioned_cache_key(
+                name, current_user.id, current_user.data_version, per_day
+            )
+
+            # クライアントが最新版を持っていれば本文なしで返す
+            if request.if_none_match.contains(etag):
+                response = make_response('', 304)
+            else:
+                body = cache_get(cache_key)
+                if body is None:
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                    cache_set(cache_key, response.get_data())
+                else:
+                    response = current_app.response_class(body, mimetype='application/json')
+
+            response.set_etag(etag)
+            # ブラウザにはキャッシュさせるが、毎回 ETag で再検証させる
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,225 @@
+# calendar_backfill.py - 既存ログのカレンダー一括登録
+"""
+カレンダー連携を後から設定したユーザー向けに、未登録のログを
+Calendar API のバッチリクエスト（1回最大50件）でまとめて登録する。
+
+・ログID順に処理し、バッチごとに calendar_backfills.last_log_id を保存（中断しても続きから再開）
+・レート制限（429、レート制限の 403）や 5xx は指数バックオフで再試行（権限エラーの 403 は再試行しない）
+・API の呼び出し中（再試行の待ち時間を含む）は DB のセッションを閉じておく
+・バッチ間に CALENDAR_BACKFILL_MIN_INTERVAL 秒の間隔を空けて API の割り当てを守る
+"""
+
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_
+
+from db import Session, Log, CalendarBackfill
+from google_calendar import CalendarError, MAX_BATCH_SIZE, get_calendar_backend
+from calendar_queue import STATUS_SYNCED, STATUS_FAILED, event_body_for_log
+
+BATCH_SIZE = min(MAX_BATCH_SIZE, int(os.getenv('CALENDAR_BACKFILL_BATCH_SIZE', str(MAX_BATCH_SIZE))))
+MIN_INTERVAL_SECONDS = float(os.getenv('CALENDAR_BACKFILL_MIN_INTERVAL', '5'))
+MAX_RETRIES = int(os.getenv('CALENDAR_BACKFILL_MAX_RETRIES', '5'))
+# バックフィル中のバッチ再試行は短めの待ち時間にする
+RETRY_BASE_SECONDS = float(os.getenv('CALENDAR_BACKFILL_RETRY_BASE', '2'))
+LEASE_SECONDS = 300
+
+
+def start_backfill(session, user_id, calendar_id):
+    """
+    バックフィルを登録する（同じユーザーの実行中のものがあればそれを返す）
+    commit は呼び出し側で行う
+    """
+    active = session.query(CalendarBackfill).filter(
+        CalendarBackfill.user_id == user_id,
+        CalendarBackfill.status.in_(['pending', 'running'])
+    ).first()
+    if active:
+        return active
+
+    backfill = CalendarBackfill(
+        user_id=user_id,
+        calendar_id=calendar_id,
+        status='pending',
+        last_log_id=0,
+        synced_count=0,
+        failed_count=0
+    )
+    session.add(backfill)
+    return backfill
+
+
+def latest_backfill(session, user_id):
+    """ユーザーの最新のバックフィル"""
+    return session.query(CalendarBackfill).filter_by(
+        user_id=user_id
+    ).order_by(CalendarBackfill.id.desc()).first()
+
+
+def count_unsynced_logs(session, user_id):
+    """カレンダー未登録（または失敗）のログ件数"""
+    return _unsynced_query(session, user_id).count()
+
+
+def backfill_to_dict(backfill, remaining=None):
+    """進捗を JSON 用の辞書にする"""
+    if backfill is None:
+        return {'status': None, 'remaining': remaining}
+    return {
+        'id': backfill.id,
+        'status': backfill.status,
+        'synced': backfill.synced_count,
+        'failed': backfill.failed_count,
+        'last_error': backfill.last_error,
+        'remaining': remaining,
+    }
+
+
+def _unsynced_query(session, user_id, after_id=0):
+    return session.query(Log).filter(
+        Log.user_id == user_id,
+        Log.id > after_id,
+        or_(Log.calendar_status.is_(None), Log.calendar_status == STATUS_FAILED)
+    )
+
+
+def _send_batch(backend, calendar_id, items, sleep):
+    """
+    1バッチ分を登録する。再試行可能な失敗は指数バックオフで再送
+    items: [(ログID, イベント本文), ...]
+    Returns: [(ログID, 作成されたイベント or CalendarError), ...]
+    """
+    outcomes = {}
+    pending = list(items)
+
+    for attempt in range(MAX_RETRIES + 1):
+        results = backend.insert_events_batch(calendar_id, [body for _, body in pending])
+
+        retry = []
+        for item, result in zip(pending, results):
+            if isinstance(result, CalendarError) and result.retryable and attempt < MAX_RETRIES:
+                retry.append(item)
+            else:
+                outcomes[item[0]] = result
+
+        if not retry:
+            break
+
+        delay = min(60.0, RETRY_BASE_SECONDS * (2 ** attempt)) * random.uniform(1.0, 1.1)
+        print(f"カレンダー一括登録: {len(retry)} 件を {delay:.1f} 秒後に再送します")
+        sleep(delay)
+        pending = retry
+
+    return [(log_id, outcomes[log_id]) for log_id, _ in items]
+
+
+def run_backfill(backfill_id, backend=None, max_batches=None, sleep=time.sleep):
+    """
+    バックフィルを実行する（チェックポイントから再開）
+
+    バッチごとに「対象ログの読み込み → API で登録 → 結果とチェックポイントの保存」を行い、
+    API の呼び出し中はセッションを閉じておく（バックオフで数分待っても DB 接続を占有しない）。
+    max_batches を指定するとその回数で処理を区切る（ワーカーで他のジョブと交互に実行するため）。
+    戻り値は処理したバッチ数。
+    """
+    backend = backend or get_calendar_backend()
+    batches = 0
+
+    while max_batches is None or batches < max_batches:
+        started = time.monotonic()
+
+        with Session() as session:
+            backfill = session.get(CalendarBackfill, backfill_id)
+            if backfill is None or backfill.status in ('done', 'failed'):
+                return batches
+
+            logs = _unsynced_query(
+                session, backfill.user_id, backfill.last_log_id
+            ).order_by(Log.id).limit(BATCH_SIZE).all()
+
+            if not logs:
+                backfill.status = 'done'
+                backfill.locked_until = None
+                session.commit()
+                print(f"カレンダー一括登録が完了しました (backfill={backfill.id}, "
+                      f"成功 {backfill.synced_count} 件, 失敗 {backfill.failed_count} 件)")
+                return batches
+
+            backfill.status = 'running'
+            backfill.locked_until = datetime.utcnow() + timedelta(seconds=LEASE_SECONDS)
+            calendar_id = backfill.calendar_id
+            items = [(log.id, event_body_for_log(log)) for log in logs]
+            session.commit()
+
+        outcomes = _send_batch(backend, calendar_id, items, sleep)
+
+        with Session() as session:
+            backfill = session.get(CalendarBackfill, backfill_id)
+            if backfill is None:
+                # 送信中にユーザー（バックフィル）が削除された
+                return batches
+
+            # 送信中に削除されたログは結果を保存しない
+            log_ids = [log_id for log_id, _ in items]
+            logs = {log.id: log for log in session.query(Log).filter(Log.id.in_(log_ids))}
+            for log_id, result in outcomes:
+                log = logs.get(log_id)
+                if log is None:
+                    continue
+                if isinstance(result, CalendarError):
+                    log.calendar_status = STATUS_FAILED
+                    backfill.failed_count += 1
+                    backfill.last_error = str(result)[:1000]
+                else:
+                    log.calendar_status = STATUS_SYNCED
+                    log.calendar_event_link = result.get('htmlLink')
+                    backfill.synced_count += 1
+
+            # チェックポイントを保存
+            backfill.last_log_id = items[-1][0]
+            session.commit()
+
+        batches += 1
+
+        # 割り当て（QPS）を守るためにバッチ間隔を空ける
+        elapsed = time.monotonic() - started
+        if elapsed < MIN_INTERVAL_SECONDS:
+            sleep(MIN_INTERVAL_SECONDS - elapsed)
+
+    return batches
+
+
+def process_pending_backfills(max_batches=5, backend=None):
+    """ワーカー用: 未完了のバックフィルを1件選んで max_batches バッチ分進める"""
+    now = datetime.utcnow()
+
+    with Session() as session:
+        query = session.query(CalendarBackfill).filter(
+            CalendarBackfill.status.in_(['pending', 'running']),
+            or_(CalendarBackfill.locked_until.is_(None), CalendarBackfill.locked_until < now)
+        ).order_by(CalendarBackfill.updated_at)
+
+        if session.get_bind().dialect.name == 'postgresql':
+            query = query.with_for_update(skip_locked=True)
+
+        backfill = query.first()
+        if backfill is None:
+            return 0
+
+        backfill.status = 'running'
+        backfill.locked_until = now + timedelta(seconds=LEASE_SECONDS)
+        backfill_id = backfill.id
+        session.commit()
+
+    try:
+        return run_backfill(backfill_id, backend, max_batches=max_batches)
+    finally:
+        # 他のワーカーも続きを取れるようにリースを外す
+        with Session() as session:
+            backfill = session.get(CalendarBackfill, backfill_id)
+            if backfill is not None:
+                backfill.locked_until = None
+                session.commit()
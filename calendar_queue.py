@@ -0,0 +1,168 @@
+# calendar_queue.py - Googleカレンダー登録のジョブキュー
+"""
+/log はジョブを calendar_sync_jobs に積んで即座に返し、
+worker.py がジョブを取り出してカレンダーへ登録する。
+
+・失敗時は指数バックオフで再試行（CALENDAR_JOB_MAX_ATTEMPTS 回まで）
+・処理中のジョブはリース（locked_until）で保持し、ワーカーが落ちても期限後に再取得
+・イベントIDはログIDから決まるので、再送しても重複登録されない
+"""
+
+import os
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_, and_
+
+from db import Session, Log, CalendarSyncJob
+from google_calendar import (
+    CalendarError, build_event_body, event_id_for_log, get_calendar_backend
+)
+
+MAX_ATTEMPTS = int(os.getenv('CALENDAR_JOB_MAX_ATTEMPTS', '8'))
+BACKOFF_BASE_SECONDS = int(os.getenv('CALENDAR_JOB_BACKOFF_BASE', '30'))
+BACKOFF_MAX_SECONDS = int(os.getenv('CALENDAR_JOB_BACKOFF_MAX', str(6 * 60 * 60)))
+LEASE_SECONDS = 300
+
+# Log.calendar_status の値
+STATUS_PENDING = 'pending'
+STATUS_SYNCED = 'synced'
+STATUS_FAILED = 'failed'
+
+
+def enqueue_log_sync(session, log, calendar_id):
+    """
+    ログのカレンダー登録ジョブを追加する
+    commit は呼び出し側で行う（ログ本体と同一トランザクションにするため）
+    """
+    if log.id is None:
+        session.flush()
+
+    log.calendar_status = STATUS_PENDING
+    job = CalendarSyncJob(
+        log_id=log.id,
+        user_id=log.user_id,
+        calendar_id=calendar_id,
+        status='pending',
+        attempts=0,
+        next_run_at=datetime.utcnow()
+    )
+    session.add(job)
+    return job
+
+
+def enqueue_logs_sync(session, user_id, log_ids, calendar_id):
+    """
+    複数ログのカレンダー登録ジョブをまとめて追加する（一括登録用）
+    commit は呼び出し側で行う
+    """
+    if not log_ids:
+        return
+
+    now = datetime.utcnow()
+    session.query(Log).filter(Log.id.in_(log_ids)).update(
+        {Log.calendar_status: STATUS_PENDING}, synchronize_session=False
+    )
+    session.bulk_insert_mappings(CalendarSyncJob, [
+        {
+            'log_id': log_id,
+            'user_id': user_id,
+            'calendar_id': calendar_id,
+            'status': 'pending',
+            'attempts': 0,
+            'next_run_at': now,
+        }
+        for log_id in log_ids
+    ])
+
+
+def event_body_for_log(log):
+    """ログからイベント本文を作成（イベントIDはログIDから決まる）"""
+    return build_event_body(
+        log.date, log.start_time, log.duration,
+        log.content, log.impression, log.tags,
+        event_id=event_id_for_log(log.id)
+    )
+
+
+def backoff_seconds(attempts):
+    """attempts 回目の失敗後に待つ秒数（指数バックオフ + 最大10%のジッター）"""
+    delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** max(attempts - 1, 0)))
+    return delay + random.uniform(0, delay * 0.1)
+
+
+def claim_jobs(session, limit=20, now=None):
+    """実行可能なジョブを取得してリースする（PostgreSQL では SKIP LOCKED で他ワーカーと分担）"""
+    now = now or datetime.utcnow()
+
+    query = session.query(CalendarSyncJob).filter(or_(
+        and_(CalendarSyncJob.status == 'pending', CalendarSyncJob.next_run_at <= now),
+        # リース切れ（ワーカーが途中で落ちた）のジョブも再取得
+        and_(CalendarSyncJob.status == 'running', CalendarSyncJob.locked_until < now),
+    )).order_by(CalendarSyncJob.next_run_at).limit(limit)
+
+    if session.get_bind().dialect.name == 'postgresql':
+        query = query.with_for_update(skip_locked=True)
+
+    jobs = query.all()
+    for job in jobs:
+        job.status = 'running'
+        job.locked_until = now + timedelta(seconds=LEASE_SECONDS)
+        job.attempts += 1
+    session.commit()
+    return jobs
+
+
+def run_job(session, job, backend):
+    """ジョブ1件を実行して結果を保存する。成功したら True"""
+    now = datetime.utcnow()
+    log = session.get(Log, job.log_id)
+
+    if log is None:
+        # ログが削除済み
+        job.status = 'done'
+        job.last_error = 'log deleted'
+        session.commit()
+        return False
+
+    event_body = event_body_for_log(log)
+
+    try:
+        created = backend.insert_event(job.calendar_id, event_body)
+    except CalendarError as e:
+        job.last_error = str(e)[:1000]
+        job.locked_until = None
+        if e.retryable and job.attempts < MAX_ATTEMPTS:
+            job.status = 'pending'
+            job.next_run_at = now + timedelta(seconds=backoff_seconds(job.attempts))
+            print(f"カレンダー登録を再試行予定 (job={job.id}, attempts={job.attempts}): {e}")
+        else:
+            job.status = 'failed'
+            log.calendar_status = STATUS_FAILED
+            print(f"カレンダー登録に失敗 (job={job.id}): {e}")
+        session.commit()
+        return False
+
+    job.status = 'done'
+    job.locked_until = None
+    job.last_error = None
+    log.calendar_status = STATUS_SYNCED
+    log.calendar_event_link = created.get('htmlLink')
+    session.commit()
+    return True
+
+
+def process_due_jobs(limit=20, backend=None):
+    """実行可能なジョブをまとめて処理し、処理件数を返す"""
+    backend = backend or get_calendar_backend()
+
+    with Session() as session:
+        jobs = claim_jobs(session, limit)
+        for job in jobs:
+            try:
+                run_job(session, job, backend)
+            except Exception as e:
+                # 想定外のエラーでも他のジョブは続行（リース切れ後に再取得される）
+                session.rollback()
+                print(f"カレンダージョブ処理エラー (job={job.id}): {type(e).__name__}: {e}")
+        return len(jobs)
@@ -0,0 +1,249 @@
+# check_calendar_backfill.py - カレンダー一括登録の動作確認（ローカルの代替サーバー）
+"""
+Calendar API の代わりにローカルで HTTP サーバー（トークン発行・バッチエンドポイント）を起動し、
+CALENDAR_API_ROOT をそこに向けて calendar_backfill.run_backfill を実行する。
+GoogleCalendarBackend（googleapiclient のバッチリクエスト・サービスアカウント認証）をそのまま通すので、
+Google のアカウントやネットワークは不要（DB は一時ディレクトリの SQLite）。
+
+    python check_calendar_backfill.py
+    python check_calendar_backfill.py --logs 300
+
+確認する内容
+・権限エラー以外のログがカレンダー登録済みになり、チェックポイント（last_log_id）が最後のログまで進む
+・レート制限（403 rateLimitExceeded）を返したイベントは再送されて登録される
+・権限エラー（403 forbidden）のイベントは再送せずに失敗として記録される
+・登録済みのイベントID（409）は成功として扱われる
+・API を呼び出している間は DB 接続をチェックアウトしていない（セッションを閉じている）
+
+1つでも満たさなければ終了コード 1 を返す。
+"""
+
+import argparse
+import email
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+from datetime import date, time, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BOUNDARY = 'batch_stand_in'
+HTTP_REASONS = {200: 'OK', 403: 'Forbidden', 404: 'Not Found', 409: 'Conflict'}
+
+
+class CalendarStandIn(ThreadingHTTPServer):
+    """
+    トークン発行（/token）と Calendar API のバッチ（/batch/calendar/v3）だけに応答するサーバー
+
+    rate_limited のイベントIDは1回目だけ 403 rateLimitExceeded、forbidden のイベントIDは毎回 403 forbidden、
+    existing のイベントIDは 409 を返す。
+    バッチを受け取るたびに connections_in_use() の値を記録する。
+    """
+
+    daemon_threads = True
+
+    def __init__(self, connections_in_use):
+        super().__init__(('127.0.0.1', 0), _StandInHandler)
+        self.connections_in_use = connections_in_use
+        self.lock = threading.Lock()
+        self.rate_limited = set()
+        self.forbidden = set()
+        self.existing = set()
+        self.attempts = {}
+        self.created = {}
+        self.batch_requests = 0
+        self.connections_during_calls = []
+
+    @property
+    def root(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def respond(self, event_body):
+        """イベント1件分の (ステータス, 応答の JSON)"""
+        event_id = event_body['id']
+        with self.lock:
+            self.attempts[event_id] = self.attempts.get(event_id, 0) + 1
+            if event_id in self.rate_limited:
+                self.rate_limited.discard(event_id)
+                return 403, _error(403, 'Rate Limit Exceeded', 'rateLimitExceeded')
+            if event_id in self.forbidden:
+                return 403, _error(403, 'You need to have writer access to this calendar.', 'forbidden')
+            if event_id in self.existing:
+                return 409, _error(409, 'The requested identifier already exists.', 'duplicate')
+            created = dict(event_body, htmlLink=f'https://calendar.invalid/event?eid={event_id}')
+            self.created[event_id] = created
+            return 200, created
+
+
+def _error(code, message, reason):
+    return {'error': {'code': code, 'message': message, 'errors': [{'domain': 'calendar', 'reason': reason}]}}
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path == '/token':
+            self._send(200, 'application/json', json.dumps({
+                'access_token': 'stand-in-token', 'expires_in': 3600, 'token_type': 'Bearer'
+            }))
+        elif self.path.startswith('/batch/calendar/v3'):
+            self._send(200, f'multipart/mixed; boundary={BOUNDARY}', self._batch(body))
+        else:
+            self._send(404, 'application/json', json.dumps(_error(404, 'Not Found', 'notFound')))
+
+    def _batch(self, body):
+        server = self.server
+        with server.lock:
+            server.batch_requests += 1
+            server.connections_during_calls.append(server.connections_in_use())
+
+        message = email.message_from_bytes(
+            f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body
+        )
+        parts = []
+        for part in message.get_payload():
+            http_request = part.get_payload()
+            event_body = json.loads(re.split(r'\r?\n\r?\n', http_request, maxsplit=1)[1])
+            status, payload = server.respond(event_body)
+            parts.append(
+                f"--{BOUNDARY}\r\n"
+                f"Content-Type: application/http\r\n"
+                f"Content-ID: <response-{part['Content-ID'][1:-1]}>\r\n\r\n"
+                f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n"
+                f"Content-Type: application/json; charset=UTF-8\r\n\r\n"
+                f"{json.dumps(payload)}\r\n"
+            )
+        return ''.join(parts) + f'--{BOUNDARY}--\r\n'
+
+    def _send(self, status, content_type, text):
+        data = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def service_account_info(token_uri):
+    """代替サーバーでトークンを発行するサービスアカウント（鍵はその場で生成）"""
+    import rsa
+
+    _, private_key = rsa.newkeys(1024)
+    return {
+        'type': 'service_account',
+        'project_id': 'stand-in',
+        'private_key_id': 'stand-in',
+        'private_key': private_key.save_pkcs1().decode('ascii'),
+        'client_email': 'stand-in@stand-in.iam.gserviceaccount.com',
+        'token_uri': token_uri,
+    }
+
+
+def make_logs(count):
+    today = date.today()
+    return [{
+        'date': today - timedelta(days=n % 60),
+        'start_time': time(6 + n % 16, 0),
+        'duration': 30,
+        'content': f'確認用のログ {n}',
+        'impression': '',
+        'tags': 'Python' if n % 2 else '',
+    } for n in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='カレンダー一括登録をローカルの代替サーバーに対して実行する')
+    parser.add_argument('--logs', type=int, default=120, help='登録するログ件数')
+    args = parser.parse_args()
+
+    checked_out = [0]
+    stand_in = CalendarStandIn(lambda: checked_out[0])
+    threading.Thread(target=stand_in.serve_forever, daemon=True).start()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # 以下のモジュールは読み込み時に環境変数を読むので、設定してからインポートする
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp_dir, 'check.db')}"
+        os.environ['CALENDAR_API_ROOT'] = stand_in.root
+        os.environ['SERVICE_CRED_JSON'] = json.dumps(service_account_info(stand_in.root + '/token'))
+        os.environ['CALENDAR_BACKFILL_MIN_INTERVAL'] = '0'
+
+        from sqlalchemy import event
+
+        import calendar_backfill
+        import log_import
+        from db import Base, CalendarBackfill, Log, Session, User, engine
+        from google_calendar import GoogleCalendarBackend, event_id_for_log
+
+        def on_checkout(*_):
+            checked_out[0] += 1
+
+        def on_checkin(*_):
+            checked_out[0] -= 1
+
+        event.listen(engine, 'checkout', on_checkout)
+        event.listen(engine, 'checkin', on_checkin)
+        Base.metadata.create_all(engine)
+
+        calendar_id = 'stand-in@group.calendar.google.com'
+        with Session() as session:
+            user = User(email='check@example.com', username='check', password_hash='-', calendar_id=calendar_id)
+            session.add(user)
+            session.flush()
+            log_ids = log_import.insert_logs(session, user.id, make_logs(args.logs))
+            backfill = calendar_backfill.start_backfill(session, user.id, calendar_id)
+            session.commit()
+            backfill_id = backfill.id
+
+        event_ids = [event_id_for_log(log_id) for log_id in log_ids]
+        stand_in.rate_limited.update(event_ids[::7])
+        stand_in.existing.update(event_ids[3::11])
+        stand_in.forbidden.update(event_ids[5::13])
+        rate_limited = set(stand_in.rate_limited)
+
+        forbidden_ids = [log_id for log_id, event_id in zip(log_ids, event_ids) if event_id in stand_in.forbidden]
+
+        batches = calendar_backfill.run_backfill(backfill_id, GoogleCalendarBackend(), sleep=lambda seconds: None)
+
+        with Session() as session:
+            backfill = session.get(CalendarBackfill, backfill_id)
+            statuses = dict(session.query(Log.id, Log.calendar_status).filter(Log.id.in_(log_ids)))
+            result = {
+                'status': backfill.status,
+                'synced': backfill.synced_count,
+                'failed': backfill.failed_count,
+                'last_log_id': backfill.last_log_id,
+            }
+        engine.dispose()
+    stand_in.shutdown()
+
+    checks = [
+        ('バックフィルが完了した', result['status'] == 'done'),
+        ('権限エラー以外が登録済み', result['synced'] == len(log_ids) - len(forbidden_ids)
+         and all(statuses[log_id] == calendar_backfill.STATUS_SYNCED
+                 for log_id, event_id in zip(log_ids, event_ids) if event_id not in stand_in.forbidden)),
+        ('権限エラーは再送せず失敗', result['failed'] == len(forbidden_ids)
+         and all(statuses[log_id] == calendar_backfill.STATUS_FAILED for log_id in forbidden_ids)
+         and all(stand_in.attempts[event_id] == 1 for event_id in stand_in.forbidden - rate_limited)),
+        ('チェックポイントが最後のログまで進んだ', result['last_log_id'] == max(log_ids)),
+        ('レート制限のイベントは再送された', all(stand_in.attempts[event_id] == 2 for event_id in rate_limited)),
+        ('409 のイベントは1回で成功扱い', all(stand_in.attempts[event_id] == 1
+                                          for event_id in stand_in.existing - rate_limited - stand_in.forbidden)),
+        ('API 呼び出し中に DB 接続を持っていない', max(stand_in.connections_during_calls, default=0) == 0),
+    ]
+
+    print(f"ログ {len(log_ids)} 件  バッチ {batches} 回  バッチリクエスト {stand_in.batch_requests} 回  {result}")
+    failures = 0
+    for label, ok in checks:
+        print(f"{'OK' if ok else 'NG'}: {label}")
+        failures += not ok
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,200 @@
+# check_calendar_queue.py - カレンダー登録ジョブキューの動作確認（偽のバックエンド）
+"""
+FakeCalendarBackend を元にイベントIDごとに応答を決めたバックエンドで
+calendar_queue.process_due_jobs を実行し、ジョブの成功・再試行・失敗・再取得の扱いを確認する。
+エラーは Calendar API の HttpError から GoogleCalendarBackend と同じ変換で作るので、
+403 の分類（レート制限は再試行、権限エラーは再試行しない）もあわせて確認できる。
+Google のアカウントやネットワークは不要（DB は一時ディレクトリの SQLite）。
+
+    python check_calendar_queue.py
+
+確認する内容
+・成功したジョブは完了になり、ログがカレンダー登録済みになる
+・再試行できるエラー（403 rateLimitExceeded）は指数バックオフで再試行予定になり、
+  待ち時間の間は取得されず、CALENDAR_JOB_MAX_ATTEMPTS 回目で失敗になる
+・再試行できないエラー（403 forbidden）は1回で失敗になる
+・リースの切れた実行中のジョブ（ワーカーが途中で落ちた）は再取得されて完了する
+・ログが削除されたジョブはバックエンドを呼ばずに完了になる
+
+1つでも満たさなければ終了コード 1 を返す。
+"""
+
+import json
+import os
+import sys
+import tempfile
+from datetime import date, datetime, time, timedelta
+
+MAX_ATTEMPTS = 3
+BACKOFF_BASE_SECONDS = 30
+
+
+def http_error(status, reason):
+    """Calendar API が返す形の HttpError"""
+    import httplib2
+    from googleapiclient.errors import HttpError
+
+    content = json.dumps({'error': {'code': status, 'message': reason,
+                                    'errors': [{'domain': 'calendar', 'reason': reason}]}})
+    return HttpError(httplib2.Response({'status': status}), content.encode('utf-8'))
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # 以下のモジュールは読み込み時に環境変数を読むので、設定してからインポートする
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp_dir, 'check.db')}"
+        os.environ['CALENDAR_JOB_MAX_ATTEMPTS'] = str(MAX_ATTEMPTS)
+        os.environ['CALENDAR_JOB_BACKOFF_BASE'] = str(BACKOFF_BASE_SECONDS)
+
+        import calendar_queue
+        import log_import
+        from db import Base, CalendarSyncJob, Log, Session, User, engine
+        from google_calendar import FakeCalendarBackend, _http_error_to_calendar_error, event_id_for_log
+
+        class ScriptedBackend(FakeCalendarBackend):
+            """errors に登録したイベントIDには毎回そのエラーを返す"""
+
+            def __init__(self):
+                super().__init__()
+                self.errors = {}
+                self.attempts = {}
+
+            def insert_event(self, calendar_id, event_body):
+                event_id = event_body['id']
+                self.attempts[event_id] = self.attempts.get(event_id, 0) + 1
+                if event_id in self.errors:
+                    status, reason = self.errors[event_id]
+                    raise _http_error_to_calendar_error(http_error(status, reason), event_body)
+                return super().insert_event(calendar_id, event_body)
+
+        Base.metadata.create_all(engine)
+        backend = ScriptedBackend()
+        calendar_id = 'check@group.calendar.google.com'
+
+        with Session() as session:
+            user = User(email='check@example.com', username='check', password_hash='-', calendar_id=calendar_id)
+            session.add(user)
+            session.flush()
+            user_id = user.id
+            session.commit()
+
+        def add_log(error=None):
+            """ログを1件追加してジョブを積む。error=(ステータス, reason) ならそのイベントは失敗させる"""
+            with Session() as session:
+                log_id, = log_import.insert_logs(session, user_id, [{
+                    'date': date.today(), 'start_time': time(9, 0), 'duration': 30,
+                    'content': '確認用のログ', 'impression': '', 'tags': '',
+                }])
+                calendar_queue.enqueue_log_sync(session, session.get(Log, log_id), calendar_id)
+                session.commit()
+            if error:
+                backend.errors[event_id_for_log(log_id)] = error
+            return log_id
+
+        def job_for(log_id):
+            with Session() as session:
+                job = session.query(CalendarSyncJob).filter_by(log_id=log_id).one()
+                session.expunge(job)
+                return job
+
+        def log_status(log_id):
+            with Session() as session:
+                return session.get(Log, log_id).calendar_status
+
+        def make_due(log_id):
+            """再試行の待ち時間を飛ばす"""
+            with Session() as session:
+                session.query(CalendarSyncJob).filter_by(log_id=log_id).update(
+                    {'next_run_at': datetime.utcnow() - timedelta(seconds=1)})
+                session.commit()
+
+        checks = []
+
+        # 成功
+        succeeded = add_log()
+        processed = calendar_queue.process_due_jobs(backend=backend)
+        job = job_for(succeeded)
+        checks.append(('成功したジョブは完了・ログは登録済み',
+                       processed == 1 and job.status == 'done' and job.attempts == 1
+                       and log_status(succeeded) == calendar_queue.STATUS_SYNCED))
+
+        # 再試行できるエラー
+        rate_limited = add_log(error=(403, 'rateLimitExceeded'))
+        delays = []
+        statuses = []
+        not_claimed_while_waiting = True
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            started = datetime.utcnow()
+            calendar_queue.process_due_jobs(backend=backend)
+            job = job_for(rate_limited)
+            statuses.append(job.status)
+            if job.status == 'pending':
+                delays.append((job.next_run_at - started).total_seconds())
+                calls = backend.attempts[event_id_for_log(rate_limited)]
+                calendar_queue.process_due_jobs(backend=backend)
+                not_claimed_while_waiting &= backend.attempts[event_id_for_log(rate_limited)] == calls
+                make_due(rate_limited)
+        job = job_for(rate_limited)
+        expected_delays = [BACKOFF_BASE_SECONDS * 2 ** n for n in range(MAX_ATTEMPTS - 1)]
+        checks.append(('再試行できるエラーは指数バックオフで再試行予定',
+                       statuses[:-1] == ['pending'] * (MAX_ATTEMPTS - 1)
+                       and all(expected <= delay <= expected * 1.1 + 1
+                               for delay, expected in zip(delays, expected_delays))))
+        checks.append(('待ち時間の間は取得されない', not_claimed_while_waiting))
+        checks.append((f'{MAX_ATTEMPTS} 回目で失敗・ログは失敗',
+                       job.status == 'failed' and job.attempts == MAX_ATTEMPTS
+                       and backend.attempts[event_id_for_log(rate_limited)] == MAX_ATTEMPTS
+                       and log_status(rate_limited) == calendar_queue.STATUS_FAILED))
+
+        # 再試行できないエラー
+        forbidden = add_log(error=(403, 'forbidden'))
+        calendar_queue.process_due_jobs(backend=backend)
+        job = job_for(forbidden)
+        checks.append(('再試行できないエラーは1回で失敗',
+                       job.status == 'failed' and job.attempts == 1
+                       and log_status(forbidden) == calendar_queue.STATUS_FAILED))
+
+        # リース切れの再取得（取得したワーカーが実行前に落ちた）
+        abandoned = add_log()
+        with Session() as session:
+            claimed = calendar_queue.claim_jobs(session)
+        calendar_queue.process_due_jobs(backend=backend)
+        during_lease = job_for(abandoned)
+        called_during_lease = event_id_for_log(abandoned) in backend.attempts
+        with Session() as session:
+            session.query(CalendarSyncJob).filter_by(log_id=abandoned).update(
+                {'locked_until': datetime.utcnow() - timedelta(seconds=1)})
+            session.commit()
+        calendar_queue.process_due_jobs(backend=backend)
+        job = job_for(abandoned)
+        checks.append(('リース中のジョブは他のワーカーに取得されない',
+                       len(claimed) == 1 and during_lease.status == 'running'
+                       and not called_during_lease))
+        checks.append(('リース切れのジョブは再取得されて完了',
+                       job.status == 'done' and job.attempts == 2
+                       and log_status(abandoned) == calendar_queue.STATUS_SYNCED))
+
+        # ログの削除
+        deleted = add_log()
+        with Session() as session:
+            session.query(Log).filter_by(id=deleted).delete(synchronize_session=False)
+            session.commit()
+        calendar_queue.process_due_jobs(backend=backend)
+        job = job_for(deleted)
+        checks.append(('ログが削除されたジョブは登録せずに完了',
+                       job.status == 'done' and job.last_error == 'log deleted'
+                       and event_id_for_log(deleted) not in backend.attempts))
+
+        engine.dispose()
+
+    print(f"登録 {sum(len(events) for events in backend.events.values())} 件  "
+          f"API 呼び出し {sum(backend.attempts.values())} 回  再試行の待ち時間 {[round(d) for d in delays]} 秒")
+    failures = 0
+    for label, ok in checks:
+        print(f"{'OK' if ok else 'NG'}: {label}")
+        failures += not ok
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
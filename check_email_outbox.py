@@ -0,0 +1,206 @@
+# check_email_outbox.py - メール送信キューの動作確認（ローカルの SMTP サーバー）
+"""
+ローカルで受信専用の SMTP サーバー（AUTH PLAIN 対応）を起動し、
+email_utils.process_outbox で送信キューのメールを送って、送信・再試行・失敗の扱いを確認する。
+外部の SMTP サーバーには接続しない（DB は一時ディレクトリの SQLite、STARTTLS なし）。
+
+    python check_email_outbox.py
+
+確認する内容
+・通常の宛先は送信済みになり、1回の処理では SMTP 接続を使い回す
+・4xx で一時的に拒否された宛先は再試行予定になり、次の処理で送信される
+・5xx で拒否された宛先は再試行せずに失敗になる
+・認証エラー（535）・認証情報の未設定は再試行予定になり、設定を直すと送信される
+・送信済み・失敗のメールは本文が消され、再試行待ちのメールは本文が残る
+・is_transient_smtp_error の分類
+
+1つでも満たさなければ終了コード 1 を返す。
+"""
+
+import base64
+import os
+import smtplib
+import socketserver
+import sys
+import tempfile
+import threading
+
+USERNAME = 'check'
+PASSWORD = 'check-password'
+
+
+class SmtpStandIn(socketserver.ThreadingTCPServer):
+    """
+    受け取ったメールを received に保存する SMTP サーバー
+
+    宛先のローカル部が reject なら 550、busy なら1回目だけ 451 で拒否する。
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _SmtpHandler)
+        self.lock = threading.Lock()
+        self.received = []
+        self.connections = 0
+        self.busy_refused = set()
+
+
+class _SmtpHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        self.reply('220 stand-in ESMTP')
+        authenticated = False
+        recipients = []
+        for raw in self.rfile:
+            line = raw.decode('utf-8', 'replace').rstrip('\r\n')
+            command = line[:4].upper()
+            if command in ('EHLO', 'HELO'):
+                self.reply('250-stand-in')
+                self.reply('250 AUTH PLAIN')
+            elif command == 'AUTH':
+                _, username, password = base64.b64decode(line.split()[-1]).decode().split('\0')
+                authenticated = (username, password) == (USERNAME, PASSWORD)
+                self.reply('235 Authentication successful' if authenticated
+                           else '535 Authentication credentials invalid')
+            elif command == 'MAIL':
+                recipients = []
+                self.reply('250 OK' if authenticated else '530 Authentication required')
+            elif command == 'RCPT':
+                address = line.split(':', 1)[1].strip().strip('<>')
+                local_part = address.split('@')[0]
+                with server.lock:
+                    if local_part == 'reject':
+                        self.reply('550 No such user')
+                        continue
+                    if local_part == 'busy' and address not in server.busy_refused:
+                        server.busy_refused.add(address)
+                        self.reply('451 Try again later')
+                        continue
+                recipients.append(address)
+                self.reply('250 OK')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                for data_line in self.rfile:
+                    if data_line in (b'.\r\n', b'.\n'):
+                        break
+                with server.lock:
+                    server.received.extend(recipients)
+                self.reply('250 OK')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('250 OK')
+
+
+def main():
+    stand_in = SmtpStandIn()
+    threading.Thread(target=stand_in.serve_forever, daemon=True).start()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # db は読み込み時に DATABASE_URL を読むので、設定してからインポートする
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp_dir, 'check.db')}"
+
+        from datetime import datetime
+
+        import email_utils
+        from db import Base, EmailOutbox, Session, engine
+
+        Base.metadata.create_all(engine)
+        settings = {
+            'server': '127.0.0.1', 'port': stand_in.server_address[1],
+            'username': USERNAME, 'password': PASSWORD, 'from_email': 'noreply@example.com',
+            'starttls': False, 'auth': True, 'debug': False,
+        }
+
+        def enqueue(*addresses):
+            with Session() as session:
+                messages = [email_utils.enqueue_email(session, address, '確認', '本文') for address in addresses]
+                session.commit()
+                return [message.id for message in messages]
+
+        def process(**overrides):
+            """送信キューを1回処理する（再試行待ちのものもすぐに対象にする）"""
+            with Session() as session:
+                session.query(EmailOutbox).filter_by(status='pending').update({'next_run_at': datetime.utcnow()})
+                session.commit()
+            connection = email_utils.SMTPConnection(dict(settings, **overrides))
+            try:
+                email_utils.process_outbox(connection=connection)
+            finally:
+                connection.close()
+            return connection
+
+        def statuses(ids):
+            with Session() as session:
+                return [session.get(EmailOutbox, message_id).status for message_id in ids]
+
+        checks = []
+
+        ids = enqueue('a@example.com', 'b@example.com', 'c@example.com')
+        connection = process()
+        checks.append(('通常の宛先は送信済み', statuses(ids) == ['sent'] * 3))
+        checks.append(('1回の処理で接続を使い回す', connection.connects == 1))
+
+        busy, rejected = enqueue('busy@example.com', 'reject@example.com')
+        process()
+        first = statuses([busy, rejected])
+        process()
+        checks.append(('4xx は再試行後に送信済み', first[0] == 'pending' and statuses([busy]) == ['sent']))
+        checks.append(('5xx は再試行せず失敗', first[1] == 'failed'))
+
+        with Session() as session:
+            finished = session.query(EmailOutbox).filter(EmailOutbox.status.in_(['sent', 'failed'])).all()
+            bodies_cleared = len(finished) == 5 and all(
+                (message.body, message.html_body) == ('', None) for message in finished)
+        checks.append(('送信済み・失敗のメールは本文を消す', bodies_cleared))
+
+        wrong_password, = enqueue('d@example.com')
+        process(password='wrong')
+        after_wrong = statuses([wrong_password])
+        with Session() as session:
+            pending_body = session.get(EmailOutbox, wrong_password).body
+        process(password=None)
+        after_missing = statuses([wrong_password])
+        process()
+        checks.append(('認証エラー・認証情報の未設定は再試行し、設定を直すと送信済み',
+                       after_wrong == ['pending'] and after_missing == ['pending']
+                       and statuses([wrong_password]) == ['sent']))
+        checks.append(('再試行待ちのメールは本文を残す', pending_body == '本文'))
+
+        engine.dispose()
+    stand_in.shutdown()
+
+    classification = [
+        (smtplib.SMTPAuthenticationError(535, b'invalid'), True),
+        (smtplib.SMTPException('SMTP認証情報が設定されていません'), True),
+        (smtplib.SMTPNotSupportedError('SMTP AUTH extension not supported by server.'), True),
+        (smtplib.SMTPServerDisconnected(), True),
+        (ConnectionRefusedError(), True),
+        (smtplib.SMTPSenderRefused(451, b'later', 'noreply@example.com'), True),
+        (smtplib.SMTPRecipientsRefused({'a@example.com': (451, b'later')}), True),
+        (smtplib.SMTPRecipientsRefused({'a@example.com': (550, b'no such user')}), False),
+        (smtplib.SMTPDataError(552, b'too big'), False),
+    ]
+    checks.append(('is_transient_smtp_error の分類', all(
+        email_utils.is_transient_smtp_error(error) == expected for error, expected in classification
+    )))
+
+    print(f"受信 {len(stand_in.received)} 通  接続 {stand_in.connections} 回")
+    failures = 0
+    for label, ok in checks:
+        print(f"{'OK' if ok else 'NG'}: {label}")
+        failures += not ok
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
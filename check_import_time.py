@@ -0,0 +1,107 @@
+# check_import_time.py - ワーカー起動時のインポート時間レポート
+"""
+gunicorn のワーカーと同じく `import app` を別プロセスで実行し、
+python -X importtime の出力からモジュールごとの読み込み時間を集計する。
+
+    python check_import_time.py
+    python check_import_time.py --top 30 --budget-ms 400
+
+・app 全体の読み込み時間（最も速かった回）と、時間のかかるモジュールの上位を表示
+・起動時に読み込まないはずのモジュール（Google API クライアント・SMTP）が読み込まれていないか確認
+・--budget-ms を超えた場合や、読み込まれてはいけないモジュールがあった場合は終了コード 1
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 使うときにだけインポートするモジュール（google_calendar.py / email_utils.py 参照）
+LAZY_MODULES = [
+    'googleapiclient.discovery',
+    'google.oauth2.service_account',
+    'google_auth_httplib2',
+    'httplib2',
+    'smtplib',
+]
+
+LINE_PATTERN = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def run_importtime(target):
+    """`import <target>` を -X importtime 付きで実行し、[(self_us, cumulative_us, depth, name)] を返す"""
+    env = dict(os.environ)
+    env.setdefault('SECRET_KEY', 'check-import-time')
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {target}'],
+        cwd=ROOT_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {target} に失敗しました:\n{result.stderr[-2000:]}")
+
+    entries = []
+    for line in result.stderr.splitlines():
+        match = LINE_PATTERN.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            entries.append((int(self_us), int(cumulative_us), (len(indent) - 1) // 2, name))
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description='app のインポート時間を計測する')
+    parser.add_argument('--target', default='app', help='計測するモジュール（既定: app）')
+    parser.add_argument('--runs', type=int, default=3, help='計測回数（最も速かった回を表示）')
+    parser.add_argument('--top', type=int, default=15, help='表示するモジュール数')
+    parser.add_argument('--budget-ms', type=float, default=0, help='この時間を超えたら失敗（0 なら確認しない）')
+    args = parser.parse_args()
+
+    runs = []
+    for _ in range(max(args.runs, 1)):
+        entries = run_importtime(args.target)
+        total_us = next(cumulative for _, cumulative, depth, name in entries
+                        if depth == 0 and name == args.target)
+        runs.append((total_us, entries))
+    total_us, entries = min(runs, key=lambda run: run[0])
+
+    print(f"import {args.target}: {total_us / 1000:.1f} ms"
+          f"（{len(runs)} 回中最速、全回: {', '.join(f'{run[0] / 1000:.0f}' for run in runs)} ms）")
+
+    # app が直接インポートしているモジュール（配下の読み込みを含む時間）
+    # -X importtime は読み込み完了順に出力するので、target の行の直前までの深さ1の行が直下のモジュール
+    direct = []
+    children = []
+    for entry in entries:
+        if entry[2] == 0:
+            if entry[3] == args.target:
+                direct = children
+            children = []
+        elif entry[2] == 1:
+            children.append(entry)
+    print(f"\n{args.target} から直接インポートしているモジュール（累積）:")
+    for _, cumulative_us, _, name in sorted(direct, key=lambda entry: -entry[1])[:args.top]:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+    print("\nモジュール単体の読み込み時間:")
+    for self_us, _, _, name in sorted(entries, key=lambda entry: -entry[0])[:args.top]:
+        print(f"  {self_us / 1000:8.1f} ms  {name}")
+
+    failures = 0
+    loaded = {name for _, _, _, name in entries}
+    eager = [name for name in LAZY_MODULES if name in loaded]
+    if eager:
+        failures += 1
+        print(f"\nNG: 起動時に読み込まないはずのモジュールが読み込まれています: {', '.join(eager)}")
+
+    if args.budget_ms and total_us / 1000 > args.budget_ms:
+        failures += 1
+        print(f"\nNG: 読み込み時間が上限 {args.budget_ms:.0f} ms を超えています")
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,187 @@
+# check_query_plans.py - 主要クエリの実行計画チェック
+"""
+アプリの主要な画面・API を実際に呼び出して発行された SELECT を記録し、
+それぞれに EXPLAIN をかけてシーケンシャルスキャンになっていないか確認する。
+
+    DATABASE_URL=... python check_query_plans.py [--user-id N]
+
+・SQLite: EXPLAIN QUERY PLAN の "SCAN <テーブル>"（インデックスを使わない全件走査）を検出
+  （対象は db.py のテーブルとその別名だけ。サブクエリ・CTE の結果の走査は対象外）
+・PostgreSQL: enable_seqscan = off にした上で "Seq Scan" が残るものを検出
+  （データが少ないとプランナーは Seq Scan を選ぶため、使えるインデックスが無い場合だけを検出する）
+
+1件でも見つかれば終了コード 1 を返す。--user-id を省略するとログが最も多いユーザーを使う。
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+
+os.environ.setdefault('SECRET_KEY', 'check-query-plans')
+# 計画を確認したいのはDBのクエリなので、レスポンスキャッシュは使わない
+os.environ['REDIS_URL'] = 'memory://'
+
+from sqlalchemy import event, func
+
+import app as app_module
+import rollups
+import calendar_backfill
+from db import engine, Base, Session, Log
+
+TABLE_NAMES = set(Base.metadata.tables)
+SQLITE_SCAN = re.compile(r'^SCAN (?:TABLE )?(\S+)')
+TABLE_ALIAS = re.compile(r'\b(\w+) AS (\w+)\b')
+
+# 実際に呼び出す画面・API（{log_id} は対象ユーザーの最新ログに置き換える）
+ENDPOINTS = [
+    '/logs',
+    '/api/logs',
+    '/api/logs/{log_id}',
+    '/api/dashboard',
+    '/api/popular-tags',
+    '/tags_top',
+    '/stats',
+    '/result',
+    '/settings',
+]
+
+
+def find_user_id():
+    with Session() as session:
+        row = session.query(Log.user_id, func.count(Log.id)).group_by(Log.user_id) \
+            .order_by(func.count(Log.id).desc()).first()
+        return row[0] if row else None
+
+
+def capture_queries(user_id):
+    """画面・APIを呼び出して、発行された SELECT 文とパラメータを記録する"""
+    captured = {}
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT') and statement not in captured:
+            captured[statement] = parameters
+
+    flask_app = app_module.app
+    flask_app.config['WTF_CSRF_ENABLED'] = False
+    app_module.limiter.enabled = False
+
+    with Session() as session:
+        latest = session.query(Log.id).filter(Log.user_id == user_id) \
+            .order_by(Log.date.desc(), Log.start_time.desc(), Log.id.desc()).first()
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        client = flask_app.test_client()
+        with client.session_transaction() as flask_session:
+            flask_session['_user_id'] = str(user_id)
+            flask_session['_fresh'] = True
+
+        for path in ENDPOINTS:
+            if '{log_id}' in path:
+                if latest is None:
+                    continue
+                path = path.format(log_id=latest.id)
+            response = client.get(path)
+            if response.status_code != 200:
+                print(f"警告: {path} が {response.status_code} を返しました")
+
+        # 2ページ目（カーソル付き）の一覧
+        page = client.get('/api/logs?limit=1').get_json() or {}
+        if page.get('next_cursor'):
+            client.get(f"/api/logs?limit=1&cursor={page['next_cursor']}")
+
+        # 画面以外から使うクエリ
+        with Session() as session:
+            calendar_backfill.count_unsynced_logs(session, user_id)
+            rollups.rebuild_rollups(session, user_id)
+            session.rollback()
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+    return captured
+
+
+def table_names_in(statement):
+    """実テーブル名と、文中でそのテーブルに付けられた別名（"logs AS logs_1" の logs_1）"""
+    names = set(TABLE_NAMES)
+    for table, alias in TABLE_ALIAS.findall(statement):
+        if table in TABLE_NAMES:
+            names.add(alias)
+    return names
+
+
+def sqlite_seq_scans(conn, statement, parameters):
+    rows = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+    details = [row[-1] for row in rows]
+    # "SCAN logs" はインデックスなしの全件走査、"SCAN logs USING INDEX ..." はインデックス全体の走査
+    # （どちらもユーザー単位の絞り込みができていない）。
+    # サブクエリ・CTE の結果（"SCAN anon_1" など）・定数行は実テーブルではないので対象外
+    tables = table_names_in(statement)
+    problems = []
+    for detail in details:
+        match = SQLITE_SCAN.match(detail)
+        if match and match.group(1) in tables:
+            problems.append(detail)
+    return problems, details
+
+
+def postgres_seq_scans(conn, statement, parameters):
+    plan = conn.exec_driver_sql('EXPLAIN (FORMAT JSON) ' + statement, parameters).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    problems = []
+    details = []
+
+    def walk(node):
+        details.append(f"{node['Node Type']} {node.get('Relation Name', '')}".strip())
+        if node['Node Type'] == 'Seq Scan':
+            problems.append(f"Seq Scan on {node.get('Relation Name')}")
+        for child in node.get('Plans', []):
+            walk(child)
+
+    walk(plan[0]['Plan'])
+    return problems, details
+
+
+def main():
+    parser = argparse.ArgumentParser(description='主要クエリがシーケンシャルスキャンになっていないか確認する')
+    parser.add_argument('--user-id', type=int, default=None, help='対象ユーザーID（省略時はログが最も多いユーザー）')
+    parser.add_argument('--verbose', action='store_true', help='全クエリの実行計画を表示する')
+    args = parser.parse_args()
+
+    user_id = args.user_id or find_user_id()
+    if user_id is None:
+        print('ログのあるユーザーがいません。データを用意してから実行してください')
+        return 2
+
+    captured = capture_queries(user_id)
+    dialect = engine.dialect.name
+    explain = postgres_seq_scans if dialect == 'postgresql' else sqlite_seq_scans
+
+    failures = 0
+    with engine.connect() as conn:
+        if dialect == 'postgresql':
+            conn.exec_driver_sql('SET enable_seqscan = off')
+
+        for statement, parameters in captured.items():
+            problems, details = explain(conn, statement, parameters)
+            one_line = ' '.join(statement.split())
+            if problems:
+                failures += 1
+                print(f"NG: {one_line[:200]}")
+                for problem in problems:
+                    print(f"    {problem}")
+            elif args.verbose:
+                print(f"OK: {one_line[:200]}")
+                for detail in details:
+                    print(f"    {detail}")
+
+    print(f"{dialect}: {len(captured)} 件のクエリを確認、シーケンシャルスキャン {failures} 件")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
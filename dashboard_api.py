@@ -0,0 +1,76 @@
+# dashboard_api.py - ダッシュボード用 API のレスポンス作成
+"""
+/api/dashboard と /api/popular-tags の中身を組み立てる。
+
+Flask のビュー（app.py）と asyncio 版の API（async_api.py）の両方から使うので、
+ここではリクエストに依存せず、セッションとユーザーIDだけを受け取って dict / list を返す。
+（async_api からは AsyncSession.run_sync 経由で同期セッションとして呼ばれる）
+"""
+
+from datetime import date
+
+import rollups
+import tagging
+
+
+def empty_dashboard():
+    """ログが1件もないときのレスポンス"""
+    return {
+        'daily': {'labels': [], 'data': []},
+        'tags': {'labels': [], 'data': []},
+        'weekly': {'labels': [], 'data': []},
+        'monthly': {'labels': [], 'data': []},
+        'stats': {
+            'total_hours': 0,
+            'total_logs': 0,
+            'avg_duration': 0,
+            'total_tags': 0
+        }
+    }
+
+
+def dashboard_data(session, user_id, today=None):
+    """ダッシュボードのグラフと統計情報"""
+    today = today or date.today()
+    result_data = empty_dashboard()
+
+    # 合計はロールアップから取得（ログ件数に依存しない）
+    total_duration, total_logs = rollups.fetch_totals(session, user_id)
+    if not total_logs:
+        return result_data
+
+    # タグ集計（作業時間の上位5件と種類数）
+    top_tags = tagging.tag_minutes(session, user_id, limit=5)
+    total_tags = tagging.used_tag_count(session, user_id)
+
+    # 日別データ（最近30日分のみ）
+    for current_date, minutes in rollups.fetch_daily(session, user_id, today, 30):
+        result_data['daily']['labels'].append(current_date.strftime('%m/%d'))
+        result_data['daily']['data'].append(minutes)
+
+    # タグデータ（上位5件のみ）
+    result_data['tags']['labels'] = [tag for tag, _ in top_tags]
+    result_data['tags']['data'] = [duration for _, duration in top_tags]
+
+    # 週別データ（最近8週分のみ）
+    weekly_rows = rollups.fetch_weekly(session, user_id, 8)
+    result_data['weekly']['labels'] = [week.strftime('%m/%d') for week, _ in weekly_rows]
+    result_data['weekly']['data'] = [minutes for _, minutes in weekly_rows]
+
+    # 月別データ（最近6ヶ月分のみ）
+    monthly_rows = rollups.fetch_monthly(session, user_id, 6)
+    result_data['monthly']['labels'] = [month.strftime('%Y/%m') for month, _ in monthly_rows]
+    result_data['monthly']['data'] = [minutes for _, minutes in monthly_rows]
+
+    result_data['stats'] = {
+        'total_hours': round(total_duration / 60, 1),
+        'total_logs': total_logs,
+        'avg_duration': round(total_duration / total_logs, 1),
+        'total_tags': total_tags
+    }
+    return result_data
+
+
+def popular_tags_data(session, user_id):
+    """よく使うタグ（使用回数の多い順に上位10件）"""
+    return [{'tag': tag, 'count': count} for tag, count in tagging.tag_counts(session, user_id, limit=10)]
@@ -1,9 +1,10 @@
 # db.py - PostgreSQL対応版
-from sqlalchemy import Column, Integer, String, Text, Date, Time, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, Text, Date, Time, DateTime, ForeignKey, Boolean, Index, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker, relationship
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import g
 from flask_login import UserMixin
 from datetime import datetime, timedelta
 import secrets
@@ -20,6 +21,11 @@ def get_jst_now():
 # .envファイルを読み込み（ローカル開発用）
 load_dotenv()
 
+# パスワードハッシュ・接続プールの設定も環境変数から読むので .env の読み込み後にインポート
+import passwords
+import db_pool
+import request_metrics
+
 # ── 接続文字列 ───────────────────────────────
 DATABASE_URL = os.getenv(
     "DATABASE_URL",                # Renderの環境変数から取得
@@ -34,17 +40,38 @@ print(f"Using database: {DATABASE_URL.split('@')[-1] if '@' in DATABASE_URL else
 
 # ────────────────────────────────────────────
 
-# エンジンの作成（PostgreSQL用の設定を追加）
+# エンジンの作成（プールの大きさ・生存確認は環境変数で設定。db_pool.py 参照）
 engine = create_engine(
     DATABASE_URL, 
     future=True, 
     echo=False,
-    # PostgreSQL用の追加設定
-    pool_pre_ping=True,  # 接続の健全性をチェック
-    pool_recycle=300,    # 5分ごとに接続をリサイクル
+    **db_pool.engine_options(make_url(DATABASE_URL))
 )
+db_pool.instrument_engine(engine)
+# リクエストごとの SQL の回数・時間を Server-Timing に出す（request_metrics.py 参照）
+request_metrics.instrument_engine(engine)
 
 Session = sessionmaker(bind=engine, expire_on_commit=False)
+
+
+def get_request_session():
+    """
+    リクエスト内で共有するセッション（user_loader・ビューなどで同じ接続を使う）
+    リクエストの終了時（teardown_appcontext）に close される。
+    ビューの finally で close() してもよい（接続を早めに返すだけで、同じリクエスト内で再び使える）
+    CLI・ワーカーなどリクエスト外では、これまで通り Session() を使うこと
+    """
+    if 'db_session' not in g:
+        g.db_session = Session()
+    return g.db_session
+
+
+def close_request_session(error=None):
+    session = g.pop('db_session', None)
+    if session is not None:
+        session.close()
+
+
 Base = declarative_base()
 
 # PasswordHistoryとPasswordResetTokenをUserクラスより前に定義
@@ -105,6 +132,8 @@ class User(Base, UserMixin):
     failed_login_attempts = Column(Integer, default=0)
     locked_until = Column(DateTime, nullable=True)
     is_admin = Column(Boolean, default=False)
+    # ログを変更するたびに増える（集計APIのキャッシュキー・ETag に使用）
+    data_version = Column(Integer, nullable=False, default=0)
 
     # リレーション
     logs = relationship('Log', back_populates='user', lazy='dynamic', cascade='all, delete-orphan')
@@ -115,24 +144,22 @@ class User(Base, UserMixin):
                               cascade='all, delete-orphan')
     
     def set_password(self, password):
-        """パスワードを設定"""
-        self.password_hash = generate_password_hash(password)
+        """パスワードを設定（ハッシュ計算は passwords のプールで行う）"""
+        self.password_hash = passwords.hash_password(password)
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return passwords.verify_password(self.password_hash, password)
+    
+    def password_needs_rehash(self):
+        """保存済みハッシュのアルゴリズム・パラメータが現在の設定と違うか"""
+        return passwords.needs_rehash(self.password_hash)
     
     def check_password_history(self, password, history_count=5):
         """過去のパスワードと照合（デフォルトは過去5回分）"""
-        # 現在のパスワードをチェック
-        if self.check_password(password):
-            return True
-        
-        # 過去のパスワードをチェック
-        for history in self.password_history[:history_count]:
-            if check_password_hash(history.password_hash, password):
-                return True
-        
-        return False
+        # 現在のパスワードと過去のパスワードをまとめて（並列に）照合
+        hashes = [self.password_hash]
+        hashes += [history.password_hash for history in self.password_history[:history_count]]
+        return passwords.verify_any(hashes, password)
     
     def is_locked(self):
         """アカウントがロックされているかチェック"""
@@ -163,12 +190,139 @@ class Log(Base):
     impression = Column(Text)
     tags = Column(Text, default="")
 
+    # Googleカレンダー同期状態（None: 対象外 / pending / synced / failed）
+    calendar_status = Column(String(20), nullable=True)
+    calendar_event_link = Column(String(500), nullable=True)
+
+    # オフライン同期などでクライアントが付けた冪等キー（同じキーの再送は登録しない）
+    client_key = Column(String(64), nullable=True)
+
     # 外部キーにondelete='CASCADE'を追加
     user_id = Column(Integer, ForeignKey("users.id", ondelete='CASCADE'), nullable=False)
 
     # リレーション
     user = relationship("User", back_populates="logs")
 
+    __table_args__ = (
+        # 一覧・ページング（user_id で絞り込み、日付・開始時刻の新しい順）
+        Index('ix_logs_user_id_date_start_time', user_id, date.desc(), start_time.desc(), id.desc()),
+        # 日別集計（PostgreSQL では duration を含めてインデックスだけで集計できる）
+        Index('ix_logs_user_id_date', user_id, date, postgresql_include=['duration']),
+        Index('ux_logs_user_id_client_key', user_id, client_key, unique=True),
+    )
+
+# ── バックグラウンドジョブ ──────────────────────
+# カレンダー登録は worker.py が処理する（calendar_queue.py 参照）
+
+class CalendarSyncJob(Base):
+    __tablename__ = "calendar_sync_jobs"
+    __table_args__ = (
+        Index('ix_calendar_sync_jobs_status_next_run_at', 'status', 'next_run_at'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    log_id = Column(Integer, ForeignKey("logs.id", ondelete='CASCADE'), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete='CASCADE'), nullable=False)
+    calendar_id = Column(String(255), nullable=False)
+    status = Column(String(20), nullable=False, default='pending')  # pending / running / done / failed
+    attempts = Column(Integer, nullable=False, default=0)
+    next_run_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    locked_until = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class CalendarBackfill(Base):
+    """既存ログをまとめてカレンダーへ登録する処理の進捗（チェックポイント）"""
+    __tablename__ = "calendar_backfills"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete='CASCADE'), nullable=False, index=True)
+    calendar_id = Column(String(255), nullable=False)
+    status = Column(String(20), nullable=False, default='pending')  # pending / running / done / failed
+    last_log_id = Column(Integer, nullable=False, default=0)  # ここまで処理済み
+    synced_count = Column(Integer, nullable=False, default=0)
+    failed_count = Column(Integer, nullable=False, default=0)
+    locked_until = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class EmailOutbox(Base):
+    """送信待ちメール（worker.py が SMTP 接続を使い回してまとめて送信する）"""
+    __tablename__ = "email_outbox"
+    __table_args__ = (
+        Index('ix_email_outbox_status_next_run_at', 'status', 'next_run_at'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    to_email = Column(String(255), nullable=False)
+    subject = Column(String(255), nullable=False)
+    body = Column(Text, nullable=False)
+    html_body = Column(Text, nullable=True)
+    status = Column(String(20), nullable=False, default='pending')  # pending / sending / sent / failed
+    attempts = Column(Integer, nullable=False, default=0)
+    next_run_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    locked_until = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
+
+# ── タグ（正規化） ─────────────────────────────
+# Log.tags の文字列は表示・カレンダー用にそのまま残し、集計はこちらで行う（tagging.py 参照）
+
+class Tag(Base):
+    __tablename__ = "tags"
+    __table_args__ = (
+        UniqueConstraint('user_id', 'name', name='uq_tags_user_id_name'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete='CASCADE'), nullable=False)
+    name = Column(String(100), nullable=False)
+
+class LogTag(Base):
+    __tablename__ = "log_tags"
+    __table_args__ = (
+        Index('ix_log_tags_user_id_tag_id', 'user_id', 'tag_id'),
+        Index('ix_log_tags_tag_id', 'tag_id'),
+    )
+
+    log_id = Column(Integer, ForeignKey("logs.id", ondelete='CASCADE'), primary_key=True)
+    tag_id = Column(Integer, ForeignKey("tags.id", ondelete='CASCADE'), primary_key=True)
+    # 集計クエリで logs と結合しなくて済むように保持
+    user_id = Column(Integer, ForeignKey("users.id", ondelete='CASCADE'), nullable=False)
+
+# ── 集計用ロールアップテーブル ───────────────────
+# /log の登録と同じトランザクションで加算される（rollups.py 参照）
+
+class DailyRollup(Base):
+    """ユーザー別・日別の作業時間合計"""
+    __tablename__ = "log_daily_rollups"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete='CASCADE'), primary_key=True)
+    day = Column(Date, primary_key=True)
+    total_minutes = Column(Integer, nullable=False, default=0)
+    log_count = Column(Integer, nullable=False, default=0)
+
+class WeeklyRollup(Base):
+    """ユーザー別・週別（ISO週、月曜始まり）の作業時間合計"""
+    __tablename__ = "log_weekly_rollups"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete='CASCADE'), primary_key=True)
+    week_start = Column(Date, primary_key=True)  # その週の月曜日
+    total_minutes = Column(Integer, nullable=False, default=0)
+    log_count = Column(Integer, nullable=False, default=0)
+
+class MonthlyRollup(Base):
+    """ユーザー別・月別の作業時間合計"""
+    __tablename__ = "log_monthly_rollups"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete='CASCADE'), primary_key=True)
+    month_start = Column(Date, primary_key=True)  # その月の1日
+    total_minutes = Column(Integer, nullable=False, default=0)
+    log_count = Column(Integer, nullable=False, default=0)
+
 # リレーションのback_populatesを設定
 PasswordHistory.user = relationship('User', back_populates='password_history')
 PasswordResetToken.user = relationship('User', back_populates='reset_tokens')
@@ -0,0 +1,263 @@
+# db_pool.py - DB 接続プールの設定と監視
+"""
+接続プールの大きさ・待ち時間の上限などを環境変数で設定し、利用状況を記録する。
+
+    DB_POOL_SIZE          : 常に保持する接続数（ワーカープロセスごと。既定 5）
+    DB_MAX_OVERFLOW       : 一時的に追加で開ける接続数（既定 10）
+    DB_POOL_TIMEOUT       : 空き接続を待つ秒数の上限（既定 30）
+    DB_POOL_RECYCLE       : この秒数を過ぎた接続は作り直す（既定 1800）
+    DB_POOL_REAP_INTERVAL : 空き接続の生存確認を行う間隔（秒。既定 30、0 で行わない）
+    DB_POOL_PRE_PING      : 1 ならチェックアウトのたびに生存確認する（従来の動作）
+    DB_PGBOUNCER          : 1 なら PgBouncer（transaction モード）経由として、アプリ側ではプールしない
+
+同期エンジン（db.py）と非同期エンジン（async_api.py）はそれぞれこの設定でプールを持つので、
+DB の最大接続数は「Web ワーカー数 ×（DB_POOL_SIZE + DB_MAX_OVERFLOW）× 2 ＋ worker.py の分」を
+下回らないようにする（プールが一杯のときは DB_POOL_TIMEOUT 秒待ってエラーになる）。
+
+チェックアウトのたびに SELECT 1 を送る代わりに、
+・バックグラウンドのスレッド（reaper）が空き接続を定期的に確認し、切れていたものを閉じる
+・チェックアウト時は、最後に使われて（または確認されて）から DB_POOL_REAP_INTERVAL の2倍以上
+  経った接続だけを確認する
+ので、通常のリクエストでは確認の往復が発生しない。
+"""
+
+import os
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
+
+POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10'))
+POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))
+REAP_INTERVAL = float(os.getenv('DB_POOL_REAP_INTERVAL', '30'))
+PRE_PING = os.getenv('DB_POOL_PRE_PING', '0') == '1'
+PGBOUNCER = os.getenv('DB_PGBOUNCER', '0') == '1'
+
+# これより長く確認されていない接続はチェックアウト時に確認する
+PING_AFTER_SECONDS = REAP_INTERVAL * 2 if REAP_INTERVAL > 0 else 30
+REAPER_THREAD_NAME = 'db-pool-reaper'
+
+
+class PoolStats:
+    """チェックアウト回数・待ち時間・生存確認の結果を数える"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.timeouts = 0
+        self.pings = 0
+        self.ping_failures = 0
+
+    def record_wait(self, seconds):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+    def add(self, name, count=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + count)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'checkouts': self.checkouts,
+                'wait_ms_avg': round(self.wait_seconds_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                'wait_ms_max': round(self.wait_seconds_max * 1000, 3),
+                'wait_seconds_total': round(self.wait_seconds_total, 6),
+                'timeouts': self.timeouts,
+                'pings': self.pings,
+                'ping_failures': self.ping_failures,
+            }
+
+
+class _InstrumentedPoolMixin:
+    """空き接続を得るまでの待ち時間を記録する"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def recreate(self):
+        # 接続エラーでプールが作り直されても統計は引き継ぐ
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.stats.add('timeouts')
+            raise
+        finally:
+            if not _is_reaper_thread():
+                self.stats.record_wait(time.perf_counter() - started)
+
+
+class InstrumentedQueuePool(_InstrumentedPoolMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncAdaptedQueuePool(_InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    """非同期エンジン用（QueuePool のスレッド用ロックはイベントループを止めてしまうので使えない）"""
+
+
+class InstrumentedNullPool(_InstrumentedPoolMixin, NullPool):
+    """PgBouncer 経由のとき用（プールしないが接続にかかった時間は記録する）"""
+
+
+def engine_options(url, is_async=False):
+    """create_engine / create_async_engine に渡すプール関連の引数"""
+    backend = url.get_backend_name() if hasattr(url, 'get_backend_name') else url.split(':', 1)[0].split('+')[0]
+    options = {'pool_pre_ping': PRE_PING}
+    if backend == 'sqlite':
+        # SQLite（ローカル開発用）は SQLAlchemy の既定のプールのまま
+        return options
+
+    if PGBOUNCER:
+        # 接続の使い回しは PgBouncer に任せる
+        options['poolclass'] = InstrumentedNullPool
+        if is_async:
+            # transaction モードではプリペアドステートメントを使えない
+            # （SQLAlchemy 側のキャッシュは async_api.async_database_url で無効にする）
+            options['connect_args'] = {'statement_cache_size': 0}
+        return options
+
+    options.update(
+        poolclass=InstrumentedAsyncAdaptedQueuePool if is_async else InstrumentedQueuePool,
+        pool_size=POOL_SIZE,
+        max_overflow=MAX_OVERFLOW,
+        pool_timeout=POOL_TIMEOUT,
+        pool_recycle=POOL_RECYCLE,
+    )
+    return options
+
+
+def _ping(dbapi_connection):
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute('SELECT 1')
+    finally:
+        cursor.close()
+
+
+def _stats_of(pool):
+    return getattr(pool, 'stats', None)
+
+
+def _is_reaper_thread():
+    return threading.current_thread().name == REAPER_THREAD_NAME
+
+
+def instrument_engine(engine, reaper=True):
+    """
+    チェックイン時刻の記録・必要な場合だけの生存確認・reaper の起動を設定する
+    非同期エンジンは engine.sync_engine を渡し、reaper=False にする（接続がイベントループに属するため）
+    """
+    if engine.dialect.name == 'sqlite' or isinstance(engine.pool, NullPool):
+        return
+
+    reapers = {}
+
+    @event.listens_for(engine, 'checkin')
+    def _on_checkin(dbapi_connection, connection_record):
+        connection_record.info['verified_at'] = time.monotonic()
+
+    @event.listens_for(engine, 'checkout')
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        if reaper and REAP_INTERVAL > 0 and os.getpid() not in reapers:
+            reapers[os.getpid()] = _start_reaper(engine)
+
+        if PRE_PING or _is_reaper_thread():
+            return
+        verified_at = connection_record.info.get('verified_at')
+        if verified_at is None or time.monotonic() - verified_at < PING_AFTER_SECONDS:
+            return
+        stats = _stats_of(engine.pool)
+        try:
+            _ping(dbapi_connection)
+            if stats:
+                stats.add('pings')
+        except Exception as e:
+            if stats:
+                stats.add('ping_failures')
+            # DisconnectionError を送出すると SQLAlchemy が新しい接続で取り直す
+            raise exc.DisconnectionError(f"接続が切れていました: {e}")
+        connection_record.info['verified_at'] = time.monotonic()
+
+
+def reap_idle_connections(engine):
+    """
+    空き接続をまとめて取り出して SELECT 1 で確認し、切れていたものは閉じる
+    （閉じた接続は次に使うときに接続し直される）
+    """
+    pool = engine.pool
+    stats = _stats_of(pool)
+    now = time.monotonic()
+
+    # 1本ずつ取り出して戻すと同じ接続を何度も確認することがあるので、空き接続を全部取り出してから戻す
+    # （リクエストの処理で空きが無くなったら、新しい接続を開かないようそこでやめる）
+    borrowed = []
+    try:
+        while pool.checkedin() > 0 and len(borrowed) < pool.size():
+            connection = pool.connect()
+            # info は DB 接続ごとの辞書（invalidate すると空になる）
+            borrowed.append((connection, connection.info))
+
+        for connection, _ in borrowed:
+            try:
+                _ping(connection.dbapi_connection)
+                if stats:
+                    stats.add('pings')
+            except Exception as e:
+                print(f"DB接続の生存確認に失敗したため閉じます: {type(e).__name__}: {e}")
+                connection.invalidate()
+                if stats:
+                    stats.add('ping_failures')
+    finally:
+        for connection, info in borrowed:
+            valid = connection.is_valid
+            connection.close()
+            # 確認したので、チェックアウト時の確認は次の間隔まで不要
+            if valid:
+                info['verified_at'] = now
+
+
+def _start_reaper(engine):
+    def run():
+        while True:
+            time.sleep(REAP_INTERVAL)
+            try:
+                reap_idle_connections(engine)
+            except Exception as e:
+                print(f"DB接続の整理でエラー: {type(e).__name__}: {e}")
+
+    thread = threading.Thread(target=run, name=REAPER_THREAD_NAME, daemon=True)
+    thread.start()
+    return thread
+
+
+def pool_status(engine):
+    """プールの現在の状態と累計の統計"""
+    pool = engine.pool
+    status = {'pool': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            checked_in=pool.checkedin(),
+            overflow=max(pool.overflow(), 0),
+            max_overflow=pool._max_overflow,
+            timeout=pool.timeout(),
+        )
+    stats = _stats_of(pool)
+    if stats:
+        status.update(stats.to_dict())
+    return status
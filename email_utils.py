@@ -1,64 +1,199 @@
 # email_utils.py - エラーハンドリングを強化
 import os
+import random
 import smtplib
+import socket
+import time
+from datetime import datetime, timedelta
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from flask import url_for
 import logging
 
+from sqlalchemy import or_, and_
+
+from db import Session, EmailOutbox
+import prometheus_metrics
+import request_metrics
+
 # ロギング設定
 logger = logging.getLogger(__name__)
 
-def send_email(to_email, subject, body, html_body=None):
-    """メールを送信する関数（デバッグ情報付き）"""
-    # 環境変数から設定を取得
-    smtp_server = os.getenv('SMTP_SERVER', 'smtp.gmail.com')
-    smtp_port = int(os.getenv('SMTP_PORT', '587'))
+# 送信キューの設定
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('EMAIL_OUTBOX_MAX_ATTEMPTS', '6'))
+OUTBOX_BACKOFF_BASE_SECONDS = int(os.getenv('EMAIL_OUTBOX_BACKOFF_BASE', '30'))
+OUTBOX_BACKOFF_MAX_SECONDS = int(os.getenv('EMAIL_OUTBOX_BACKOFF_MAX', str(60 * 60)))
+OUTBOX_LEASE_SECONDS = 300
+# この秒数以上使っていない接続は NOOP で生存確認してから使う
+SMTP_IDLE_CHECK_SECONDS = 30
+# この秒数以上使っていない接続は閉じる
+SMTP_IDLE_CLOSE_SECONDS = 300
+
+
+def get_smtp_settings():
+    """環境変数から SMTP 設定を取得"""
     smtp_username = os.getenv('SMTP_USERNAME')
-    smtp_password = os.getenv('SMTP_PASSWORD')
-    from_email = os.getenv('FROM_EMAIL', smtp_username)
+    return {
+        'server': os.getenv('SMTP_SERVER', 'smtp.gmail.com'),
+        'port': int(os.getenv('SMTP_PORT', '587')),
+        'username': smtp_username,
+        'password': os.getenv('SMTP_PASSWORD'),
+        'from_email': os.getenv('FROM_EMAIL', smtp_username),
+        # ローカルの検証用サーバー（aiosmtpd など）では SMTP_STARTTLS=0 / SMTP_AUTH=0
+        'starttls': os.getenv('SMTP_STARTTLS', '1') != '0',
+        'auth': os.getenv('SMTP_AUTH', '1') != '0',
+        'debug': os.getenv('SMTP_DEBUG', '0') == '1',
+    }
+
+
+def build_message(from_email, to_email, subject, body, html_body=None):
+    """送信するメッセージを作成"""
+    msg = MIMEMultipart('alternative')
+    msg['Subject'] = subject
+    msg['From'] = from_email
+    msg['To'] = to_email
+    
+    # テキストパート
+    msg.attach(MIMEText(body, 'plain', 'utf-8'))
+    
+    # HTMLパート（オプション）
+    if html_body:
+        msg.attach(MIMEText(html_body, 'html', 'utf-8'))
+    
+    return msg
+
+
+def is_transient_smtp_error(error):
+    """
+    再試行で成功する可能性があるエラーか
+
+    ・接続系のエラーと 4xx 応答は再試行する
+    ・認証・設定のエラー（535 などの SMTPAuthenticationError、認証情報の未設定、
+      AUTH / STARTTLS 非対応などの応答コードのない SMTPException）も、
+      宛先や本文ではなく設定の問題で、設定を直せば送れるので再試行する
+    ・宛先・差出人・本文を 5xx で拒否されたものは再試行しない
+    """
+    # SMTPException は OSError のサブクラスなので、接続系（OSError）より先に判定する
+    if isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError,
+                          smtplib.SMTPAuthenticationError)):
+        return True
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    return isinstance(error, (smtplib.SMTPException, socket.error, TimeoutError))
+
+
+class SMTPConnection:
+    """
+    認証済みの SMTP 接続を保持して複数のメールで使い回す
+    切断されていた場合は1回だけ再接続して送り直す
+    """
+
+    def __init__(self, settings=None):
+        self.settings = settings or get_smtp_settings()
+        self._server = None
+        self._last_used = 0.0
+        self.connects = 0
+
+    def _connect(self):
+        settings = self.settings
+        logger.info(f"SMTPサーバーに接続中... {settings['server']}:{settings['port']}")
+        server = smtplib.SMTP(settings['server'], settings['port'], timeout=30)
+        try:
+            if settings['debug']:
+                server.set_debuglevel(1)
+            if settings['starttls']:
+                server.starttls()
+            if settings['auth']:
+                server.login(settings['username'], settings['password'])
+        except Exception:
+            server.close()
+            raise
+        self._server = server
+        self.connects += 1
+
+    def _ensure_connected(self):
+        now = time.monotonic()
+        if self._server is not None and now - self._last_used > SMTP_IDLE_CHECK_SECONDS:
+            # しばらく使っていない接続はサーバー側で切られている可能性がある
+            try:
+                if self._server.noop()[0] != 250:
+                    self.close()
+            except (smtplib.SMTPException, OSError):
+                self.close()
+        if self._server is None:
+            self._connect()
+
+    def send(self, msg):
+        """メッセージを送信（切断されていたら再接続して1回だけ再送）"""
+        started = time.perf_counter()
+        try:
+            with request_metrics.timed('smtp'):
+                self._ensure_connected()
+                try:
+                    self._server.send_message(msg)
+                except smtplib.SMTPServerDisconnected:
+                    self.close()
+                    self._connect()
+                    self._server.send_message(msg)
+        except Exception:
+            prometheus_metrics.SMTP_ERRORS.inc()
+            raise
+        finally:
+            prometheus_metrics.SMTP_LATENCY.observe(time.perf_counter() - started)
+        self._last_used = time.monotonic()
+
+    def close_if_idle(self):
+        if self._server is not None and time.monotonic() - self._last_used > SMTP_IDLE_CLOSE_SECONDS:
+            self.close()
+
+    def close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except Exception:
+                try:
+                    self._server.close()
+                except Exception:
+                    pass
+            self._server = None
+
+
+# プロセス内で共有する接続（ワーカーは1スレッドで使う）
+_connection = None
+
+
+def get_connection():
+    global _connection
+    if _connection is None:
+        _connection = SMTPConnection()
+    return _connection
+
+
+def _check_credentials(settings):
+    if settings['auth'] and (not settings['username'] or not settings['password']):
+        logger.error("SMTP認証情報が設定されていません")
+        logger.error(f"SMTP_USERNAME: {'設定済み' if settings['username'] else '未設定'}")
+        logger.error(f"SMTP_PASSWORD: {'設定済み' if settings['password'] else '未設定'}")
+        return False
+    return True
+
+
+def send_email(to_email, subject, body, html_body=None):
+    """メールをすぐに送信する関数（通常は enqueue_email で送信キューに入れる）"""
+    connection = get_connection()
+    settings = connection.settings
     
     # デバッグ情報
     logger.info(f"メール送信試行: {to_email}")
-    logger.info(f"SMTP設定: {smtp_server}:{smtp_port}")
-    logger.info(f"送信元: {from_email}")
     
-    if not smtp_username or not smtp_password:
-        logger.error("SMTP認証情報が設定されていません")
-        logger.error(f"SMTP_USERNAME: {'設定済み' if smtp_username else '未設定'}")
-        logger.error(f"SMTP_PASSWORD: {'設定済み' if smtp_password else '未設定'}")
+    if not _check_credentials(settings):
         return False
     
     try:
-        # メッセージの作成
-        msg = MIMEMultipart('alternative')
-        msg['Subject'] = subject
-        msg['From'] = from_email
-        msg['To'] = to_email
-        
-        # テキストパート
-        text_part = MIMEText(body, 'plain', 'utf-8')
-        msg.attach(text_part)
-        
-        # HTMLパート（オプション）
-        if html_body:
-            html_part = MIMEText(html_body, 'html', 'utf-8')
-            msg.attach(html_part)
-        
-        # SMTPサーバーに接続して送信
-        logger.info("SMTPサーバーに接続中...")
-        with smtplib.SMTP(smtp_server, smtp_port, timeout=30) as server:
-            server.set_debuglevel(1)  # デバッグ出力を有効化
-            
-            logger.info("STARTTLS開始...")
-            server.starttls()
-            
-            logger.info("ログイン試行中...")
-            server.login(smtp_username, smtp_password)
-            
-            logger.info("メール送信中...")
-            server.send_message(msg)
-        
+        msg = build_message(settings['from_email'], to_email, subject, body, html_body)
+        connection.send(msg)
         logger.info(f"✅ メール送信成功: {to_email}")
         return True
         
@@ -75,11 +210,112 @@ def send_email(to_email, subject, body, html_body=None):
         
     except Exception as e:
         logger.error(f"予期しないエラー: {type(e).__name__}: {e}")
-        
+    
+    connection.close()
     return False
 
-def send_password_reset_email(user_email, reset_url):
-    """パスワードリセットメールを送信"""
+
+# ── 送信キュー（アウトボックス） ─────────────────
+
+def enqueue_email(session, to_email, subject, body, html_body=None):
+    """
+    メールを送信キューに追加する
+    commit は呼び出し側で行う（トークン発行などと同一トランザクションにするため）
+    """
+    message = EmailOutbox(
+        to_email=to_email,
+        subject=subject,
+        body=body,
+        html_body=html_body,
+        status='pending',
+        attempts=0,
+        next_run_at=datetime.utcnow()
+    )
+    session.add(message)
+    return message
+
+
+def outbox_backoff_seconds(attempts):
+    """attempts 回目の失敗後に待つ秒数（指数バックオフ + 最大10%のジッター）"""
+    delay = min(OUTBOX_BACKOFF_MAX_SECONDS, OUTBOX_BACKOFF_BASE_SECONDS * (2 ** max(attempts - 1, 0)))
+    return delay + random.uniform(0, delay * 0.1)
+
+
+def claim_outbox(session, limit=50, now=None):
+    """送信可能なメールを取得してリースする"""
+    now = now or datetime.utcnow()
+    query = session.query(EmailOutbox).filter(or_(
+        and_(EmailOutbox.status == 'pending', EmailOutbox.next_run_at <= now),
+        and_(EmailOutbox.status == 'sending', EmailOutbox.locked_until < now),
+    )).order_by(EmailOutbox.next_run_at).limit(limit)
+    
+    if session.get_bind().dialect.name == 'postgresql':
+        query = query.with_for_update(skip_locked=True)
+    
+    messages = query.all()
+    for message in messages:
+        message.status = 'sending'
+        message.locked_until = now + timedelta(seconds=OUTBOX_LEASE_SECONDS)
+        message.attempts += 1
+    session.commit()
+    return messages
+
+
+def _clear_body(message):
+    """送信済み・失敗のメールは本文を消す（パスワードリセットの URL を DB に残さない）"""
+    message.body = ''
+    message.html_body = None
+
+
+def process_outbox(limit=50, connection=None):
+    """送信キューのメールを1つの SMTP 接続でまとめて送信し、処理件数を返す"""
+    connection = connection or get_connection()
+    
+    with Session() as session:
+        messages = claim_outbox(session, limit)
+        if not messages:
+            connection.close_if_idle()
+            return 0
+        
+        settings = connection.settings
+        credentials_ok = _check_credentials(settings)
+        
+        for message in messages:
+            now = datetime.utcnow()
+            try:
+                if not credentials_ok:
+                    raise smtplib.SMTPException("SMTP認証情報が設定されていません")
+                msg = build_message(settings['from_email'], message.to_email,
+                                    message.subject, message.body, message.html_body)
+                connection.send(msg)
+            except Exception as e:
+                transient = is_transient_smtp_error(e)
+                message.last_error = f"{type(e).__name__}: {e}"[:1000]
+                message.locked_until = None
+                if transient and message.attempts < OUTBOX_MAX_ATTEMPTS:
+                    message.status = 'pending'
+                    message.next_run_at = now + timedelta(seconds=outbox_backoff_seconds(message.attempts))
+                    logger.warning(f"メール送信を再試行予定 (id={message.id}, attempts={message.attempts}): {e}")
+                else:
+                    message.status = 'failed'
+                    _clear_body(message)
+                    logger.error(f"メール送信に失敗 (id={message.id}): {e}")
+                # 接続状態が不明なので張り直す
+                connection.close()
+            else:
+                message.status = 'sent'
+                message.sent_at = now
+                message.locked_until = None
+                message.last_error = None
+                _clear_body(message)
+                logger.info(f"✅ メール送信成功: {message.to_email}")
+            session.commit()
+        
+        return len(messages)
+
+
+def build_password_reset_email(reset_url):
+    """パスワードリセットメールの (件名, 本文, HTML本文) を作成"""
     subject = "パスワードリセットのご案内 - Working Log PWA"
     
     body = f"""
@@ -146,4 +382,16 @@ Working Log PWA チーム
 </html>
     """
     
-    return send_email(user_email, subject, body, html_body)
\ No newline at end of file
+    return subject, body, html_body
+
+
+def send_password_reset_email(user_email, reset_url):
+    """パスワードリセットメールをすぐに送信"""
+    subject, body, html_body = build_password_reset_email(reset_url)
+    return send_email(user_email, subject, body, html_body)
+
+
+def queue_password_reset_email(session, user_email, reset_url):
+    """パスワードリセットメールを送信キューに追加"""
+    subject, body, html_body = build_password_reset_email(reset_url)
+    return enqueue_email(session, user_email, subject, body, html_body)
\ No newline at end of file
@@ -6,31 +6,420 @@ Google Calendar 連携  ── サービスアカウント方式専用
 """
 
 import os
+import json
+import threading
+import time as time_module
 from datetime import datetime, timedelta, date, time
 
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
+import prometheus_metrics
+import request_metrics
+
+# httplib2 / google-auth / googleapiclient は読み込みが重いので、
+# Web ワーカーの起動を遅らせないよう実際に API を使うときにインポートする
 
 # ─────────────────────────────────────────
 SCOPES        = ["https://www.googleapis.com/auth/calendar.events"]
 SERVICE_CRED  = os.getenv("SERVICE_CRED", "service_account.json")
 CALENDAR_ID   = os.getenv("CALENDAR_ID", "primary")   # 子カレンダーIDを指定可
+HTTP_TIMEOUT  = int(os.getenv("CALENDAR_HTTP_TIMEOUT", "30"))
+# API の接続先（ローカルの代替サーバーで動作確認する場合に指定）
+API_ROOT      = os.getenv("CALENDAR_API_ROOT")
+# アクセストークンの期限がこの秒数以内なら先に更新しておく
+TOKEN_REFRESH_MARGIN = int(os.getenv("CALENDAR_TOKEN_REFRESH_MARGIN", "300"))
 # ─────────────────────────────────────────
 
+
+class CalendarClientManager:
+    """
+    Calendar API クライアントをプロセス内で使い回す
+
+    ・認証情報はプロセスごとに1回だけ読み込む（SERVICE_CRED_JSON または SERVICE_CRED）
+    ・アクセストークンは期限切れ前に更新する
+    ・discovery ドキュメントはライブラリ同梱の静的ファイルを使う
+    ・HTTP 接続（httplib2.Http）はスレッドごとに保持して keep-alive で再利用
+    ・stats() で読み込み・更新・API呼び出しの回数と時間を参照できる
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._credentials = None
+        self._pid = None
+        self._counters = {}
+        self._reset_counters()
+
+    def _reset_counters(self):
+        self._counters = {
+            "credential_loads": 0,
+            "token_refreshes": 0,
+            "service_builds": 0,
+            "api_calls": 0,
+            "api_errors": 0,
+            "api_seconds": 0.0,
+            "token_refresh_seconds": 0.0,
+        }
+
+    def _check_fork(self):
+        """gunicorn の fork 後は親プロセスの接続・トークンを引き継がない"""
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self._credentials = None
+                    self._local = threading.local()
+                    self._reset_counters()
+                    self._pid = pid
+
+    def _load_credentials(self):
+        from google.oauth2 import service_account
+
+        cred_json = os.getenv("SERVICE_CRED_JSON")
+        if cred_json:
+            creds = service_account.Credentials.from_service_account_info(
+                json.loads(cred_json), scopes=SCOPES
+            )
+        else:
+            creds = service_account.Credentials.from_service_account_file(
+                SERVICE_CRED, scopes=SCOPES
+            )
+        self._counters["credential_loads"] += 1
+        return creds
+
+    def get_credentials(self):
+        """読み込み済みの認証情報を返す（期限が近ければ更新）"""
+        self._check_fork()
+        with self._lock:
+            if self._credentials is None:
+                self._credentials = self._load_credentials()
+            creds = self._credentials
+
+            expiry = creds.expiry
+            expiring = expiry is None or expiry - datetime.utcnow() < timedelta(seconds=TOKEN_REFRESH_MARGIN)
+            if not creds.valid or expiring:
+                import httplib2
+                import google_auth_httplib2
+
+                started = time_module.perf_counter()
+                creds.refresh(google_auth_httplib2.Request(httplib2.Http(timeout=HTTP_TIMEOUT)))
+                self._counters["token_refreshes"] += 1
+                self._counters["token_refresh_seconds"] += time_module.perf_counter() - started
+            return creds
+
+    def get_service(self):
+        """スレッドごとに保持した Calendar API クライアントを返す"""
+        creds = self.get_credentials()
+        service = getattr(self._local, "service", None)
+        if service is None:
+            import httplib2
+            import google_auth_httplib2
+            from googleapiclient.discovery import build
+
+            authorized_http = google_auth_httplib2.AuthorizedHttp(
+                creds, http=httplib2.Http(timeout=HTTP_TIMEOUT)
+            )
+            client_options = {"api_endpoint": API_ROOT.rstrip("/") + "/calendar/v3/"} if API_ROOT else None
+            service = build(
+                "calendar", "v3",
+                http=authorized_http,
+                static_discovery=True,
+                cache_discovery=False,
+                client_options=client_options,
+            )
+            self._local.service = service
+            with self._lock:
+                self._counters["service_builds"] += 1
+        return service
+
+    def new_batch_http_request(self, callback):
+        """バッチリクエストを作成（CALENDAR_API_ROOT 指定時はその配下に送信）"""
+        from googleapiclient.http import BatchHttpRequest
+
+        service = self.get_service()
+        if API_ROOT:
+            return BatchHttpRequest(callback=callback,
+                                    batch_uri=API_ROOT.rstrip("/") + "/batch/calendar/v3")
+        return service.new_batch_http_request(callback=callback)
+
+    def execute(self, request):
+        """API リクエストを実行して時間を記録する"""
+        started = time_module.perf_counter()
+        try:
+            with request_metrics.timed("calendar"):
+                return request.execute()
+        except Exception:
+            with self._lock:
+                self._counters["api_errors"] += 1
+            prometheus_metrics.CALENDAR_ERRORS.inc()
+            raise
+        finally:
+            elapsed = time_module.perf_counter() - started
+            with self._lock:
+                self._counters["api_calls"] += 1
+                self._counters["api_seconds"] += elapsed
+            prometheus_metrics.CALENDAR_LATENCY.observe(elapsed)
+
+    def stats(self):
+        """カウンターのスナップショット"""
+        with self._lock:
+            snapshot = dict(self._counters)
+        calls = snapshot["api_calls"]
+        snapshot["api_avg_ms"] = round(snapshot["api_seconds"] * 1000 / calls, 1) if calls else 0.0
+        return snapshot
+
+    def reset(self):
+        """認証情報・クライアントを破棄する（認証ファイル差し替え時など）"""
+        with self._lock:
+            self._credentials = None
+            self._local = threading.local()
+
+
+client_manager = CalendarClientManager()
+
+
 def get_calendar_service_sa():
-    """サービスアカウントで Calendar API クライアントを生成"""
+    """サービスアカウントの Calendar API クライアントを取得（プロセス内で再利用）"""
     try:
-        creds = service_account.Credentials.from_service_account_file(
-            SERVICE_CRED, scopes=SCOPES
-        )
-        return build("calendar", "v3", credentials=creds)
+        return client_manager.get_service()
     except Exception as e:
         print(f"サービスアカウント認証エラー: {e}")
         raise
 
+def resolve_calendar_id(calendar_id):
+    """引数で渡されたカレンダーIDを優先し、"primary" の場合は環境変数を使う"""
+    return calendar_id if calendar_id and calendar_id != "primary" else CALENDAR_ID
+
+
+def build_event_body(date_obj, time_obj, duration_minutes, content, impression=None, tags=None, event_id=None):
+    """ログ1件分のイベント本文を作成"""
+    # date と time を datetime に結合
+    start_datetime = datetime.combine(date_obj, time_obj)
+    
+    # タイトルの作成（タグを含む）
+    title = f"📚 {content}"
+    if tags and tags.strip():
+        # タグをハッシュタグ形式で追加
+        tag_list = [f"#{tag.strip()}" for tag in tags.split(',') if tag.strip()]
+        title += f" {' '.join(tag_list)}"
+    
+    # 説明文の作成（感想・メモを含む）
+    description_parts = [
+        f"作業内容: {content}",
+        f"記録時間: {duration_minutes}分"
+    ]
+    
+    if impression and impression.strip():
+        description_parts.append(f"\n感想・メモ:\n{impression}")
+    
+    if tags and tags.strip():
+        description_parts.append(f"\nタグ: {tags}")
+    
+    description = "\n".join(description_parts)
+    
+    event_body = {
+        "summary": title,
+        "description": description,
+        "start": {
+            "dateTime": start_datetime.isoformat(),
+            "timeZone": "Asia/Tokyo",
+        },
+        "end": {
+            "dateTime": (start_datetime + timedelta(minutes=duration_minutes)).isoformat(),
+            "timeZone": "Asia/Tokyo",
+        },
+    }
+    
+    # クライアント指定のイベントID（再送しても重複登録されない）
+    if event_id:
+        event_body["id"] = event_id
+    
+    return event_body
+
+
+def event_id_for_log(log_id):
+    """ログIDから決まるイベントID（base32hex の文字 0-9a-v のみ使用）"""
+    return f"log{log_id:08d}"
+
+
+# ── バックエンド ───────────────────────────────
+# CALENDAR_BACKEND=fake にするとネットワークを使わずに動作確認できる
+
+class CalendarError(Exception):
+    """カレンダー登録の失敗（retryable=True なら再試行対象）"""
+
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+# Calendar API のバッチリクエストに含められる件数の上限
+MAX_BATCH_SIZE = 50
+
+
+# 403 のうち再試行するもの（それ以外の 403 はカレンダーの共有設定などによる恒久的なエラー）
+RATE_LIMIT_REASONS = ("rateLimitExceeded", "userRateLimitExceeded")
+
+
+def _error_reasons(error):
+    """HttpError の応答本文の errors[].reason"""
+    try:
+        data = json.loads(error.content.decode("utf-8"))
+        return {item.get("reason") for item in data["error"].get("errors", [])}
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return set()
+
+
+def _is_retryable_http_error(error):
+    """レート制限（429、reason がレート制限の 403）と 5xx は再試行する"""
+    status = error.resp.status
+    if status == 403:
+        return bool(_error_reasons(error) & set(RATE_LIMIT_REASONS))
+    return status == 429 or status >= 500
+
+
+def _http_error_to_calendar_error(error, event_body):
+    """HttpError を CalendarError に変換（重複登録の 409 は成功扱いで None を返す）"""
+    status = error.resp.status
+    if status == 409 and event_body.get("id"):
+        # 同じイベントIDが登録済み（前回の送信が成功していた）
+        return None
+    return CalendarError(f"HTTP {status}: {error}", retryable=_is_retryable_http_error(error))
+
+
+class GoogleCalendarBackend:
+    """Google Calendar API へ登録するバックエンド"""
+
+    def insert_event(self, calendar_id, event_body):
+        from googleapiclient.errors import HttpError
+
+        try:
+            service = get_calendar_service_sa()
+            return client_manager.execute(service.events().insert(
+                calendarId=resolve_calendar_id(calendar_id),
+                body=event_body
+            ))
+        except HttpError as e:
+            error = _http_error_to_calendar_error(e, event_body)
+            if error is None:
+                return {"id": event_body["id"], "htmlLink": None}
+            raise error
+        except FileNotFoundError as e:
+            raise CalendarError(f"認証ファイルが見つかりません: {SERVICE_CRED} ({e})", retryable=False)
+        except CalendarError:
+            raise
+        except Exception as e:
+            # 通信エラーなどは再試行する
+            raise CalendarError(f"{type(e).__name__}: {e}")
+
+    def insert_events_batch(self, calendar_id, event_bodies):
+        """
+        複数のイベントを1回のバッチHTTPリクエストで登録する（最大 MAX_BATCH_SIZE 件）
+
+        Returns:
+            list: event_bodies と同じ順序で、作成されたイベント（dict）または CalendarError
+        """
+        from googleapiclient.errors import HttpError
+
+        if len(event_bodies) > MAX_BATCH_SIZE:
+            raise ValueError(f"batch size must be <= {MAX_BATCH_SIZE}")
+
+        results = [None] * len(event_bodies)
+
+        def callback(request_id, response, exception):
+            index = int(request_id)
+            if exception is None:
+                results[index] = response
+            elif isinstance(exception, HttpError):
+                error = _http_error_to_calendar_error(exception, event_bodies[index])
+                results[index] = error or {"id": event_bodies[index]["id"], "htmlLink": None}
+            else:
+                results[index] = CalendarError(f"{type(exception).__name__}: {exception}")
+
+        try:
+            service = get_calendar_service_sa()
+            batch = client_manager.new_batch_http_request(callback)
+            target_calendar_id = resolve_calendar_id(calendar_id)
+            for index, event_body in enumerate(event_bodies):
+                batch.add(
+                    service.events().insert(calendarId=target_calendar_id, body=event_body),
+                    request_id=str(index)
+                )
+            client_manager.execute(batch)
+        except HttpError as e:
+            # バッチ全体が失敗した場合は全件同じエラー
+            error = CalendarError(f"HTTP {e.resp.status}: {e}", retryable=_is_retryable_http_error(e))
+            return [error] * len(event_bodies)
+        except FileNotFoundError as e:
+            error = CalendarError(f"認証ファイルが見つかりません: {SERVICE_CRED} ({e})", retryable=False)
+            return [error] * len(event_bodies)
+        except Exception as e:
+            error = CalendarError(f"{type(e).__name__}: {e}")
+            return [error] * len(event_bodies)
+
+        # 応答に含まれなかったリクエストは再試行対象
+        return [
+            result if result is not None else CalendarError("no response in batch")
+            for result in results
+        ]
+
+
+class FakeCalendarBackend:
+    """
+    テスト・オフライン用のバックエンド
+    登録したイベントを events に保持し、fail_times 回だけ失敗させることもできる
+    """
+
+    def __init__(self, fail_times=0, retryable=True):
+        self.events = {}
+        self.calls = 0
+        self.batch_calls = 0
+        self.fail_times = fail_times
+        self.retryable = retryable
+
+    def insert_event(self, calendar_id, event_body):
+        self.calls += 1
+        if self.fail_times > 0:
+            self.fail_times -= 1
+            raise CalendarError("fake calendar failure", retryable=self.retryable)
+
+        event_id = event_body.get("id") or f"fake{len(self.events) + 1:08d}"
+        created = dict(event_body, id=event_id, htmlLink=f"https://calendar.invalid/event?eid={event_id}")
+        self.events.setdefault(calendar_id, {})[event_id] = created
+        return created
+
+    def insert_events_batch(self, calendar_id, event_bodies):
+        self.batch_calls += 1
+        results = []
+        for event_body in event_bodies:
+            try:
+                results.append(self.insert_event(calendar_id, event_body))
+            except CalendarError as e:
+                results.append(e)
+        return results
+
+
+_backend = None
+
+
+def get_calendar_backend():
+    """環境変数 CALENDAR_BACKEND（google / fake）に応じたバックエンドを返す"""
+    global _backend
+    if _backend is None:
+        if os.getenv("CALENDAR_BACKEND", "google") == "fake":
+            _backend = FakeCalendarBackend()
+        else:
+            _backend = GoogleCalendarBackend()
+    return _backend
+
+
+def set_calendar_backend(backend):
+    """バックエンドを差し替える（テスト用）"""
+    global _backend
+    _backend = backend
+
+
 def add_event(calendar_id, date_obj, time_obj, duration_minutes, content, impression=None, tags=None):
     """
-    Google カレンダーへ予定を追加（app.py からの呼び出しに対応）
+    Google カレンダーへ予定を追加（同期呼び出し用）
     
     Args:
         calendar_id: カレンダーID（使用する場合）
@@ -45,66 +434,17 @@ def add_event(calendar_id, date_obj, time_obj, duration_minutes, content, impres
         str: 作成されたイベントのHTMLリンク、または None
     """
     try:
-        # date と time を datetime に結合
-        start_datetime = datetime.combine(date_obj, time_obj)
-        
-        # サービスを取得
-        service = get_calendar_service_sa()
-        
-        # カレンダーIDの決定（引数で渡されたものを優先、なければ環境変数）
-        target_calendar_id = calendar_id if calendar_id != "primary" else CALENDAR_ID
-        
-        # タイトルの作成（タグを含む）
-        title = f"📚 {content}"
-        if tags and tags.strip():
-            # タグをハッシュタグ形式で追加
-            tag_list = [f"#{tag.strip()}" for tag in tags.split(',') if tag.strip()]
-            title += f" {' '.join(tag_list)}"
-        
-        # 説明文の作成（感想・メモを含む）
-        description_parts = [
-            f"作業内容: {content}",
-            f"記録時間: {duration_minutes}分"
-        ]
-        
-        if impression and impression.strip():
-            description_parts.append(f"\n感想・メモ:\n{impression}")
-        
-        if tags and tags.strip():
-            description_parts.append(f"\nタグ: {tags}")
-        
-        description = "\n".join(description_parts)
-        
-        # イベントの作成
-        event_body = {
-            "summary": title,
-            "description": description,
-            "start": {
-                "dateTime": start_datetime.isoformat(),
-                "timeZone": "Asia/Tokyo",
-            },
-            "end": {
-                "dateTime": (start_datetime + timedelta(minutes=duration_minutes)).isoformat(),
-                "timeZone": "Asia/Tokyo",
-            },
-        }
+        event_body = build_event_body(date_obj, time_obj, duration_minutes, content, impression, tags)
         
         print(f"カレンダーにイベントを追加: {event_body['summary']}")
         
-        created = service.events().insert(
-            calendarId=target_calendar_id,
-            body=event_body
-        ).execute()
+        created = get_calendar_backend().insert_event(calendar_id, event_body)
         
         html_link = created.get("htmlLink")
         print(f"カレンダーイベント作成成功: {html_link}")
         
         return html_link
         
-    except FileNotFoundError as e:
-        print(f"認証ファイルが見つかりません: {SERVICE_CRED}")
-        print(f"エラー詳細: {e}")
-        return None
     except Exception as e:
         print(f"カレンダーイベント作成エラー: {type(e).__name__}: {e}")
         return None
@@ -134,10 +474,10 @@ def add_event_with_details(summary: str,
             },
         }
 
-        created = service.events().insert(
+        created = client_manager.execute(service.events().insert(
             calendarId=CALENDAR_ID,
             body=event_body
-        ).execute()
+        ))
 
         return created.get("htmlLink")
     except Exception as e:
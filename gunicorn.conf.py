@@ -0,0 +1,23 @@
+# gunicorn.conf.py - gunicorn の設定（gunicorn は起動ディレクトリのこのファイルを自動で読み込む）
+"""
+Prometheus のメトリクスを全ワーカーで合算するためのマルチプロセスモードの準備をする（prometheus_metrics.py 参照）。
+ワーカーは prometheus_client を読み込む前にこの環境変数を引き継ぐ必要があるので、マスタープロセスで設定する。
+"""
+
+import os
+import shutil
+
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/learning-log-metrics')
+
+
+def on_starting(server):
+    # 前回の起動時の値が残っていると合算されてしまうので空にする
+    path = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):
+    # 終了したワーカーのファイルを集計対象から外す（カウンター・ヒストグラムの値は残る）
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
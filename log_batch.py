@@ -0,0 +1,96 @@
+# log_batch.py - JSON でのログ一括作成 API（POST /api/logs:batch）
+"""
+タイマーやスクリプトなどのプログラムから、複数のログを1リクエストで登録する。
+
+・各エントリを LOG_ENTRY_SCHEMA で型・範囲チェックし、/log と同じ検証（日付・時刻の形式）も行う
+・1件でも不正なエントリがあれば何も登録せず、エントリ番号ごとのエラーを返す
+・全件を1トランザクションでまとめて INSERT し、タグ・ロールアップ・キャッシュ・
+  カレンダー登録ジョブもバッチ単位で1回ずつ更新する
+"""
+
+from db import Session
+import calendar_queue
+import log_import
+
+MAX_BATCH_SIZE = 500
+TEXT_MAX_LENGTH = 10000
+TAGS_MAX_COUNT = 20
+
+# フィールド名: (受け付ける型, 必須か, 追加チェック)
+LOG_ENTRY_SCHEMA = {
+    'date': (str, True, None),
+    'start_time': (str, True, None),
+    'duration': (int, True, lambda v: 0 <= v <= 24 * 60 or '0〜1440 の整数で指定してください'),
+    'content': (str, False, lambda v: len(v) <= TEXT_MAX_LENGTH or f'{TEXT_MAX_LENGTH}文字以内で指定してください'),
+    'impression': (str, False, lambda v: len(v) <= TEXT_MAX_LENGTH or f'{TEXT_MAX_LENGTH}文字以内で指定してください'),
+    'tags': ((str, list), False, lambda v: isinstance(v, str) or (
+        len(v) <= TAGS_MAX_COUNT and all(isinstance(tag, str) for tag in v)
+    ) or f'{TAGS_MAX_COUNT}個以内の文字列の配列で指定してください'),
+}
+
+TYPE_NAMES = {str: '文字列', int: '整数', (str, list): '文字列または配列'}
+
+
+def check_schema(entry, schema=LOG_ENTRY_SCHEMA):
+    """スキーマに合わないフィールドを {フィールド名: エラーメッセージ} で返す"""
+    if not isinstance(entry, dict):
+        return {'_': 'オブジェクトで指定してください'}
+
+    errors = {}
+    for name in entry:
+        if name not in schema:
+            errors[name] = '不明なフィールドです'
+
+    for name, (expected_type, required, check) in schema.items():
+        value = entry.get(name)
+        if value is None:
+            if required:
+                errors[name] = '必須です'
+            continue
+        # JSON の true/false は整数として扱わない
+        if isinstance(value, bool) or not isinstance(value, expected_type):
+            errors[name] = f'{TYPE_NAMES[expected_type]}で指定してください'
+            continue
+        if check:
+            result = check(value)
+            if result is not True:
+                errors[name] = result
+    return errors
+
+
+def validate_entries(entries):
+    """
+    全エントリを検証し (Log の列の辞書のリスト, エラーのリスト) を返す
+    エラー: [{'index': エントリ番号, 'errors': {フィールド名: メッセージ}}, ...]
+    """
+    values_list = []
+    errors = []
+    for index, entry in enumerate(entries):
+        entry_errors = check_schema(entry)
+        if not entry_errors:
+            row = dict(entry)
+            if isinstance(row.get('tags'), list):
+                row['tags'] = ', '.join(row['tags'])
+            try:
+                values_list.append(log_import.validate_log_row(row))
+            except ValueError as e:
+                entry_errors = {'_': str(e)}
+        if entry_errors:
+            errors.append({'index': index, 'errors': entry_errors})
+    return values_list, errors
+
+
+def create_batch(user_id, values_list, calendar_id=None):
+    """検証済みのログを1トランザクションで登録し、作成したログIDのリストを返す"""
+    session = Session()
+    try:
+        log_ids = log_import.insert_logs(session, user_id, values_list)
+        if calendar_id:
+            calendar_queue.enqueue_logs_sync(session, user_id, log_ids, calendar_id)
+        session.commit()
+        return log_ids
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
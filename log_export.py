@@ -0,0 +1,107 @@
+# log_export.py - ログのエクスポート（CSV / JSONL）
+"""
+ユーザーの全ログをストリーミングで書き出す。
+
+・サーバーサイドカーソル（stream_results）で YIELD_PER 行ずつ読み、その都度書き出す
+  （ログ件数が多くてもワーカーのメモリ使用量は一定）
+・列はインポート（log_import.COLUMNS）と同じなので、書き出したファイルをそのまま取り込める
+・gzip=True のときは zlib で逐次圧縮して .gz として返す
+"""
+
+import csv
+import io
+import json
+import os
+import zlib
+
+from sqlalchemy import select
+
+from db import Session, Log
+from log_import import COLUMNS
+
+YIELD_PER = int(os.getenv('EXPORT_YIELD_PER', '1000'))
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+
+def iter_log_rows(user_id, yield_per=YIELD_PER):
+    """ユーザーのログを日付順に (date, start_time, duration, content, impression, tags) で返す"""
+    stmt = select(
+        Log.date, Log.start_time, Log.duration, Log.content, Log.impression, Log.tags
+    ).where(
+        Log.user_id == user_id
+    ).order_by(
+        Log.date, Log.start_time, Log.id
+    ).execution_options(stream_results=True)
+
+    session = Session()
+    try:
+        result = session.execute(stmt).yield_per(yield_per)
+        for row in result:
+            yield row
+    finally:
+        session.close()
+
+
+def _row_values(row):
+    log_date, start_time, duration, content, impression, tags = row
+    return [
+        log_date.isoformat(),
+        start_time.strftime('%H:%M'),
+        duration,
+        content or '',
+        impression or '',
+        tags or '',
+    ]
+
+
+def iter_csv(rows, batch_size=YIELD_PER):
+    """CSV のテキストを batch_size 行ごとにまとめて返す（Excel 用に BOM 付き）"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(COLUMNS)
+
+    for count, row in enumerate(rows, start=1):
+        writer.writerow(_row_values(row))
+        if count % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue()
+
+
+def iter_jsonl(rows, batch_size=YIELD_PER):
+    """JSONL のテキストを batch_size 行ごとにまとめて返す"""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(COLUMNS, _row_values(row))), ensure_ascii=False))
+        if len(lines) >= batch_size:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def iter_gzip(chunks):
+    """テキストのチャンクを逐次 gzip 圧縮して返す"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_logs(user_id, file_format='csv', gzip=False):
+    """エクスポート本文のジェネレーター（gzip=False なら UTF-8 のバイト列）"""
+    rows = iter_log_rows(user_id)
+    chunks = iter_jsonl(rows) if file_format == 'jsonl' else iter_csv(rows)
+    if gzip:
+        return iter_gzip(chunks)
+    return (chunk.encode('utf-8') for chunk in chunks)
@@ -0,0 +1,224 @@
+# log_import.py - ログの一括インポート（CSV / JSONL）
+"""
+スプレッドシート等からの移行用に、CSV または JSONL のファイルをまとめて登録する。
+
+・ファイルは1行ずつ読みながら処理する（全体をメモリに載せない）
+・各行は /log と同じ検証（validate_log_row）を行い、不正な行は行番号付きで報告してスキップ
+・IMPORT_CHUNK_SIZE 行ごとに1トランザクションで一括 INSERT（タグ・ロールアップもまとめて更新）
+・カレンダー連携中のユーザーは、取り込み後にカレンダー一括登録（calendar_backfill）を開始する
+
+列（CSV のヘッダー / JSON のキー）: date, start_time, duration, content, impression, tags
+"""
+
+import csv
+import io
+import json
+import os
+from datetime import datetime
+
+from sqlalchemy import insert, text
+
+from db import Session, Log
+import cache
+import calendar_backfill
+import rollups
+import tagging
+
+CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE', '2000'))
+# レポートに含めるエラー行の上限（件数自体はすべて数える）
+MAX_REPORTED_ERRORS = 100
+
+FORMATS = ('csv', 'jsonl')
+COLUMNS = ('date', 'start_time', 'duration', 'content', 'impression', 'tags')
+
+
+def validate_log_row(row):
+    """
+    1件分の入力（フォームや CSV の行）を検証して Log の列の辞書にする
+    不正な場合は ValueError
+    """
+    def field(name):
+        value = row.get(name)
+        return '' if value is None else str(value)
+
+    try:
+        date_obj = datetime.strptime(field('date').strip(), '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError('日付は YYYY-MM-DD 形式で指定してください')
+
+    try:
+        time_obj = datetime.strptime(field('start_time').strip(), '%H:%M').time()
+    except ValueError:
+        raise ValueError('開始時刻は HH:MM 形式で指定してください')
+
+    try:
+        duration = int(field('duration').strip() or 0)
+    except ValueError:
+        raise ValueError('作業時間（分）は整数で指定してください')
+
+    return {
+        'date': date_obj,
+        'start_time': time_obj,
+        'duration': duration,
+        'content': field('content'),
+        'impression': field('impression'),
+        'tags': field('tags'),
+    }
+
+
+def detect_format(filename, default='csv'):
+    """ファイル名の拡張子から形式を判定"""
+    name = (filename or '').lower()
+    if name.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    if name.endswith('.csv'):
+        return 'csv'
+    return default
+
+
+def iter_csv_rows(stream):
+    """バイナリストリームの CSV を1行ずつ (行番号, 行の辞書, エラー) で返す"""
+    text_stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    reader = csv.DictReader(text_stream)
+    missing = [name for name in ('date', 'start_time', 'duration') if name not in (reader.fieldnames or [])]
+    if missing:
+        yield 1, None, f"ヘッダーに必要な列がありません: {', '.join(missing)}"
+        return
+
+    try:
+        for row in reader:
+            yield reader.line_num, row, None
+    except csv.Error as e:
+        yield reader.line_num, None, f"CSV の形式が正しくありません: {e}"
+
+
+def iter_jsonl_rows(stream):
+    """バイナリストリームの JSONL を1行ずつ (行番号, 行の辞書, エラー) で返す"""
+    for line_num, line in enumerate(io.TextIOWrapper(stream, encoding='utf-8-sig'), start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield line_num, None, 'JSON の形式が正しくありません'
+            continue
+        if not isinstance(row, dict):
+            yield line_num, None, 'JSON オブジェクトではありません'
+            continue
+        yield line_num, row, None
+
+
+def iter_rows(stream, file_format):
+    if file_format == 'jsonl':
+        return iter_jsonl_rows(stream)
+    return iter_csv_rows(stream)
+
+
+def insert_logs(session, user_id, values_list):
+    """
+    検証済みの行をまとめて INSERT し、タグ・ロールアップ・データバージョンも更新する
+    戻り値は追加したログIDのリスト（values_list と同じ順）。commit は呼び出し側で行う
+    """
+    mappings = [dict(values, user_id=user_id) for values in values_list]
+    dialect = session.get_bind().dialect.name
+
+    if dialect == 'sqlite':
+        # SQLite は executemany で一括 INSERT。書き込みロックを持ったまま連続して
+        # 挿入するので、ROWID は直前の最大値から連番で振られる
+        session.bulk_insert_mappings(Log, mappings)
+        last_id = session.query(Log.id).order_by(Log.id.desc()).limit(1).scalar()
+        log_ids = list(range(last_id - len(mappings) + 1, last_id + 1))
+    elif dialect == 'postgresql':
+        # PostgreSQL は先にシーケンスから ID をまとめて採番し、ID 付きで INSERT する
+        # （psycopg2 の executemany は複数行の INSERT ... VALUES にまとめて送信される）
+        log_ids = [log_id for (log_id,) in session.execute(
+            text("SELECT nextval(pg_get_serial_sequence('logs', 'id')) FROM generate_series(1, :count)"),
+            {'count': len(mappings)}
+        )]
+        for mapping, log_id in zip(mappings, log_ids):
+            mapping['id'] = log_id
+        session.execute(insert(Log), mappings)
+    else:
+        session.bulk_insert_mappings(Log, mappings, return_defaults=True)
+        log_ids = [mapping['id'] for mapping in mappings]
+
+    tagging.add_tags_for_logs(session, user_id, [
+        (log_id, mapping['tags']) for log_id, mapping in zip(log_ids, mappings)
+    ])
+    rollups.apply_logs(session, user_id, [
+        (mapping['date'], mapping['duration']) for mapping in mappings
+    ])
+    cache.bump_data_version(session, user_id)
+    return log_ids
+
+
+class ImportReport:
+    """インポート結果（登録件数と、行番号付きのエラー）"""
+
+    def __init__(self):
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+
+    def add_error(self, line_num, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line_num, 'error': message})
+
+    def to_dict(self):
+        return {
+            'imported': self.imported,
+            'failed': self.failed,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors),
+        }
+
+
+def _flush_chunk(user_id, chunk, report):
+    """1チャンク分を1トランザクションで登録"""
+    session = Session()
+    try:
+        insert_logs(session, user_id, [values for _, values in chunk])
+        session.commit()
+        report.imported += len(chunk)
+    except Exception as e:
+        session.rollback()
+        print(f"インポートエラー (user={user_id}, 行 {chunk[0][0]}〜{chunk[-1][0]}): {type(e).__name__}: {e}")
+        for line_num, _ in chunk:
+            report.add_error(line_num, '保存中にエラーが発生したため登録されませんでした')
+    finally:
+        session.close()
+
+
+def import_logs(user_id, stream, file_format='csv', calendar_id=None, chunk_size=None):
+    """
+    ストリームからログを取り込み ImportReport を返す
+
+    calendar_id を指定すると、取り込み後にカレンダー一括登録を開始する
+    """
+    chunk_size = chunk_size or CHUNK_SIZE
+    report = ImportReport()
+    chunk = []
+
+    for line_num, row, error in iter_rows(stream, file_format):
+        if error is None:
+            try:
+                chunk.append((line_num, validate_log_row(row)))
+            except ValueError as e:
+                error = str(e)
+        if error is not None:
+            report.add_error(line_num, error)
+
+        if len(chunk) >= chunk_size:
+            _flush_chunk(user_id, chunk, report)
+            chunk = []
+
+    if chunk:
+        _flush_chunk(user_id, chunk, report)
+
+    if report.imported and calendar_id:
+        with Session() as session:
+            calendar_backfill.start_backfill(session, user_id, calendar_id)
+            session.commit()
+
+    return report
@@ -0,0 +1,104 @@
+# log_sync.py - オフライン記録の一括同期
+"""
+PWA がオフライン中に IndexedDB へ溜めたログを、接続回復後にまとめて受け取る。
+
+・各ログにはクライアントが生成した冪等キー（client_key）が付いている
+  同じキーのログが既にあれば登録せず、既存のログIDを返す（再送しても重複しない）
+・有効なログは1トランザクションで一括登録（タグ・ロールアップ・カレンダーもまとめて更新）
+・同じキーの同時送信で一意制約に当たった場合は、やり直して重複として扱う
+"""
+
+from sqlalchemy.exc import IntegrityError
+
+from db import Session, Log
+import calendar_queue
+import log_import
+
+MAX_SYNC_ENTRIES = 100
+CLIENT_KEY_MAX_LENGTH = 64
+
+STATUS_CREATED = 'created'
+STATUS_DUPLICATE = 'duplicate'
+STATUS_INVALID = 'invalid'
+
+
+def validate_entry(entry):
+    """1件分を検証して (client_key, Log の列の辞書) を返す。不正な場合は ValueError"""
+    if not isinstance(entry, dict):
+        raise ValueError('ログはオブジェクトで指定してください')
+
+    client_key = entry.get('client_key')
+    if not isinstance(client_key, str) or not 0 < len(client_key) <= CLIENT_KEY_MAX_LENGTH:
+        raise ValueError(f'client_key は{CLIENT_KEY_MAX_LENGTH}文字以内の文字列で指定してください')
+
+    values = log_import.validate_log_row(entry)
+    values['client_key'] = client_key
+    return client_key, values
+
+
+def create_logs(session, user_id, entries, calendar_id=None):
+    """
+    検証済みの (client_key, values) を登録し、{client_key: (ステータス, ログID)} を返す
+    commit は呼び出し側で行う
+    """
+    keys = [client_key for client_key, _ in entries]
+    outcomes = {
+        client_key: (STATUS_DUPLICATE, log_id)
+        for client_key, log_id in session.query(Log.client_key, Log.id).filter(
+            Log.user_id == user_id, Log.client_key.in_(keys)
+        )
+    }
+
+    new_values = []
+    for client_key, values in entries:
+        # 既存のキーと、同じリクエスト内で重複したキーは登録しない
+        if client_key not in outcomes:
+            outcomes[client_key] = None
+            new_values.append(values)
+
+    if new_values:
+        log_ids = log_import.insert_logs(session, user_id, new_values)
+        for values, log_id in zip(new_values, log_ids):
+            outcomes[values['client_key']] = (STATUS_CREATED, log_id)
+        if calendar_id:
+            calendar_queue.enqueue_logs_sync(session, user_id, log_ids, calendar_id)
+
+    return outcomes
+
+
+def sync_logs(user_id, raw_entries, calendar_id=None):
+    """
+    クライアントから受け取ったログをまとめて登録し、入力と同じ順の結果リストを返す
+    結果: {'client_key', 'status': created / duplicate / invalid, 'id' または 'error'}
+    """
+    results = []
+    valid = []
+    for entry in raw_entries:
+        client_key = entry.get('client_key') if isinstance(entry, dict) else None
+        try:
+            valid.append(validate_entry(entry))
+            results.append({'client_key': client_key})
+        except ValueError as e:
+            results.append({'client_key': client_key, 'status': STATUS_INVALID, 'error': str(e)})
+
+    outcomes = {}
+    if valid:
+        for attempt in range(2):
+            session = Session()
+            try:
+                outcomes = create_logs(session, user_id, valid, calendar_id)
+                session.commit()
+                break
+            except IntegrityError:
+                # 別リクエストが同じキーを先に登録した（次の試行で重複として扱われる）
+                session.rollback()
+                if attempt:
+                    raise
+            finally:
+                session.close()
+
+    for result in results:
+        if 'status' not in result:
+            status, log_id = outcomes[result['client_key']]
+            result.update(status=status, id=log_id)
+    return results
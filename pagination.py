@@ -0,0 +1,121 @@
+# pagination.py - ログ一覧のキーセット（カーソル）ページング
+"""
+(date, start_time, id) の降順でページングする。
+OFFSET を使わず「前ページ最後の行より後」を条件にするので、
+何ページ目でも読む行数は1ページ分だけになる。
+"""
+
+import base64
+from datetime import datetime
+
+from sqlalchemy import func, tuple_
+
+from db import Log
+from tagging import parse_tags
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+CONTENT_PREVIEW_LENGTH = 50
+
+
+def encode_cursor(log_date, start_time, log_id):
+    """ページ最後の行からカーソル文字列を作る"""
+    raw = f"{log_date.isoformat()}|{start_time.strftime('%H:%M:%S')}|{log_id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """カーソル文字列を (date, time, id) に戻す。不正な場合は ValueError"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        date_str, time_str, id_str = base64.urlsafe_b64decode(padded).decode('utf-8').split('|')
+        return (
+            datetime.strptime(date_str, '%Y-%m-%d').date(),
+            datetime.strptime(time_str, '%H:%M:%S').time(),
+            int(id_str),
+        )
+    except Exception:
+        raise ValueError('invalid cursor')
+
+
+def parse_page_size(value):
+    """limit パラメータを 1〜MAX_PAGE_SIZE に丸める"""
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def fetch_log_page(session, user_id, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    1ページ分のログ一覧行と次ページのカーソルを返す
+
+    一覧に必要な列だけを取得し、作業内容は先頭部分のみ読む。
+    詳細（全文・感想）は fetch_log_detail() で個別に取得する。
+    """
+    query = session.query(
+        Log.id,
+        Log.date,
+        Log.start_time,
+        Log.duration,
+        func.substr(Log.content, 1, CONTENT_PREVIEW_LENGTH + 1).label('content_preview'),
+        Log.tags,
+        Log.calendar_status,
+    ).filter(Log.user_id == user_id)
+
+    if cursor:
+        last_date, last_time, last_id = decode_cursor(cursor)
+        query = query.filter(
+            tuple_(Log.date, Log.start_time, Log.id) < tuple_(last_date, last_time, last_id)
+        )
+
+    # 1件多く取得して次ページの有無を判定
+    rows = query.order_by(
+        Log.date.desc(), Log.start_time.desc(), Log.id.desc()
+    ).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last.date, last.start_time, last.id)
+
+    return rows, next_cursor
+
+
+def fetch_log_detail(session, user_id, log_id):
+    """ログ1件の詳細（他ユーザーのログは None）"""
+    return session.query(Log).filter_by(id=log_id, user_id=user_id).first()
+
+
+def log_row_to_dict(row):
+    """一覧行を JSON 用の辞書にする"""
+    content = row.content_preview or ''
+    truncated = len(content) > CONTENT_PREVIEW_LENGTH
+    return {
+        'id': row.id,
+        'date': row.date.strftime('%Y-%m-%d'),
+        'start_time': row.start_time.strftime('%H:%M'),
+        'duration': row.duration,
+        'content': content[:CONTENT_PREVIEW_LENGTH],
+        'content_truncated': truncated,
+        'tags': parse_tags(row.tags),
+        'calendar_status': row.calendar_status,
+    }
+
+
+def log_detail_to_dict(log):
+    """ログ詳細を JSON 用の辞書にする"""
+    return {
+        'id': log.id,
+        'date': log.date.strftime('%Y-%m-%d'),
+        'date_label': log.date.strftime('%Y年%m月%d日'),
+        'start_time': log.start_time.strftime('%H:%M'),
+        'duration': log.duration,
+        'content': log.content or '',
+        'impression': log.impression or '',
+        'tags': parse_tags(log.tags),
+        'calendar_status': log.calendar_status,
+        'calendar_event_link': log.calendar_event_link,
+    }
@@ -0,0 +1,157 @@
+# passwords.py - パスワードのハッシュ化・照合サービス
+"""
+パスワードのハッシュ計算（scrypt / pbkdf2）は CPU を多く使うので、
+Web ワーカーのスレッドでは行わず、上限付きのプロセスプールで実行する。
+
+・PASSWORD_HASH_METHOD   : werkzeug の method 文字列（例: scrypt:32768:8:1, pbkdf2:sha256:600000）
+・PASSWORD_HASH_WORKERS  : プールのプロセス数（0 ならプールを使わずその場で計算）
+・PASSWORD_HASH_MAX_PENDING : 同時に投入できる計算の上限（超えた分は空きが出るまで待つ）
+・PASSWORD_HASH_TIMEOUT  : 空き待ち・計算それぞれの待ち時間の上限（秒）。超えたら PasswordServiceBusy
+
+保存済みハッシュのパラメータが現在の設定と違う場合、needs_rehash() が True を返す。
+ログイン成功時にその場で再ハッシュする（app.py の login 参照）。
+
+プールは spawn で起動するため、子プロセスはメインモジュールを読み直す。
+app をインポートするスクリプトは処理を if __name__ == '__main__': の中に書くこと。
+"""
+
+import atexit
+import multiprocessing
+import os
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt')
+WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', '2'))
+MAX_PENDING = int(os.getenv('PASSWORD_HASH_MAX_PENDING', str(max(WORKERS, 1) * 4)))
+TIMEOUT_SECONDS = float(os.getenv('PASSWORD_HASH_TIMEOUT', '10'))
+
+_executor = None
+_executor_pid = None
+_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(MAX_PENDING)
+_method_prefix = None
+
+
+class PasswordServiceBusy(Exception):
+    """プールが混雑していて時間内に計算できなかった（app.py で「しばらくしてから再試行」を返す）"""
+
+
+def _get_executor():
+    """プロセスごとにプールを作る（fork 後の子プロセスでは作り直す）"""
+    global _executor, _executor_pid
+    if WORKERS <= 0:
+        return None
+
+    with _lock:
+        if _executor is None or _executor_pid != os.getpid():
+            # Web ワーカーのスレッドから fork しないよう spawn で起動する
+            _executor = ProcessPoolExecutor(
+                max_workers=WORKERS, mp_context=multiprocessing.get_context('spawn')
+            )
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def _reset_executor():
+    global _executor
+    with _lock:
+        if _executor is not None and _executor_pid == os.getpid():
+            _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def shutdown():
+    _reset_executor()
+
+
+atexit.register(shutdown)
+
+
+@contextmanager
+def _slot():
+    """同時に投入できる計算の枠を1つ使う（TIMEOUT_SECONDS 待っても空かなければ PasswordServiceBusy）"""
+    if not _slots.acquire(timeout=TIMEOUT_SECONDS):
+        print("パスワードハッシュ用プールが混雑しています（空き待ちがタイムアウト）")
+        raise PasswordServiceBusy('password hashing pool is saturated')
+    try:
+        yield
+    finally:
+        _slots.release()
+
+
+def _results(futures):
+    """全ての結果を待つ。TIMEOUT_SECONDS 以内に終わらなければ取り消して PasswordServiceBusy"""
+    _, not_done = wait(futures, timeout=TIMEOUT_SECONDS)
+    if not_done:
+        for future in futures:
+            future.cancel()
+        print("パスワードハッシュ用プールが混雑しています（計算がタイムアウト）")
+        raise PasswordServiceBusy('password hashing timed out')
+    return [future.result() for future in futures]
+
+
+def _run(func, *args):
+    """プールで func(*args) を実行する。プールが使えなければその場で計算する"""
+    executor = _get_executor()
+    if executor is None:
+        return func(*args)
+
+    with _slot():
+        try:
+            return _results([executor.submit(func, *args)])[0]
+        except BrokenProcessPool:
+            print("パスワードハッシュ用プールが停止したため作り直します")
+            _reset_executor()
+            return func(*args)
+
+
+def hash_password(password):
+    """現在の設定でハッシュ化する"""
+    return _run(generate_password_hash, password, HASH_METHOD)
+
+
+def verify_password(password_hash, password):
+    """ハッシュとパスワードを照合する"""
+    if not password_hash:
+        return False
+    return _run(check_password_hash, password_hash, password)
+
+
+def verify_any(password_hashes, password):
+    """
+    いずれかのハッシュと一致すれば True（パスワード履歴のチェック用）
+    プールがあるときは全件を並列に照合する
+    """
+    password_hashes = [h for h in password_hashes if h]
+    executor = _get_executor()
+    if executor is None or len(password_hashes) <= 1:
+        return any(verify_password(h, password) for h in password_hashes)
+
+    with _slot():
+        try:
+            return any(_results([executor.submit(check_password_hash, h, password) for h in password_hashes]))
+        except BrokenProcessPool:
+            print("パスワードハッシュ用プールが停止したため作り直します")
+            _reset_executor()
+            return any(check_password_hash(h, password) for h in password_hashes)
+
+
+def current_method_prefix():
+    """現在の設定で作られるハッシュの method 部分（例: scrypt:32768:8:1）"""
+    global _method_prefix
+    if _method_prefix is None:
+        # werkzeug の既定パラメータも含めた正規の表記を得るため、1回だけ実際にハッシュ化する
+        _method_prefix = generate_password_hash('', method=HASH_METHOD).split('$', 1)[0]
+    return _method_prefix
+
+
+def needs_rehash(password_hash):
+    """保存済みのハッシュが現在の設定と違うアルゴリズム・パラメータで作られていれば True"""
+    if not password_hash or '$' not in password_hash:
+        return True
+    return password_hash.split('$', 1)[0] != current_method_prefix()
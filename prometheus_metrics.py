@@ -0,0 +1,85 @@
+# prometheus_metrics.py - Prometheus 形式のメトリクス
+"""
+/metrics で Prometheus 形式のメトリクスを返す（管理者ユーザー、または METRICS_TOKEN を Bearer で送った場合のみ）。
+
+    http_request_duration_seconds{method, endpoint, status}  ルート・ステータスごとのレイテンシ
+    db_queries_total{endpoint} / db_query_seconds_total{endpoint}  リクエスト内の SQL の回数・時間
+    rate_limit_rejections_total{endpoint}                    レート制限で拒否した回数
+    calendar_api_duration_seconds / calendar_api_errors_total  Google Calendar API の呼び出し
+    smtp_send_duration_seconds / smtp_send_errors_total      メール送信
+
+gunicorn の複数ワーカーの値を合算するため、PROMETHEUS_MULTIPROC_DIR が設定されていれば
+prometheus_client のマルチプロセスモードで集計する（gunicorn.conf.py が起動時に設定・初期化する）。
+カレンダー登録・メール送信は worker.py で行うので、WORKER_METRICS_PORT を設定すると
+worker.py もそのポートでメトリクスを公開する。
+"""
+
+import hmac
+import os
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest, multiprocess,
+    start_http_server,
+)
+
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'リクエストの処理時間', ['method', 'endpoint', 'status'],
+)
+DB_QUERIES = Counter('db_queries_total', 'リクエスト内で実行した SQL の数', ['endpoint'])
+DB_QUERY_SECONDS = Counter('db_query_seconds_total', 'リクエスト内で SQL にかかった時間', ['endpoint'])
+RATE_LIMITED = Counter('rate_limit_rejections_total', 'レート制限で拒否したリクエスト数', ['endpoint'])
+
+CALENDAR_LATENCY = Histogram(
+    'calendar_api_duration_seconds', 'Google Calendar API の呼び出し時間（バッチは1回として数える）',
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+CALENDAR_ERRORS = Counter('calendar_api_errors_total', 'Google Calendar API の呼び出しエラー数')
+SMTP_LATENCY = Histogram(
+    'smtp_send_duration_seconds', 'メール1通の送信時間（接続・再接続を含む）',
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+SMTP_ERRORS = Counter('smtp_send_errors_total', 'メール送信のエラー数')
+
+
+def observe_request(metrics, method, endpoint, status, **fields):
+    """request_metrics.RequestMetrics の内容を記録する（fields は使わない）"""
+    endpoint = endpoint or 'none'
+    REQUEST_LATENCY.labels(method, endpoint, str(status)).observe(metrics.elapsed())
+    if metrics.queries:
+        DB_QUERIES.labels(endpoint).inc(metrics.queries)
+        DB_QUERY_SECONDS.labels(endpoint).inc(metrics.spans['db'])
+
+
+def is_authorized(authorization, user):
+    """管理者ユーザー、または Authorization: Bearer <METRICS_TOKEN> なら True"""
+    if getattr(user, 'is_authenticated', False) and getattr(user, 'is_admin', False):
+        return True
+    if METRICS_TOKEN and authorization and authorization.startswith('Bearer '):
+        return hmac.compare_digest(authorization[len('Bearer '):].encode(), METRICS_TOKEN.encode())
+    return False
+
+
+def _registry():
+    """マルチプロセスモードでは全ワーカーの値を合算するレジストリ"""
+    if not MULTIPROC_DIR:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def latest():
+    """(本文, Content-Type) を返す"""
+    return generate_latest(_registry()), CONTENT_TYPE_LATEST
+
+
+def start_worker_server():
+    """worker.py 用: WORKER_METRICS_PORT が設定されていればメトリクスを公開する"""
+    port = os.getenv('WORKER_METRICS_PORT')
+    if not port:
+        return
+    start_http_server(int(port), registry=_registry())
+    print(f"メトリクスをポート {port} で公開しています")
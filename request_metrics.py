@@ -0,0 +1,200 @@
+# request_metrics.py - リクエストごとの処理時間の計測
+"""
+1リクエストの中で実行された SQL の回数・時間と、カレンダー API・SMTP・テンプレート描画の時間を数え、
+
+・Server-Timing ヘッダーで返す（ブラウザの開発者ツールの「タイミング」に表示される）
+    Server-Timing: db;dur=12.4;desc="9 queries", render;dur=3.1, total;dur=18.9
+・同じ SQL が何度も実行されていたら N+1 の候補としてログに出す
+・遅いリクエストを JSON 1行でログに出す（ログの集計基盤で検索しやすいように）
+
+    REQUEST_SLOW_MS          : これ以上かかったリクエストをログに出す（ミリ秒。既定 500、0 で出さない）
+    SQL_N_PLUS_ONE_THRESHOLD : 同じ SQL が1リクエスト内でこの回数以上実行されたら N+1 の候補とする（既定 5）
+    SERVER_TIMING            : 0 なら Server-Timing ヘッダーを付けない（既定 1）
+
+計測中のリクエストは ContextVar で持つので、Flask（スレッド）でも asyncio 版の API でも同じ仕組みで数えられる。
+リクエストの外（worker.py・CLI）では何もしない。
+"""
+
+import json
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+import prometheus_metrics
+
+SLOW_REQUEST_MS = float(os.getenv('REQUEST_SLOW_MS', '500'))
+N_PLUS_ONE_THRESHOLD = int(os.getenv('SQL_N_PLUS_ONE_THRESHOLD', '5'))
+SERVER_TIMING_ENABLED = os.getenv('SERVER_TIMING', '1') == '1'
+
+# Server-Timing に出す区間（db は常に、それ以外は計測された場合だけ出す）
+SPANS = ('db', 'calendar', 'smtp', 'render')
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """1リクエスト分の計測結果"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = {name: 0.0 for name in SPANS}
+        self.queries = 0
+        # SQL 文ごとの (回数, 合計秒)
+        self.statements = {}
+
+    def add(self, name, seconds):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def add_query(self, statement, seconds):
+        self.queries += 1
+        self.spans['db'] += seconds
+        count, total = self.statements.get(statement, (0, 0.0))
+        self.statements[statement] = (count + 1, total + seconds)
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def n_plus_one(self):
+        """N+1 の候補（同じ SQL が閾値以上実行されたもの）を回数の多い順に返す"""
+        if N_PLUS_ONE_THRESHOLD <= 0:
+            return []
+        candidates = [
+            {'statement': ' '.join(statement.split())[:300], 'count': count, 'ms': round(total * 1000, 1)}
+            for statement, (count, total) in self.statements.items()
+            if count >= N_PLUS_ONE_THRESHOLD
+        ]
+        return sorted(candidates, key=lambda c: c['count'], reverse=True)
+
+    def server_timing(self, n_plus_one=None):
+        """Server-Timing ヘッダーの値"""
+        db_desc = f"{self.queries} queries"
+        if n_plus_one:
+            db_desc += ', N+1?'
+        parts = [f'db;dur={self.spans["db"] * 1000:.1f};desc="{db_desc}"']
+        for name in SPANS[1:]:
+            if self.spans[name]:
+                parts.append(f'{name};dur={self.spans[name] * 1000:.1f}')
+        parts.append(f'total;dur={self.elapsed() * 1000:.1f}')
+        return ', '.join(parts)
+
+    def to_log(self, **fields):
+        """ログに出す内容（fields はメソッド・パスなど呼び出し側の情報）"""
+        record = dict(fields)
+        record.update(
+            duration_ms=round(self.elapsed() * 1000, 1),
+            db_queries=self.queries,
+            **{f'{name}_ms': round(seconds * 1000, 1) for name, seconds in self.spans.items()},
+        )
+        return record
+
+
+def start():
+    """計測を開始し、finish() に渡すトークンを返す"""
+    return _current.set(RequestMetrics())
+
+
+def finish(token):
+    _current.reset(token)
+
+
+def current():
+    """計測中のリクエストの RequestMetrics（リクエストの外では None）"""
+    return _current.get()
+
+
+@contextmanager
+def timed(name):
+    """with timed('calendar'): ... の区間の時間を計測中のリクエストに加算する"""
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add(name, time.perf_counter() - started)
+
+
+def report(metrics, **fields):
+    """
+    N+1 の候補と遅いリクエストをログに出し、Prometheus のメトリクスに記録して、
+    Server-Timing ヘッダーの値を返す（SERVER_TIMING=0 のときは None）
+    """
+    prometheus_metrics.observe_request(metrics, **fields)
+    candidates = metrics.n_plus_one()
+    if candidates:
+        print(json.dumps(dict(event='sql_n_plus_one', **fields, candidates=candidates), ensure_ascii=False))
+
+    record = metrics.to_log(event='slow_request', **fields)
+    if SLOW_REQUEST_MS > 0 and record['duration_ms'] >= SLOW_REQUEST_MS:
+        record['n_plus_one'] = len(candidates)
+        print(json.dumps(record, ensure_ascii=False))
+
+    return metrics.server_timing(candidates) if SERVER_TIMING_ENABLED else None
+
+
+def instrument_engine(engine):
+    """エンジンで実行される SQL を計測中のリクエストに記録する（非同期エンジンは engine.sync_engine を渡す）"""
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if context is not None and _current.get() is not None:
+            context._request_metrics_started = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        metrics = _current.get()
+        started = getattr(context, '_request_metrics_started', None)
+        if metrics is not None and started is not None:
+            metrics.add_query(statement, time.perf_counter() - started)
+
+
+def init_app(app):
+    """Flask アプリのリクエストごとに計測し、レスポンスに Server-Timing を付ける"""
+    from flask import g, request, before_render_template, template_rendered
+
+    @app.before_request
+    def _start_request_metrics():
+        g._request_metrics_token = start()
+
+    @app.after_request
+    def _add_server_timing(response):
+        metrics = current()
+        if metrics is None:
+            return response
+        header = report(
+            metrics,
+            method=request.method,
+            path=request.path,
+            endpoint=request.endpoint,
+            status=response.status_code,
+        )
+        if header:
+            response.headers['Server-Timing'] = header
+        return response
+
+    @app.teardown_request
+    def _finish_request_metrics(error=None):
+        token = g.pop('_request_metrics_token', None)
+        if token is not None:
+            finish(token)
+
+    # テンプレートの描画時間（include などで入れ子になっても外側の1回だけ数える）
+    def _before_render(sender, template, context, **extra):
+        metrics = current()
+        if metrics is not None and not hasattr(metrics, '_render_started'):
+            metrics._render_started = time.perf_counter()
+
+    def _after_render(sender, template, context, **extra):
+        metrics = current()
+        started = getattr(metrics, '_render_started', None)
+        if started is not None:
+            metrics.add('render', time.perf_counter() - started)
+            del metrics._render_started
+
+    before_render_template.connect(_before_render, app, weak=False)
+    template_rendered.connect(_after_render, app, weak=False)
@@ -0,0 +1,298 @@
+# rollups.py - 日別・週別・月別の集計テーブル管理
+"""
+ログ登録時にロールアップテーブルを加算更新し、
+ダッシュボードは表示するバケット数分の行だけを読む。
+
+・apply_log()        : /log と同じセッション（トランザクション）内で呼ぶ
+・rebuild_rollups()  : 既存データから再集計（flask rebuild-rollups）。集計は DB 側の GROUP BY で行う
+・fetch_*()          : ダッシュボード・統計ページ用の読み出し
+"""
+
+from datetime import date, timedelta
+
+from sqlalchemy import func, case, cast, insert, select, Date, Integer
+from sqlalchemy.dialects import postgresql, sqlite
+
+from db import Log, DailyRollup, WeeklyRollup, MonthlyRollup
+import analytics
+
+# (テーブル, バケットの列名, analytics.bucket_totals() のキー)
+ROLLUP_TABLES = (
+    (DailyRollup, 'day', 'daily'),
+    (WeeklyRollup, 'week_start', 'weekly'),
+    (MonthlyRollup, 'month_start', 'monthly'),
+)
+
+
+def week_start_of(day):
+    """その日が属する週（月曜始まり）の月曜日"""
+    return day - timedelta(days=day.weekday())
+
+
+def month_start_of(day):
+    """その日が属する月の1日"""
+    return day.replace(day=1)
+
+
+def _bucket_keys(day):
+    """各ロールアップテーブルと主キー値の組を返す"""
+    return [
+        (DailyRollup, {'day': day}),
+        (WeeklyRollup, {'week_start': week_start_of(day)}),
+        (MonthlyRollup, {'month_start': month_start_of(day)}),
+    ]
+
+
+def _upsert_many(session, model, key_names, rows):
+    """
+    複数バケットに加算する（PostgreSQL/SQLite は INSERT ... ON CONFLICT を executemany）
+    rows: キー列と total_minutes / log_count の辞書のリスト
+    """
+    dialect = session.get_bind().dialect.name
+
+    if dialect in ('postgresql', 'sqlite'):
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        stmt = insert(model)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=key_names,
+            set_={
+                'total_minutes': model.total_minutes + stmt.excluded.total_minutes,
+                'log_count': model.log_count + stmt.excluded.log_count,
+            }
+        )
+        session.execute(stmt, rows)
+        return
+
+    # その他のDBは行ロックして加算
+    for values in rows:
+        keys = {name: values[name] for name in key_names}
+        row = session.query(model).filter_by(**keys).with_for_update().first()
+        if row:
+            row.total_minutes += values['total_minutes']
+            row.log_count += values['log_count']
+        else:
+            session.add(model(**values))
+
+
+def _upsert(session, model, keys, minutes, count):
+    """1バケットに加算"""
+    _upsert_many(session, model, list(keys), [dict(keys, total_minutes=minutes, log_count=count)])
+
+
+def apply_log(session, user_id, log_date, duration, count=1):
+    """
+    ログ1件分（count=-1 なら削除分）をロールアップに反映する
+    commit は呼び出し側で行う（ログ本体と同一トランザクションにするため）
+    """
+    for model, keys in _bucket_keys(log_date):
+        _upsert(session, model, dict(keys, user_id=user_id), duration * count, count)
+
+
+def apply_logs(session, user_id, entries):
+    """
+    複数ログ分をロールアップに反映する（一括登録用）
+    entries: [(日付, 分), ...]。バケットごとに合算してからまとめて加算する
+    """
+    buckets = analytics.summarize(entries)
+    for model, key_name, name in ROLLUP_TABLES:
+        _upsert_many(session, model, ['user_id', key_name], [
+            {'user_id': user_id, key_name: bucket, 'total_minutes': minutes, 'log_count': count}
+            for bucket, (minutes, count) in buckets[name].items()
+        ])
+
+
+def delete_user_rollups(session, user_id):
+    """ユーザーのロールアップを全削除"""
+    for model in (DailyRollup, WeeklyRollup, MonthlyRollup):
+        session.query(model).filter_by(user_id=user_id).delete(synchronize_session=False)
+
+
+def bucket_start(session, key_name, column=Log.date):
+    """
+    日付の列をロールアップのバケットの開始日に丸める SQL 式（key_name は ROLLUP_TABLES の列名）
+
+    PostgreSQL は date_trunc('week' / 'month')（週は月曜始まり）、
+    SQLite は date() の修飾子（次の日曜日から6日戻る）と strftime を使う。その他のDBは None
+    """
+    if key_name == 'day':
+        return column
+    dialect = session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        unit = 'week' if key_name == 'week_start' else 'month'
+        return cast(func.date_trunc(unit, column), Date)
+    if dialect == 'sqlite':
+        if key_name == 'week_start':
+            return func.date(column, 'weekday 0', '-6 days')
+        return func.strftime('%Y-%m-01', column)
+    return None
+
+
+def _delete_rollups(session, user_id):
+    for model in (DailyRollup, WeeklyRollup, MonthlyRollup):
+        query = session.query(model)
+        if user_id is not None:
+            query = query.filter_by(user_id=user_id)
+        query.delete(synchronize_session=False)
+
+
+def rebuild_rollups(session, user_id=None):
+    """
+    logs テーブルからロールアップを作り直す
+
+    PostgreSQL/SQLite はバケットごとの GROUP BY の結果を INSERT ... SELECT で直接書き込む
+    （ログ・集計結果をアプリに転送しない）。その他のDBは日別を GROUP BY で受け取り、
+    週別・月別をアプリ側で計算する。
+    user_id を省略すると全ユーザーが対象。戻り値は再集計した日別バケット数。
+    """
+    _delete_rollups(session, user_id)
+    if bucket_start(session, 'week_start') is None:
+        return _rebuild_rollups_in_python(session, user_id)
+
+    daily_buckets = 0
+    for model, key_name, _ in ROLLUP_TABLES:
+        bucket = bucket_start(session, key_name)
+        query = select(
+            Log.user_id,
+            bucket,
+            func.coalesce(func.sum(Log.duration), 0),
+            func.count(Log.id)
+        ).group_by(Log.user_id, bucket)
+        if user_id is not None:
+            query = query.where(Log.user_id == user_id)
+
+        result = session.execute(
+            insert(model).from_select(['user_id', key_name, 'total_minutes', 'log_count'], query)
+        )
+        if model is DailyRollup:
+            daily_buckets = result.rowcount
+    return daily_buckets
+
+
+def _rebuild_rollups_in_python(session, user_id):
+    """日別を SQL の GROUP BY で求め、週別・月別は日別の結果（日数分の行）から計算する"""
+    daily_query = session.query(
+        Log.user_id,
+        Log.date,
+        func.sum(Log.duration),
+        func.count(Log.id)
+    ).group_by(Log.user_id, Log.date)
+
+    if user_id is not None:
+        daily_query = daily_query.filter(Log.user_id == user_id)
+
+    # ユーザーごとに日別の結果から週別・月別を求める
+    per_user = {}
+    for row_user_id, day, minutes, count in daily_query:
+        per_user.setdefault(row_user_id, {})[day.toordinal()] = [int(minutes or 0), count]
+
+    mappings = {model: [] for model, _, _ in ROLLUP_TABLES}
+    for row_user_id, days in per_user.items():
+        buckets = analytics.bucket_totals(days)
+        for model, key_name, name in ROLLUP_TABLES:
+            mappings[model].extend(
+                {'user_id': row_user_id, key_name: bucket, 'total_minutes': minutes, 'log_count': count}
+                for bucket, (minutes, count) in buckets[name].items()
+            )
+
+    for model, rows in mappings.items():
+        if rows:
+            session.bulk_insert_mappings(model, rows)
+
+    return len(mappings[DailyRollup])
+
+
+# ── 読み出し ─────────────────────────────────
+
+def fetch_daily(session, user_id, end_date=None, days=30):
+    """直近 days 日分の (日付, 分) リスト（記録のない日は0）"""
+    end_date = end_date or date.today()
+    start_date = end_date - timedelta(days=days - 1)
+
+    rows = session.query(DailyRollup.day, DailyRollup.total_minutes).filter(
+        DailyRollup.user_id == user_id,
+        DailyRollup.day >= start_date,
+        DailyRollup.day <= end_date
+    ).all()
+    minutes_by_day = dict(rows)
+
+    return [
+        (start_date + timedelta(days=i), minutes_by_day.get(start_date + timedelta(days=i), 0))
+        for i in range(days)
+    ]
+
+
+def fetch_recent(session, model, column, user_id, limit):
+    """記録のある直近 limit バケットを古い順に (開始日, 分) で返す"""
+    rows = session.query(column, model.total_minutes).filter(
+        model.user_id == user_id
+    ).order_by(column.desc()).limit(limit).all()
+    return list(reversed(rows))
+
+
+def fetch_weekly(session, user_id, limit=8):
+    return fetch_recent(session, WeeklyRollup, WeeklyRollup.week_start, user_id, limit)
+
+
+def fetch_monthly(session, user_id, limit=6):
+    return fetch_recent(session, MonthlyRollup, MonthlyRollup.month_start, user_id, limit)
+
+
+def fetch_totals(session, user_id):
+    """(合計分, ログ件数) を月別ロールアップから求める"""
+    total_minutes, total_logs = session.query(
+        func.coalesce(func.sum(MonthlyRollup.total_minutes), 0),
+        func.coalesce(func.sum(MonthlyRollup.log_count), 0)
+    ).filter(MonthlyRollup.user_id == user_id).one()
+    return int(total_minutes), int(total_logs)
+
+
+def fetch_day_summary(session, user_id):
+    """記録のある日数・最初と最後の記録日を日別ロールアップから求める"""
+    days, first_day, last_day = session.query(
+        func.count(DailyRollup.day),
+        func.min(DailyRollup.day),
+        func.max(DailyRollup.day)
+    ).filter(DailyRollup.user_id == user_id).one()
+    return int(days), first_day, last_day
+
+
+# ── 連続記録（gaps-and-islands） ─────────────────
+
+def _island_key(session):
+    """
+    連続した日付で同じ値になる式（日付 − 日付順の行番号）
+
+    SQLite は julianday() で日数に変換、PostgreSQL は date - integer で日付のまま計算する
+    """
+    row_number = func.row_number().over(order_by=DailyRollup.day)
+    if session.get_bind().dialect.name == 'sqlite':
+        return func.julianday(DailyRollup.day) - row_number
+    return DailyRollup.day - cast(row_number, Integer)
+
+
+def fetch_streaks(session, user_id, today=None):
+    """
+    (現在の連続記録日数, 最長連続記録日数) を返す
+
+    記録のある日（日別ロールアップの行）を連続区間ごとにまとめ、
+    今日または昨日で終わる区間の長さを現在の連続記録とする。
+    DB からは集計後の2つの値だけを受け取る。
+    """
+    today = today or date.today()
+    yesterday = today - timedelta(days=1)
+
+    days = session.query(
+        DailyRollup.day.label('day'),
+        _island_key(session).label('island')
+    ).filter(DailyRollup.user_id == user_id).subquery()
+
+    islands = session.query(
+        func.max(days.c.day).label('last_day'),
+        func.count().label('length')
+    ).group_by(days.c.island).subquery()
+
+    current, longest = session.query(
+        func.max(case((islands.c.last_day >= yesterday, islands.c.length))),
+        func.max(islands.c.length)
+    ).one()
+    return int(current or 0), int(longest or 0)
@@ -8,11 +8,10 @@ document.addEventListener('DOMContentLoaded', function() {
     const controller = new AbortController();
     const timeoutId = setTimeout(() => controller.abort(), 10000); // 10秒でタイムアウト
     
+    // ブラウザのキャッシュを ETag で再検証（変更がなければ 304 で本文なし）
     fetch('/api/dashboard', {
         signal: controller.signal,
-        headers: {
-            'Cache-Control': 'no-cache'
-        }
+        cache: 'no-cache'
     })
         .then(response => {
             clearTimeout(timeoutId);
@@ -0,0 +1,124 @@
+// static/js/log-queue.js - オフライン記録の送信待ちキュー（ページと Service Worker で共用）
+//
+// 記録したログは client_key（冪等キー）付きで IndexedDB に保存し、
+// /api/logs/sync にまとめて送信する。サーバーが結果を返したものだけキューから削除するので、
+// 通信が途中で切れても再送で重複登録されない。
+// 各ログには記録したユーザーの ID（user_id）を保存し、送信時にサーバー側のログイン中のユーザーと照合する。
+// 別のユーザーがログインしている間はそのユーザーのログは送信せずキューに残す（ログアウトしても削除しない）。
+
+(function (global) {
+    const DB_NAME = 'learning-log';
+    const DB_VERSION = 1;
+    const STORE = 'pending-logs';
+    const SYNC_URL = '/api/logs/sync';
+    const SYNC_TAG = 'sync-logs';
+    // サーバー側の1リクエストあたりの上限（log_sync.MAX_SYNC_ENTRIES）
+    const BATCH_SIZE = 100;
+
+    function openDb() {
+        return new Promise((resolve, reject) => {
+            const request = indexedDB.open(DB_NAME, DB_VERSION);
+            request.onupgradeneeded = () => {
+                request.result.createObjectStore(STORE, { keyPath: 'client_key' });
+            };
+            request.onsuccess = () => resolve(request.result);
+            request.onerror = () => reject(request.error);
+        });
+    }
+
+    function withStore(mode, callback) {
+        return openDb().then(db => new Promise((resolve, reject) => {
+            const tx = db.transaction(STORE, mode);
+            const result = callback(tx.objectStore(STORE));
+            tx.oncomplete = () => {
+                db.close();
+                resolve(result && 'result' in result ? result.result : undefined);
+            };
+            tx.onerror = () => {
+                db.close();
+                reject(tx.error);
+            };
+        }));
+    }
+
+    function newClientKey() {
+        if (global.crypto && global.crypto.randomUUID) {
+            return global.crypto.randomUUID();
+        }
+        return Date.now().toString(36) + '-' + Math.random().toString(36).slice(2);
+    }
+
+    function add(entry) {
+        const queued = Object.assign({ client_key: newClientKey(), queued_at: Date.now() }, entry);
+        return withStore('readwrite', store => store.put(queued)).then(() => queued);
+    }
+
+    function all() {
+        return withStore('readonly', store => store.getAll());
+    }
+
+    // userId を指定するとそのユーザーの件数
+    function count(userId) {
+        if (userId === undefined) {
+            return withStore('readonly', store => store.count());
+        }
+        return all().then(entries => entries.filter(entry => String(entry.user_id) === String(userId)).length);
+    }
+
+    function remove(keys) {
+        return withStore('readwrite', store => {
+            keys.forEach(key => store.delete(key));
+        });
+    }
+
+    // 送信待ちのログをユーザーごとにまとめて送信する。通信できない・未ログインの場合は reject
+    async function flush() {
+        const summary = { created: 0, duplicate: 0, invalid: 0, held: 0, errors: [] };
+        const groups = new Map();
+        (await all()).forEach(entry => {
+            const userId = entry.user_id === undefined ? null : String(entry.user_id);
+            if (!groups.has(userId)) groups.set(userId, []);
+            groups.get(userId).push(entry);
+        });
+
+        for (const [userId, entries] of groups) {
+            for (let i = 0; i < entries.length; i += BATCH_SIZE) {
+                const batch = entries.slice(i, i + BATCH_SIZE).map(entry => {
+                    const { queued_at, user_id, ...log } = entry;
+                    return log;
+                });
+
+                const response = await fetch(SYNC_URL, {
+                    method: 'POST',
+                    credentials: 'same-origin',
+                    headers: { 'Content-Type': 'application/json', 'Accept': 'application/json' },
+                    body: JSON.stringify(userId === null ? { logs: batch } : { logs: batch, user_id: userId })
+                });
+                // 別のユーザーがログイン中（このユーザーのログはキューに残す）
+                if (response.status === 409) {
+                    summary.held += entries.length - i;
+                    break;
+                }
+                // 未ログインだとログイン画面へリダイレクトされる
+                if (!response.ok || response.redirected) {
+                    throw new Error(`同期に失敗しました (${response.status})`);
+                }
+
+                const data = await response.json();
+                const done = [];
+                data.results.forEach(result => {
+                    if (!result.status || !result.client_key) return;
+                    summary[result.status] += 1;
+                    if (result.status === 'invalid') {
+                        summary.errors.push(result.error);
+                    }
+                    done.push(result.client_key);
+                });
+                await remove(done);
+            }
+        }
+        return summary;
+    }
+
+    global.LogQueue = { add, all, count, flush, SYNC_TAG };
+})(self);
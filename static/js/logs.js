@@ -0,0 +1,98 @@
+// static/js/logs.js - ログ詳細モーダルの遅延読み込み
+
+document.addEventListener('DOMContentLoaded', function() {
+    const modal = document.getElementById('logModal');
+    if (!modal) return;
+
+    const body = document.getElementById('logModalBody');
+    // 一度取得した詳細はページ内で再利用
+    const cache = {};
+
+    const CALENDAR_STATUS_LABELS = {
+        pending: '追加待ち',
+        synced: '追加済み',
+        failed: '追加失敗'
+    };
+
+    modal.addEventListener('show.bs.modal', function(event) {
+        const button = event.relatedTarget;
+        const logId = button && button.getAttribute('data-log-id');
+        if (!logId) return;
+
+        if (cache[logId]) {
+            renderDetail(cache[logId]);
+            return;
+        }
+
+        body.innerHTML = '<div class="text-center my-4"><div class="spinner-border text-primary" role="status"><span class="visually-hidden">Loading...</span></div></div>';
+
+        fetch(`/api/logs/${logId}`)
+            .then(response => {
+                if (!response.ok) {
+                    throw new Error('ログの取得に失敗しました');
+                }
+                return response.json();
+            })
+            .then(log => {
+                cache[logId] = log;
+                renderDetail(log);
+            })
+            .catch(error => {
+                console.error('ログ詳細の取得に失敗しました:', error);
+                body.innerHTML = '<div class="alert alert-danger mb-0">ログ詳細の読み込みに失敗しました。</div>';
+            });
+    });
+
+    // モーダル本文の描画（ユーザー入力は textContent で挿入）
+    function renderDetail(log) {
+        body.innerHTML = '';
+
+        appendField('日付', log.date_label);
+        appendField('時間', `${log.start_time} (${log.duration}分)`);
+        appendField('作業内容', log.content, true);
+        if (log.impression) {
+            appendField('感想・メモ', log.impression, true);
+        }
+        if (log.calendar_status) {
+            const p = appendField('カレンダー', CALENDAR_STATUS_LABELS[log.calendar_status] || log.calendar_status);
+            if (log.calendar_event_link) {
+                const link = document.createElement('a');
+                link.href = log.calendar_event_link;
+                link.target = '_blank';
+                link.rel = 'noopener';
+                link.className = 'ms-2';
+                link.textContent = '予定を開く';
+                p.appendChild(link);
+            }
+        }
+        if (log.tags.length > 0) {
+            const p = appendField('タグ', '', true);
+            log.tags.forEach(tag => {
+                const badge = document.createElement('span');
+                badge.className = 'badge bg-secondary me-1';
+                badge.textContent = tag;
+                p.appendChild(badge);
+            });
+        }
+    }
+
+    function appendField(label, value, block) {
+        const p = document.createElement('p');
+        const strong = document.createElement('strong');
+        strong.textContent = label + ':';
+        p.appendChild(strong);
+        if (block) {
+            p.appendChild(document.createElement('br'));
+        } else {
+            p.appendChild(document.createTextNode(' '));
+        }
+        if (value) {
+            const span = document.createElement('span');
+            span.style.whiteSpace = 'pre-wrap';
+            span.textContent = value;
+            p.appendChild(span);
+        }
+        body.appendChild(p);
+        return p;
+    }
+});
@@ -0,0 +1,124 @@
+// static/js/offline-log.js - ログ記録フォームのオフライン対応
+//
+// フォームの送信内容をいったん送信待ちキュー（log-queue.js）に入れてから同期する。
+// オフラインのときはキューに残し、接続が戻ったら Background Sync（非対応ブラウザでは online イベント）で送信する。
+
+document.addEventListener('DOMContentLoaded', function() {
+    const form = document.getElementById('log-form');
+    const status = document.getElementById('sync-status');
+    if (!form || !window.indexedDB || !window.LogQueue) return;
+    const userId = form.dataset.userId;
+    // Service Worker が有効にならない場合に待ち続けないための上限
+    const SW_READY_TIMEOUT_MS = 3000;
+
+    function showStatus(message, category) {
+        if (!status) return;
+        status.className = `alert alert-${category} mt-3`;
+        status.textContent = message;
+    }
+
+    async function updatePending() {
+        const pending = await LogQueue.count(userId);
+        if (pending > 0) {
+            showStatus(`送信待ちのログが ${pending} 件あります（接続が戻ると自動で送信されます）`, 'warning');
+        }
+        return pending;
+    }
+
+    function serviceWorkerReady() {
+        return Promise.race([
+            navigator.serviceWorker.ready,
+            new Promise((_, reject) => setTimeout(
+                () => reject(new Error('Service Worker が有効になっていません')), SW_READY_TIMEOUT_MS
+            ))
+        ]);
+    }
+
+    async function requestBackgroundSync() {
+        if (!('serviceWorker' in navigator)) return;
+        const registration = await serviceWorkerReady();
+        if (registration.sync) {
+            await registration.sync.register(LogQueue.SYNC_TAG);
+        }
+    }
+
+    async function flush() {
+        try {
+            const summary = await LogQueue.flush();
+            if (summary.invalid > 0) {
+                showStatus(`登録できなかったログがあります: ${summary.errors.join(' / ')}`, 'danger');
+            } else if (summary.created + summary.duplicate > 0) {
+                showStatus('ログを記録しました', 'success');
+            }
+            return true;
+        } catch (error) {
+            console.warn('ログの同期を保留しました:', error);
+            await requestBackgroundSync().catch(() => {});
+            await updatePending();
+            return false;
+        }
+    }
+
+    form.addEventListener('submit', async function(event) {
+        event.preventDefault();
+        const data = new FormData(form);
+
+        await LogQueue.add({
+            user_id: userId,
+            date: data.get('date'),
+            start_time: data.get('start_time'),
+            duration: data.get('duration'),
+            content: data.get('content') || '',
+            impression: data.get('impression') || '',
+            tags: data.get('tags') || ''
+        });
+
+        // 入力欄をクリア（日付・開始時刻は残す）
+        form.querySelectorAll('textarea, input[name="duration"]').forEach(el => { el.value = ''; });
+        const tagsInput = document.getElementById('tags-input');
+        if (tagsInput && tagsInput.__tagify) {
+            tagsInput.__tagify.removeAllTags();
+        }
+
+        if (navigator.onLine) {
+            await flush();
+        } else {
+            await requestBackgroundSync().catch(() => {});
+            await updatePending();
+        }
+    });
+
+    // Service Worker がバックグラウンドで同期したら表示を更新
+    if ('serviceWorker' in navigator) {
+        navigator.serviceWorker.addEventListener('message', function(event) {
+            if (event.data && event.data.type === 'logs-synced') {
+                showStatus('オフライン中に記録したログを送信しました', 'success');
+            }
+        });
+    }
+
+    window.addEventListener('online', flush);
+
+    // ログアウト前に送信待ちのログを送信し、送信できなければ確認する
+    // （ログアウトしても端末には残り、次にこのユーザーでログインしたときに送信される）
+    document.querySelectorAll('[data-logout-link]').forEach(link => {
+        link.addEventListener('click', async function(event) {
+            // await より前に止めないと、そのまま遷移してしまう
+            event.preventDefault();
+            if (navigator.onLine && await LogQueue.count(userId) > 0) {
+                await flush();
+            }
+            const pending = await LogQueue.count(userId);
+            if (pending === 0 || window.confirm(
+                `送信待ちのログが ${pending} 件あります。ログアウトしても削除されず、次にログインしたときに送信されます。ログアウトしますか？`
+            )) {
+                window.location.href = link.href;
+            }
+        });
+    });
+
+    // 前回送信できなかったログがあれば送信
+    updatePending().then(pending => {
+        if (pending > 0 && navigator.onLine) flush();
+    });
+});
@@ -1,12 +1,95 @@
+// service-worker.js - オフライン対応（/service-worker.js としてサイト全体をスコープに配信）
+//
+// ・画面遷移はネットワーク優先。オフライン時は最後に表示できた画面をキャッシュから返す
+// ・静的ファイルと CDN の CSS/JS はキャッシュを返しつつ裏で更新する
+// ・オフライン中に記録したログは Background Sync でまとめて送信する（log-queue.js）
+
+importScripts('/static/js/log-queue.js');
+
+const CACHE_NAME = 'learning-log-v2';
+const CDN_HOSTS = ['cdn.jsdelivr.net', 'cdnjs.cloudflare.com'];
+const PRECACHE_URLS = [
+  '/static/js/log-queue.js',
+  '/static/js/offline-log.js',
+  '/static/js/tagify-init.js',
+  '/static/CSS/responsive.css',
+  '/static/manifest.json',
+  '/static/icon-192.png'
+];
+
 self.addEventListener('install', function (event) {
   console.log('[Service Worker] Installed');
+  // 1件ずつキャッシュする（取得できないファイルがあってもインストールは続ける）
+  event.waitUntil(
+    caches.open(CACHE_NAME).then(cache => Promise.all(PRECACHE_URLS.map(url =>
+      cache.add(url).catch(error => console.warn('[Service Worker] Precache failed:', url, error))
+    )))
+  );
   self.skipWaiting();
 });
 
 self.addEventListener('activate', function (event) {
   console.log('[Service Worker] Activated');
+  event.waitUntil(
+    caches.keys()
+      .then(keys => Promise.all(keys.filter(key => key !== CACHE_NAME).map(key => caches.delete(key))))
+      .then(() => self.clients.claim())
+  );
 });
 
 self.addEventListener('fetch', function (event) {
-  // 通常のネットワークフェッチに任せる（今回はキャッシュなし）
+  const request = event.request;
+  if (request.method !== 'GET') return;
+
+  const url = new URL(request.url);
+
+  if (request.mode === 'navigate') {
+    event.respondWith(networkFirst(request));
+  } else if ((url.origin === self.location.origin && url.pathname.startsWith('/static/')) ||
+             CDN_HOSTS.includes(url.hostname)) {
+    event.respondWith(staleWhileRevalidate(event, request));
+  }
+  // API などはそのままネットワークへ
+});
+
+async function networkFirst(request) {
+  const cache = await caches.open(CACHE_NAME);
+  try {
+    const response = await fetch(request);
+    // ログイン画面へのリダイレクトなどはキャッシュしない
+    if (response.ok && !response.redirected) {
+      cache.put(request, response.clone());
+    }
+    return response;
+  } catch (error) {
+    return (await cache.match(request)) || (await cache.match('/')) || Response.error();
+  }
+}
+
+async function staleWhileRevalidate(event, request) {
+  const cache = await caches.open(CACHE_NAME);
+  const cached = await cache.match(request);
+  const network = fetch(request).then(response => {
+    if (response.ok || response.type === 'opaque') {
+      cache.put(request, response.clone());
+    }
+    return response;
+  });
+  if (cached) {
+    event.waitUntil(network.catch(() => {}));
+    return cached;
+  }
+  return network;
+}
+
+self.addEventListener('sync', function (event) {
+  if (event.tag !== LogQueue.SYNC_TAG) return;
+
+  event.waitUntil(
+    LogQueue.flush().then(async summary => {
+      if (summary.created + summary.duplicate + summary.invalid === 0) return;
+      const clients = await self.clients.matchAll({ type: 'window' });
+      clients.forEach(client => client.postMessage({ type: 'logs-synced', summary }));
+    })
+  );
 });
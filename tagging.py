@@ -0,0 +1,183 @@
+# tagging.py - タグの正規化と集計
+"""
+Log.tags（カンマ区切り文字列）を tags / log_tags テーブルに展開し、
+タグランキング類は GROUP BY の集計クエリで求める。
+"""
+
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
+
+from db import Log, Tag, LogTag
+
+TAG_NAME_MAX_LENGTH = 100
+
+
+def parse_tags(tags_str):
+    """カンマ区切りのタグ文字列を重複なしのタグ名リストにする（出現順を維持）"""
+    if not tags_str:
+        return []
+
+    names = []
+    for tag in tags_str.split(','):
+        tag = tag.strip()[:TAG_NAME_MAX_LENGTH]
+        if tag and tag not in names:
+            names.append(tag)
+    return names
+
+
+def get_or_create_tag_ids(session, user_id, names):
+    """タグ名 → tag_id の辞書を返す（存在しないタグは作成）"""
+    if not names:
+        return {}
+
+    dialect = session.get_bind().dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        # 同時登録で一意制約に当たっても失敗しないように ON CONFLICT DO NOTHING
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        stmt = insert(Tag).values([{'user_id': user_id, 'name': name} for name in names])
+        session.execute(stmt.on_conflict_do_nothing(index_elements=['user_id', 'name']))
+    else:
+        existing = {
+            name for (name,) in session.query(Tag.name).filter(
+                Tag.user_id == user_id, Tag.name.in_(names)
+            )
+        }
+        for name in names:
+            if name not in existing:
+                session.add(Tag(user_id=user_id, name=name))
+        session.flush()
+
+    rows = session.query(Tag.name, Tag.id).filter(
+        Tag.user_id == user_id, Tag.name.in_(names)
+    ).all()
+    return dict(rows)
+
+
+def set_log_tags(session, log, tags_str):
+    """
+    ログにタグを関連付ける（既存の関連付けは置き換え）
+    log.id が必要なので、未 flush の場合はここで flush する
+    """
+    if log.id is None:
+        session.flush()
+
+    session.query(LogTag).filter_by(log_id=log.id).delete(synchronize_session=False)
+
+    tag_ids = get_or_create_tag_ids(session, log.user_id, parse_tags(tags_str))
+    if tag_ids:
+        session.bulk_insert_mappings(LogTag, [
+            {'log_id': log.id, 'tag_id': tag_id, 'user_id': log.user_id}
+            for tag_id in tag_ids.values()
+        ])
+
+
+def add_tags_for_logs(session, user_id, log_tags):
+    """
+    新しく追加した複数ログにタグを関連付ける（一括登録用）
+    log_tags: [(log_id, タグ文字列), ...]。タグIDはまとめて解決し、関連付けは一括 INSERT
+    """
+    parsed = [(log_id, parse_tags(tags_str)) for log_id, tags_str in log_tags]
+    names = sorted({name for _, log_names in parsed for name in log_names})
+    tag_ids = get_or_create_tag_ids(session, user_id, names)
+
+    mappings = [
+        {'log_id': log_id, 'tag_id': tag_ids[name], 'user_id': user_id}
+        for log_id, log_names in parsed
+        for name in log_names
+    ]
+    if mappings:
+        session.bulk_insert_mappings(LogTag, mappings)
+
+
+def delete_user_tags(session, user_id):
+    """ユーザーのタグと関連付けを全削除"""
+    session.query(LogTag).filter_by(user_id=user_id).delete(synchronize_session=False)
+    session.query(Tag).filter_by(user_id=user_id).delete(synchronize_session=False)
+
+
+def rebuild_log_tags(session, user_id=None, batch_size=1000):
+    """
+    既存の Log.tags 文字列から tags / log_tags を作り直す
+    ログは batch_size 件ずつ読み込む。戻り値は処理したログ件数。
+    """
+    association_query = session.query(LogTag)
+    if user_id is not None:
+        association_query = association_query.filter_by(user_id=user_id)
+    association_query.delete(synchronize_session=False)
+
+    query = session.query(Log.id, Log.user_id, Log.tags).filter(
+        Log.tags.isnot(None), Log.tags != ''
+    )
+    if user_id is not None:
+        query = query.filter(Log.user_id == user_id)
+
+    processed = 0
+    last_id = 0
+    while True:
+        rows = query.filter(Log.id > last_id).order_by(Log.id).limit(batch_size).all()
+        if not rows:
+            break
+
+        # ユーザーごとにまとめてタグIDを解決
+        names_by_user = {}
+        for log_id, log_user_id, tags_str in rows:
+            names_by_user.setdefault(log_user_id, set()).update(parse_tags(tags_str))
+        tag_ids = {
+            log_user_id: get_or_create_tag_ids(session, log_user_id, sorted(names))
+            for log_user_id, names in names_by_user.items()
+        }
+
+        mappings = []
+        for log_id, log_user_id, tags_str in rows:
+            for name in parse_tags(tags_str):
+                mappings.append({
+                    'log_id': log_id,
+                    'tag_id': tag_ids[log_user_id][name],
+                    'user_id': log_user_id,
+                })
+        if mappings:
+            session.bulk_insert_mappings(LogTag, mappings)
+
+        processed += len(rows)
+        last_id = rows[-1][0]
+
+    return processed
+
+
+# ── 集計 ─────────────────────────────────────
+
+def tag_counts(session, user_id, limit=None):
+    """タグごとの使用回数を多い順に [(タグ名, 回数), ...] で返す"""
+    usage = func.count(LogTag.log_id).label('usage')
+    query = session.query(Tag.name, usage).select_from(LogTag).join(
+        Tag, Tag.id == LogTag.tag_id
+    ).filter(
+        LogTag.user_id == user_id
+    ).group_by(Tag.id, Tag.name).order_by(usage.desc(), Tag.name)
+
+    if limit:
+        query = query.limit(limit)
+    return [(name, count) for name, count in query.all()]
+
+
+def tag_minutes(session, user_id, limit=None):
+    """タグごとの作業時間合計を多い順に [(タグ名, 分), ...] で返す"""
+    minutes = func.sum(Log.duration).label('minutes')
+    query = session.query(Tag.name, minutes).select_from(LogTag).join(
+        Tag, Tag.id == LogTag.tag_id
+    ).join(
+        Log, Log.id == LogTag.log_id
+    ).filter(
+        LogTag.user_id == user_id
+    ).group_by(Tag.id, Tag.name).order_by(minutes.desc(), Tag.name)
+
+    if limit:
+        query = query.limit(limit)
+    return [(name, int(total or 0)) for name, total in query.all()]
+
+
+def used_tag_count(session, user_id):
+    """ログで使われているタグの種類数"""
+    return session.query(func.count(func.distinct(LogTag.tag_id))).filter(
+        LogTag.user_id == user_id
+    ).scalar() or 0
@@ -0,0 +1,189 @@
+# user_cache.py - Flask-Login の user_loader 用ユーザーキャッシュ
+"""
+認証済みリクエストのたびに users テーブルを読まないように、
+ユーザー情報のスナップショットをキャッシュする。
+
+・リクエスト内: flask.g にメモ
+・リクエスト間: Redis（使えない場合はプロセス内）に USER_CACHE_TTL 秒保持
+・パスワード変更・ロック・設定変更・ログ追加（data_version）で無効化する
+  無効化はコミット後に行う（コミット前に消すと、その間に読んだ古い行がキャッシュされるため）。
+  ただし、同時に実行中の別のリクエストがコミット前の行を読み、無効化の後にキャッシュすることはある。
+  その場合、古い値が残るのは最大 USER_CACHE_TTL 秒
+
+スナップショットにはパスワードハッシュを含めない。
+パスワードの照合や更新が必要な処理では、これまで通り DB から User を読み込むこと。
+"""
+
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from flask import g, has_request_context
+from sqlalchemy import event, DateTime
+
+from db import Session, User, get_request_session
+import cache
+
+USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', '60'))
+
+# スナップショットに含める列（password_hash は除外）
+SNAPSHOT_COLUMNS = [
+    column for column in User.__table__.columns if column.name != 'password_hash'
+]
+
+_local = {}
+_local_lock = threading.Lock()
+
+
+def _cache_key(user_id):
+    return f"user:v1:{user_id}"
+
+
+def _to_snapshot(user):
+    data = {}
+    for column in SNAPSHOT_COLUMNS:
+        value = getattr(user, column.key)
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        data[column.key] = value
+    return data
+
+
+def _from_snapshot(data):
+    """スナップショットからセッションに属さない User を作る"""
+    values = {}
+    for column in SNAPSHOT_COLUMNS:
+        value = data.get(column.key)
+        if value is not None and isinstance(column.type, DateTime):
+            value = datetime.fromisoformat(value)
+        values[column.key] = value
+    return User(**values)
+
+
+def _get_cached(user_id):
+    client = cache.get_redis()
+    if client is not None:
+        try:
+            raw = client.get(_cache_key(user_id))
+            return json.loads(raw) if raw else None
+        except Exception as e:
+            cache.disable_redis(e)
+    return _get_local(user_id)
+
+
+def _get_local(user_id):
+    with _local_lock:
+        entry = _local.get(user_id)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+    return None
+
+
+def _set_local(user_id, data):
+    with _local_lock:
+        _local[user_id] = (time.monotonic() + USER_CACHE_TTL, data)
+
+
+def _set_cached(user_id, data):
+    client = cache.get_redis()
+    if client is not None:
+        try:
+            client.set(_cache_key(user_id), json.dumps(data), ex=USER_CACHE_TTL)
+            return
+        except Exception as e:
+            cache.disable_redis(e)
+    _set_local(user_id, data)
+
+
+def invalidate_user(user_id):
+    """キャッシュ済みのスナップショットを削除する"""
+    with _local_lock:
+        _local.pop(user_id, None)
+
+    client = cache.get_redis()
+    if client is not None:
+        try:
+            client.delete(_cache_key(user_id))
+        except Exception as e:
+            cache.disable_redis(e)
+
+    if has_request_context():
+        g.pop('_user_snapshots', None)
+
+
+def invalidate_user_after_commit(session, user_id):
+    """session のコミット後にスナップショットを無効化する"""
+    session.info.setdefault('invalidate_user_ids', set()).add(user_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed_users(session):
+    for user_id in session.info.pop('invalidate_user_ids', ()):
+        invalidate_user(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_pending_invalidations(session):
+    session.info.pop('invalidate_user_ids', None)
+
+
+def load_user_snapshot(user_id):
+    """ユーザーを取得（リクエスト内メモ → キャッシュ → DB の順）。存在しなければ None"""
+    memo = None
+    if has_request_context():
+        memo = g.setdefault('_user_snapshots', {})
+        if user_id in memo:
+            return memo[user_id]
+
+    data = _get_cached(user_id)
+    if data is None:
+        if memo is not None:
+            # リクエスト内ではビューと同じセッション（同じ接続）を使う
+            user = get_request_session().get(User, user_id)
+        else:
+            with Session() as session:
+                user = session.get(User, user_id)
+        if user is None:
+            return None
+        data = _to_snapshot(user)
+        _set_cached(user_id, data)
+
+    user = _from_snapshot(data)
+    if memo is not None:
+        memo[user_id] = user
+    return user
+
+
+async def load_user_data_async(session, user_id):
+    """
+    asyncio 版の API（async_api.py）用: スナップショットの dict を返す（キャッシュ → DB）
+    session は AsyncSession。存在しなければ None
+    """
+    data = None
+    client = cache.get_async_redis()
+    if client is not None:
+        try:
+            raw = await client.get(_cache_key(user_id))
+            data = json.loads(raw) if raw else None
+        except Exception as e:
+            cache.disable_redis(e)
+            client = None
+    if client is None:
+        data = _get_local(user_id)
+
+    if data is None:
+        user = await session.get(User, user_id)
+        if user is None:
+            return None
+        data = _to_snapshot(user)
+        if client is not None:
+            try:
+                await client.set(_cache_key(user_id), json.dumps(data), ex=USER_CACHE_TTL)
+            except Exception as e:
+                cache.disable_redis(e)
+                _set_local(user_id, data)
+        else:
+            _set_local(user_id, data)
+    return data
@@ -0,0 +1,65 @@
+# worker.py - バックグラウンドジョブのワーカープロセス
+"""
+Procfile の worker プロセスとして起動する:  python worker.py
+
+ジョブテーブルをポーリングし、カレンダー登録やメール送信などのジョブを処理する。
+処理するジョブがない間は WORKER_POLL_INTERVAL 秒（デフォルト5秒）待機する。
+"""
+
+import os
+import signal
+import time
+
+import calendar_queue
+import calendar_backfill
+import email_utils
+import prometheus_metrics
+from google_calendar import client_manager
+
+POLL_INTERVAL = float(os.getenv('WORKER_POLL_INTERVAL', '5'))
+BATCH_SIZE = int(os.getenv('WORKER_BATCH_SIZE', '20'))
+
+# 1周ごとに呼び出す処理（戻り値は処理件数）
+PROCESSORS = [
+    ('calendar', lambda: calendar_queue.process_due_jobs(BATCH_SIZE)),
+    ('calendar_backfill', lambda: calendar_backfill.process_pending_backfills()),
+    ('email', lambda: email_utils.process_outbox()),
+]
+
+_running = True
+
+
+def _stop(signum, frame):
+    global _running
+    print(f"シグナル {signum} を受信しました。現在の処理が終わり次第停止します")
+    _running = False
+
+
+def run_once():
+    """全ての処理を1周実行し、合計処理件数を返す"""
+    processed = 0
+    for name, processor in PROCESSORS:
+        try:
+            processed += processor()
+        except Exception as e:
+            print(f"ワーカー処理エラー ({name}): {type(e).__name__}: {e}")
+    return processed
+
+
+def main():
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    prometheus_metrics.start_worker_server()
+    print(f"ワーカーを起動しました（ポーリング間隔 {POLL_INTERVAL} 秒）")
+    while _running:
+        # ジョブがあった場合はすぐに次を取りに行く
+        if run_once() == 0:
+            time.sleep(POLL_INTERVAL)
+    email_utils.get_connection().close()
+    print(f"Calendar API 統計: {client_manager.stats()}")
+    print("ワーカーを停止しました")
+
+
+if __name__ == '__main__':
+    main()